@@ -1,22 +1,74 @@
-# noinspection PyPep8Naming
-from __builtin__ import xrange
 import maya.api.OpenMaya as Om2
+import maya.OpenMaya as Om1
 import pymel.core as pm
 import maya.cmds as cm
+import maya.mel as mel
+import ctypes
+import json
+import os
 import time
+import numpy as np
+
+from subdivCache import OperatorCache
+from subdivIO import PointIO , writeObj
+from subdivJournal import Journal , MeshState , pendingJournals , unjournaledData
+from subdivParallel import MESH_PHASES , PoolUnavailable , poolMap , reconstructArrays , reconstructMesh , workerCount
+from subdivProfile import Profiler , aggregateReports , getProfiler , profiling
+from subdivProgress import Cancelled , Progress , getProgress , progressing
+from subdivRegion import Region , selectionFaces
+from subdivSolve import CoarseFit
+from subdivTopology import preflight
+
+JOURNAL_PLUGIN = 'reconstructSubdivJournal'
+
+
+# noinspection PyCallByClass
+class MayaPointBackend(object):
+
+    def __init__(self , mDag):
+        self.mDag = mDag
+
+    def getRawPointBuffer(self):
+        # Zero-copy view on the mesh's internal float points (API 1.0), only valid until the mesh changes
+        tmpSel = Om1.MSelectionList()
+        tmpSel.add(self.mDag.fullPathName())
+        dag = Om1.MDagPath()
+        tmpSel.getDagPath(0 , dag)
+        mfnMesh = Om1.MFnMesh(dag)
+        address = int(mfnMesh.getRawPoints())
+        pointer = ctypes.cast(address , ctypes.POINTER(ctypes.c_float))
+        return np.ctypeslib.as_array(pointer , shape=(mfnMesh.numVertices() , 3))
+
+    def getPointBuffer(self):
+        try:
+            points = self.getRawPointBuffer().astype(np.float64)
+            getProfiler().count('rawPointReads')
+            return points
+        except (TypeError , ValueError , RuntimeError):
+            getProfiler().count('apiPointReads')
+            return np.array(Om2.MFnMesh(self.mDag).getPoints(Om2.MSpace.kObject) , dtype=np.float64)
+
+    def setPointBuffer(self , points):
+        Om2.MFnMesh(self.mDag).setPoints(Om2.MPointArray(points.tolist()) , Om2.MSpace.kObject)
 
 
 # noinspection SpellCheckingInspection,PyCallByClass,PyAttributeOutsideInit,PyMethodMayBeStatic,PyUnusedLocal
 class ReconstructSubdiv(object):
 
     def __init__(self):
-        self.mayaVersion = cm.about(version=True)
-        self.mayaOldVersions = ['2014' , '2015' , '2016' , '2017' , '2018' , '2019']
         self.reverse = False
         self.keepOrig = True
         self.curvature = True
         self.sharpCorners = True
+        self.rebuild = False
+        self.levels = 1
         self.showProgress = True
+        self.profile = False
+        self.fit = None
+        self.region = None
+        self.jobs = 0
+        self.profileReports = []
+        self.cache = OperatorCache()
         self.clrs = {
             'orange': (0.85882 , 0.58039 , 0.33725) ,
             'red': (1 , 0.353 , 0.353) ,
@@ -27,274 +79,167 @@ class ReconstructSubdiv(object):
             pm.deleteUI('RecostructWin')
         self.RecostructUI()
 
-    def checkForNonQuad(self , Dag):
-        badFaces = Om2.MSelectionList()
-        meshIt = Om2.MItMeshPolygon(Dag)
-        if self.mayaVersion not in self.mayaOldVersions:
-            while not meshIt.isDone():
-                if meshIt.polygonVertexCount() != 4:
-                    badFaces.add((Dag , meshIt.currentItem()))
-                meshIt.next()
+    def checkForNonQuad(self , Dag , components=None):
+        mfnMesh = Om2.MFnMesh(Dag)
+        faceCounts , faceIndices = mfnMesh.getVertices()
+        if components is None:
+            report = preflight(faceCounts , faceIndices , mfnMesh.numVertices)
+            region = None
+            nonQuadFaces = report.nonQuadFaces
         else:
-            while not meshIt.isDone():
-                if meshIt.polygonVertexCount() != 4:
-                    badFaces.add((Dag , meshIt.currentItem()))
-                meshIt.next(None)
-
-        if badFaces.isEmpty():
+            # Only the selected faces have to be quads, the rest of the mesh is not checked
+            report = None
+            region = Region(faceCounts , faceIndices , mfnMesh.numVertices ,
+                            selectionFaces(faceCounts , faceIndices , mfnMesh.numVertices , *components))
+            nonQuadFaces = region.nonQuadFaces
+        self.reports.append(report)
+        self.regions.append(region)
+
+        if not len(nonQuadFaces):
             return True
         else:
+            message = (report or region.report).message()
+            faceComponent = Om2.MFnSingleIndexedComponent()
+            components = faceComponent.create(Om2.MFn.kMeshPolygonComponent)
+            faceComponent.addElements(nonQuadFaces.tolist())
+            badFaces = Om2.MSelectionList()
+            badFaces.add((Dag , components))
             Om2.MGlobal.setActiveSelectionList(badFaces)
             pm.textField('meshes' , edit=True , ip=1 , bgc=self.clrs['red'] ,
-                         text='Unable to reconstruct! Found non quad face(s) in mesh: "{0}"!'.format(Dag))
-            cm.error('Unable to reconstruct! Found non quad face(s) in "{0}"!'.format(Dag))
+                         text='Unable to reconstruct! {0} in mesh: "{1}"!'.format(message , Dag))
+            cm.error('Unable to reconstruct! {0} in "{1}"!'.format(message , Dag))
             return False
 
     def getVtxPositions(self):
-        vtxComponent = Om2.MFnSingleIndexedComponent()
-        vtxComponent.create(Om2.MFn.kMeshVertComponent)
-        vtxComponent.addElements(self.vtxIdArray)
-        vtxIterator = Om2.MItMeshVertex(self.mDag , vtxComponent.object())
-        while not vtxIterator.isDone():
-            self.vtxPositions[int(vtxIterator.index())] = vtxIterator.position(Om2.MSpace.kWorld)
-            vtxIterator.next()
+        self.pointIO = PointIO(MayaPointBackend(self.mDag))
+        self.vtxPositions = self.pointIO.read()
         return self.vtxPositions
 
-    def getStartVertex(self , vtxIdArray):
-
-        vtxComponent = Om2.MFnSingleIndexedComponent()
-        vtxComponent.create(Om2.MFn.kMeshVertComponent)
-        vtxComponent.addElements(vtxIdArray)
-
-        vtxIterator = Om2.MItMeshVertex(self.mDag , vtxComponent.object())
-
-        vtxValence_2 = -1
-        vtxValence_n = -1
-        vtxValence_3 = -1
-        vtxBorderValence_3 = -1
-
-        while not vtxIterator.isDone():
-            vtxId = int(vtxIterator.index())
-            numEdges = vtxIterator.numConnectedEdges()
-            onBoundary = vtxIterator.onBoundary()
-            if onBoundary:
-                self.vtxBoundary = self.vtxBoundary.union([vtxId])
-
-            if vtxValence_2 == -1 and numEdges == 2:
-                vtxValence_2 = vtxId
-
-            elif vtxValence_n == -1 and numEdges > 4:
-                vtxValence_n = vtxId
-
-            elif vtxValence_3 == -1 and numEdges == 3 and not onBoundary:
-                vtxValence_3 = vtxId
-
-            elif vtxBorderValence_3 == -1 and numEdges == 3 and onBoundary:
-                vtxBorderValence_3 = vtxId
-
-            vtxIterator.next()
-
-        if vtxValence_2 != -1:
-            return vtxValence_2
-
-        elif vtxValence_n != -1:
-            return vtxValence_n
-
-        elif vtxValence_3 != -1:
-            return vtxValence_3
-
-        elif vtxBorderValence_3 != -1:
-            return vtxBorderValence_3
-
-        else:
-            return 0
-
-    def getNearComponents(self , vtxId , diagonal=0 , edgesConnected=0):
-        vtxComponent = Om2.MFnSingleIndexedComponent()
-        vtxComponent.create(Om2.MFn.kMeshVertComponent)
-        vtxComponent.addElement(vtxId)
-
-        vtxIterator = Om2.MItMeshVertex(self.mDag , vtxComponent.object())
-
-        if edgesConnected:
-            return set(vtxIterator.getConnectedEdges())
-
-        vtxConnected = set(vtxIterator.getConnectedVertices())
-
-        if not diagonal:
-            return vtxConnected
-
-        facesConnected = vtxIterator.getConnectedFaces()
-
-        vtxAround = set()
-        for f in facesConnected:
-            faceComponent = Om2.MFnSingleIndexedComponent()
-            faceComponent.create(Om2.MFn.kMeshPolygonComponent)
-            faceComponent.addElement(f)
-
-            faceIterator = Om2.MItMeshPolygon(self.mDag , faceComponent.object())
-            vtxOfFace = faceIterator.getVertices()
-            for vf in vtxOfFace:
-                vtxAround.add(vf)
-
-        vtxAround.remove(vtxId)
-        vtxDiagonal = vtxAround - vtxConnected
-        return vtxDiagonal
-
-    def getOverVertices(self , vtxIds):
-        result = set()
-        for vtxId in vtxIds:
-            vtxGrow = set()
-            vtxConnected = self.getNearComponents(vtxId)
-            self.vtxDict[vtxId] = {
-                'connected': {
-                    k: None for k in vtxConnected
-                }
-            }
-            vtxDiagonal = self.getNearComponents(vtxId , diagonal=True)
-            self.vtxDict[vtxId]['diagonal'] = vtxDiagonal
-
-            for v in vtxConnected:
-                vtxConnected2 = self.getNearComponents(v)
-                self.vtxDict[vtxId]['connected'][v] = vtxConnected2
-                vtxGrow = vtxGrow.union(vtxConnected2)
-
-            vtxOver = vtxGrow - vtxDiagonal
-            result = result.union(vtxOver)
-
-        return result
-
-    def vtxSearch(self , vtxStart):
-        vtxPrev = [vtxStart]
-        while True:
-            vtxNext = (self.getOverVertices(vtxPrev) - set(self.vtxDict))
-            if not vtxNext:
-                return
-            vtxPrev = vtxNext
-
-    def vtxSearchProgress(self , vtxStart):
-        vtxPrev = [vtxStart]
-        while True:
-            vtxNext = (self.getOverVertices(vtxPrev) - set(self.vtxDict))
-            if not vtxNext:
-                return
-            vtxPrev = vtxNext
-
-            for v in vtxPrev:
-                self.progress_current += self.progress_step
-                pm.progressBar('progress' , edit=True , progress=round(self.progress_current))
-
-    # noinspection PyTypeChecker
-    def getAvaraveragePositions(self , points , plus=False):
-        vector = Om2.MVector()
-        for p in points:
-            vector += Om2.MVector(self.vtxPositions[p])
-        if plus:
-            return vector
-        return vector / len(points)
-
-    # noinspection PyTypeChecker
-    def getCurvature(self):
-        # Calculate boundary vtx
-        vtxBoundary = self.vtxBoundary & set(self.vtxDict)
-        for v in list(vtxBoundary):
-            n = len(self.vtxDict[v]['connected'])
-            if self.sharpCorners:
-                if n == 2:
-                    continue
-            ek1 = tuple(set(self.vtxDict[v]['connected']) & self.vtxBoundary)
-            e0k1 = Om2.MVector(self.vtxPositions[ek1[0]])
-            e1k1 = Om2.MVector(self.vtxPositions[ek1[1]])
-            vk1 = Om2.MVector(self.vtxPositions[v])
-
-            vk = -(0.5 * e0k1) + (2 * vk1) - (0.5 * e1k1)
-            self.vtxPositionsNew[v] = vk
-
-        # Calculate not boundary vtx with connected edges n >= 4
-        vtxNotBoundary = list(set(self.vtxDict) - vtxBoundary)
-        for v in vtxNotBoundary:
-            n = len(self.vtxDict[v]['connected'])
-            if n >= 4:
-                A = n / (n - 3.0)
-                B = -4.0 / (n * (n - 3.0))
-                Y = 1.0 / (n * (n - 3.0))
-
-                vk1 = Om2.MVector(self.vtxPositions[v])
-                Average_ek1 = self.getAvaraveragePositions(self.vtxDict[v]['connected'] , plus=True)
-                Average_fk1 = self.getAvaraveragePositions(self.vtxDict[v]['diagonal'] , plus=True)
-
-                vk = A * vk1 + B * Average_ek1 + Y * Average_fk1
-                self.vtxPositionsNew[v] = vk
-
-        # Calculate not boundary vtx with connected edges n == 3
-        for v in vtxNotBoundary:
-            n = len(self.vtxDict[v]['connected'])
-            if n == 3:
-                for v1 in self.vtxDict[v]['connected']:
-                    vk_near = (self.vtxDict[v]['connected'][v1] - self.vtxDict[v]['diagonal'] - {v})
-                    if vk_near:
-                        vk_near = int(vk_near.pop())
-
-                        if vk_near in self.vtxPositionsNew and vk_near not in self.vtxBoundary:
-                            ek = Om2.MVector(self.vtxPositionsNew[vk_near])
-                            ek1 = Om2.MVector(self.vtxPositions[v1])
-                            fk1 = tuple(self.vtxDict[v]['connected'][v1] & self.vtxDict[v]['diagonal'])
-                            f0k1 = Om2.MVector(self.vtxPositions[fk1[0]])
-                            f1k1 = Om2.MVector(self.vtxPositions[fk1[1]])
-
-                            vk = 4 * ek1 - ek - f1k1 - f0k1
-                            self.vtxPositionsNew[v] = vk
-                            break
-
-        # Calculate one more time not boundary vtx with connected edges n == 3
-        for v in set(vtxNotBoundary) - set(self.vtxPositionsNew):
-            n = len(self.vtxDict[v]['connected'])
-            if n == 3:
-                for v1 in self.vtxDict[v]['connected']:
-                    vk_near = (self.vtxDict[v]['connected'][v1] - self.vtxDict[v]['diagonal'] - [v])
-                    if vk_near:
-                        vk_near = int(vk_near.pop())
-
-                        if vk_near in self.vtxPositionsNew and vk_near not in self.vtxBoundary:
-                            ek = Om2.MVector(self.vtxPositionsNew[vk_near])
-                            ek1 = Om2.MVector(self.vtxPositions[v1])
-                            fk1 = tuple(self.vtxDict[v]['connected'][v1] & self.vtxDict[v]['diagonal'])
-                            f0k1 = Om2.MVector(self.vtxPositions[fk1[0]])
-                            f1k1 = Om2.MVector(self.vtxPositions[fk1[1]])
-
-                            vk = 4 * ek1 - ek - f1k1 - f0k1
-                            self.vtxPositionsNew[v] = vk
-                            break
-
-        vtxPositionsUpdated = self.vtxPositions
-        for k , v in self.vtxPositionsNew.iteritems():
-            vtxPositionsUpdated[k] = v
-        self.vtxPositionsNew = vtxPositionsUpdated
-
     def moveVtx(self):
-        mfnMesh = Om2.MFnMesh(self.mDag)
-        array = Om2.MFloatPointArray()
-        for k in sorted(self.vtxPositionsNew):
-            array.append(Om2.MFloatPoint(self.vtxPositionsNew[k]))
-        mfnMesh.setPoints(array , space=Om2.MSpace.kWorld)
+        PointIO(MayaPointBackend(self.mDag)).write(self.vtxPositionsNew)
 
     def edgeDelete(self , vtxs):
-        edgeIds = []
-        for v in vtxs:
-            for e in self.getNearComponents(v , edgesConnected=1):
-                edgeIds.append(e)
-
-        edgeIds = set(edgeIds)
+        with getProfiler().phase('edgeDelete'):
+            self.deleteEdges(vtxs)
 
-        edgeComponent = Om2.MFnSingleIndexedComponent()
-        components = edgeComponent.create(Om2.MFn.kMeshEdgeComponent)
-        map(edgeComponent.addElement , edgeIds)
-
-        edgeSel = Om2.MSelectionList()
-        edgeSel.add((self.mDag , components))
-        Om2.MGlobal.setActiveSelectionList(edgeSel)
+    def deleteEdges(self , vtxs):
+        vtxComponent = Om2.MFnSingleIndexedComponent()
+        components = vtxComponent.create(Om2.MFn.kMeshVertComponent)
+        vtxComponent.addElements(sorted(set(vtxs)))
+
+        vtxSel = Om2.MSelectionList()
+        vtxSel.add((self.mDag , components))
+        Om2.MGlobal.setActiveSelectionList(vtxSel)
+        edges = cm.polyListComponentConversion(cm.ls(sl=True) , fromVertex=True , toEdge=True)
+        cm.select(edges , replace=True)
         cm.polyDelEdge(cv=True , ch=False)
 
+    def createCoarseMesh(self , mfnMesh , points , faceCounts , faceIndices , fineCorners , fineFaceCounts):
+        uvSet = mfnMesh.currentUVSetName()
+        uvCounts , uvIds = mfnMesh.getAssignedUVs(uvSet)
+        uvCounts = np.array(uvCounts , dtype=np.int64)
+        us , vs = mfnMesh.getUVs(uvSet)
+
+        mfnMesh.createInPlace(Om2.MPointArray(points.tolist()) , faceCounts.tolist() , faceIndices.tolist())
+
+        # Carry the current UV set over when every face has UVs, each coarse corner keeps its fine corner's UV
+        if len(uvCounts) and (uvCounts == fineFaceCounts).all():
+            uvIds = np.array(uvIds , dtype=np.int64)
+            uvSet = mfnMesh.currentUVSetName()
+            mfnMesh.setUVs(us , vs , uvSet)
+            mfnMesh.assignUVs(faceCounts.tolist() , uvIds[fineCorners].tolist() , uvSet)
+
+    def rebuildMesh(self , coarse , fineFaceCounts):
+        with getProfiler().phase('rebuild'):
+            self.createCoarseMesh(Om2.MFnMesh(self.mDag) , *(tuple(coarse) + (fineFaceCounts ,)))
+
+    def getReconstruction(self , report):
+        # Classification and sparse operator of a topology, shared by all meshes (targets, frames) that have it
+        topology = report.topology
+        return self.cache.get(topology.faceCounts , topology.faceIndices , topology.vtxCount , self.levels ,
+                              self.reverse , self.curvature , self.sharpCorners)
+
+    def computeTarget(self):
+        # Blendshape targets of one base: every mesh is one sparse product once its topology has been seen
+        progress = getProgress()
+        progress.begin('operator')
+        with getProfiler().phase('operator'):
+            entry = self.getReconstruction(self.report)
+        progress.begin('read')
+        points = entry.apply(self.getVtxPositions())
+        progress.begin('rebuild')
+        return {'coarse': (points , entry.faceCounts , entry.faceIndices , entry.fineCorners) ,
+                'fineFaceCounts': self.report.topology.faceCounts}
+
+    def reconstructTargets(self):
+        self.run(self.computeTarget , self.commit , ('validation' , 'operator' , 'read' , 'rebuild'))
+        print('Operator cache: {0} hit(s), {1} miss(es)'.format(self.cache.hits , self.cache.misses))
+
+    def computeFrames(self , startFrame , endFrame):
+        # Points of every frame of the time range go through one sparse product
+        frames = list(range(int(startFrame) , int(endFrame) + 1))
+        current = cm.currentTime(q=True)
+        pointSets = []
+        progress = getProgress()
+        progress.begin('read')
+        self.pointIO = PointIO(MayaPointBackend(self.mDag))
+        try:
+            for frame in frames:
+                cm.currentTime(frame , update=True)
+                pointSets.append(self.pointIO.read())
+                progress.update(len(pointSets) / float(len(frames)))
+        finally:
+            cm.currentTime(current , update=True)
+
+        progress.begin('operator')
+        with getProfiler().phase('operator'):
+            entry = self.getReconstruction(self.report)
+        progress.begin('write')
+        return frames , entry , entry.applyMany(pointSets)
+
+    def writeFrames(self , result , outDir):
+        # Coarse mesh of every frame as name.####.obj
+        frames , entry , pointSets = result
+        name = self.mDag.partialPathName().replace('|' , '_').replace(':' , '_')
+        for frame , points in zip(frames , pointSets):
+            writeObj(os.path.join(outDir , '{0}.{1:04d}.obj'.format(name , frame)) , points , entry.faceCounts ,
+                     entry.faceIndices)
+
+    def reconstructFrames(self , startFrame , endFrame , outDir):
+        # Returns face counts, face indices and the coarse points of every frame
+        result = self.computeFrames(startFrame , endFrame)
+        self.writeFrames(result , outDir)
+        return result[1].faceCounts , result[1].faceIndices , result[2]
+
+    def loadJournal(self):
+        # In place changes are undone through the command of reconstructSubdivJournal.py, next to this file
+        if not cm.pluginInfo(JOURNAL_PLUGIN + '.py' , q=True , loaded=True):
+            try:
+                cm.loadPlugin(os.path.join(os.path.dirname(os.path.abspath(__file__)) , JOURNAL_PLUGIN + '.py') ,
+                              quiet=True)
+            except RuntimeError as e:
+                print('No undo journal, reconstructing in place without undo: {0}'.format(e))
+                return False
+        return True
+
+    def unjournaled(self):
+        lost = set()
+        for obj in self.mDags:
+            lost.update(unjournaledData(Om2.MFnMesh(obj)))
+        return sorted(lost)
+
+    def readState(self , mDag):
+        return MeshState.read(Om2.MFnMesh(mDag) , PointIO(MayaPointBackend(mDag)).read())
+
+    def recordJournal(self , before):
+        # One undo step for all meshes, holding compressed arrays instead of a second copy of every mesh
+        journal = Journal()
+        for obj , state in zip(self.mDags , before):
+            journal.add(obj.fullPathName() , state , self.readState(obj))
+        pendingJournals.append(journal)
+        getattr(cm , JOURNAL_PLUGIN)()
+        print(journal.message())
+
     def makeDuplicates(self):
         duplicates = []
         for i in range(len(self.mDags)):
@@ -310,59 +255,123 @@ class ReconstructSubdiv(object):
         translate = (bbox[3] - bbox[0]) * 1.1
         cm.move(translate , 0 , 0 , duplicates , r=1)
 
-    def reconstruct(self):
-        self.vtxDict = {
-
-        }
-        self.vtxPositions = {
-
-        }
-        self.vtxPositionsNew = {
-
+    def meshJob(self , local=True):
+        # Arrays and options of the current mesh for subdivParallel.reconstructArrays. Local jobs also carry the
+        # validation already done, jobs for worker processes only what pickles cheaply.
+        region = self.region
+        topology = None if region else self.report.topology
+        job = {
+            'name': self.mDag.fullPathName() ,
+            'faceCounts': region.faceCounts if region else topology.faceCounts ,
+            'faceIndices': region.faceIndices if region else topology.faceIndices ,
+            'points': self.getVtxPositions() ,
+            'faceIds': region.faceIds if region else None ,
+            'levels': self.levels ,
+            'reverse': self.reverse ,
+            'curvature': self.curvature ,
+            'sharpCorners': self.sharpCorners ,
+            'rebuild': self.rebuild ,
+            'fit': self.fit ,
+            'profile': self.profile
         }
-        self.vtxBoundary = set()
-        self.vtxCount = cm.polyEvaluate(self.mDag , v=True)
-        self.vtxIdArray = xrange(self.vtxCount)
-        self.vtxMax = self.vtxCount / 4.0
-        self.progress_step = 1.0 / self.vtxMax * 100
-        self.progress_current = 0
-
-        self.getVtxPositions()
-
-        if not self.reverse:
-            vtxStart = self.getStartVertex(self.vtxIdArray)
-        else:
-            vtxStart = self.getNearComponents(self.getStartVertex(self.vtxIdArray) , diagonal=True).pop()
-
-        print('Searching vertices...')
+        if local:
+            job['report'] = self.report
+            job['region'] = region
+        return job
+
+    def checked(self , result):
+        # Stops before anything in the scene changes when a mesh could not be reconstructed
+        for message in result.get('messages' , ()):
+            print(message)
+        if result.get('error'):
+            pm.textField('meshes' , edit=True , ip=1 , bgc=self.clrs['red'] ,
+                         text='Unable to reconstruct! {0}: "{1}"!'.format(result['error'] , self.mDag))
+            cm.error('Unable to reconstruct! {0}: "{1}"!'.format(result['error'] , self.mDag))
+        return result
 
-        if self.showProgress:
-            self.vtxSearchProgress(vtxStart)
-        else:
-            self.vtxSearch(vtxStart)
+    def compute(self):
+        # Everything up to the new points and polygons, the scene is not touched yet
+        getProgress().begin('read')
+        print('Recostructing...')
+        return self.checked(reconstructArrays(self.meshJob()))
+
+    def computeParallel(self):
+        # All meshes are read first, then reconstructed in worker processes and written back one by one later.
+        # Whatever the pool could not do runs here.
+        progress = getProgress()
+        jobs = []
+        for id_vtx in range(len(self.mDags)):
+            self.setCurrent(id_vtx)
+            progress.begin('read')
+            with profiling(self.profilers[id_vtx]):
+                jobs.append(self.meshJob(local=False))
+            progress.end()
+
+        print('Recostructing {0} meshes in worker processes...'.format(len(jobs)))
+        results = [None] * len(jobs)
+        try:
+            for id_vtx , result in poolMap(reconstructMesh , jobs , self.jobs , progress.update):
+                self.setCurrent(id_vtx)
+                if self.profile:
+                    self.profilers[id_vtx].merge(result.pop('profile'))
+                results[id_vtx] = self.checked(result)
+                progress.complete(MESH_PHASES)
+        except PoolUnavailable as e:
+            print('No worker processes ({0}), reconstructing here'.format(e))
+
+        for id_vtx , job in enumerate(jobs):
+            if results[id_vtx] is None:
+                self.setCurrent(id_vtx)
+                with profiling(self.profilers[id_vtx]):
+                    results[id_vtx] = self.checked(reconstructArrays(job))
+        return results
+
+    def setCurrent(self , id_vtx):
+        self.mDag = self.mDags[id_vtx]
+        self.report = self.reports[id_vtx]
+        self.region = self.regions[id_vtx]
+
+    def commit(self , result):
+        if 'coarse' in result:
+            print('Rebuilding mesh...')
+            self.rebuildMesh(result['coarse'] , result['fineFaceCounts'])
+            return
 
-        if self.curvature:
-            print('Recostructing curvature...')
-            self.getCurvature()
+        if result['points'] is not None:
+            self.vtxPositionsNew = result['points']
             self.moveVtx()
 
         print('Deleting edges...')
 
-        self.edgeDelete(j for i in self.vtxDict for j in self.vtxDict[i]['diagonal'])
+        self.edgeDelete(result['vtxFace'].tolist())
 
-    def separate(self):
-        for i in range(len(self.mDags)):
-            shellCount = cm.polyEvaluate(self.mDags[i] , shell=True)
-            if shellCount > 1:
-                separatedObj = cm.polySeparate(self.mDags[i] , ch=False)
-                tmpSel = Om2.MSelectionList()
-                self.mDags[i] = [self.mDags[i]]
-                for obj in separatedObj:
-                    tmpSel.clear()
-                    tmpSel.add(obj)
-                    self.mDags[i].append(tmpSel.getDagPath(0))
-
-    def getObjects(self):
+    def reconstruct(self):
+        self.commit(self.compute())
+
+    def getComponents(self):
+        # Selected faces and vertices of every object: {path: (face ids , vertex ids)}
+        selection = Om2.MGlobal.getActiveSelectionList()
+        components = {}
+        for i in range(selection.length()):
+            # Shading groups, sets and other nodes without a DAG path can be selected too
+            try:
+                dag , component = selection.getComponent(i)
+            except TypeError:
+                continue
+            if component.isNull() or component.apiType() not in (Om2.MFn.kMeshPolygonComponent ,
+                                                                  Om2.MFn.kMeshVertComponent):
+                continue
+            if dag.apiType() == Om2.MFn.kMesh:
+                dag.pop()
+            faceIds , vtxIds = components.setdefault(dag.fullPathName() , ([] , []))
+            elements = Om2.MFnSingleIndexedComponent(component).getElements()
+            if component.apiType() == Om2.MFn.kMeshPolygonComponent:
+                faceIds.extend(elements)
+            else:
+                vtxIds.extend(elements)
+        return components
+
+    def getObjects(self , regions=False):
         shapes = [i.split('|')[:-1] for i in cm.ls(sl=True , dag=True , l=True , s=True)]
         objects = []
         for i in shapes:
@@ -370,67 +379,168 @@ class ReconstructSubdiv(object):
             for j in i[1:]:
                 string += '|{0}'.format(j)
             objects.append(string)
+
+        # Objects with selected components only get their region reconstructed
+        self.components = self.getComponents()
+        for obj in sorted(self.components):
+            if obj not in objects:
+                objects.append(obj)
+        if not regions:
+            self.components = {}
         if objects:
             return objects
         else:
             return False
 
-    def Main(self):
-        start = time.time()
+    def prepare(self , regions=False):
         print('Preparing...')
         self.mSel = Om2.MSelectionList()
-        objects = self.getObjects()
+        self.reports = []
+        self.regions = []
+        self.profilers = []
+        objects = self.getObjects(regions)
         if not objects:
             self.uiClear()
             pm.textField('meshes' , edit=True , bgc=self.clrs['red'] , text='No object(s) selected!')
             cm.error('No object(s) selected!')
-            return
+            return False
         else:
             self.mDags = []
             mDagBackup = []
+            progress = getProgress()
+            progress.setItems(len(objects))
             for i in range(len(objects)):
                 self.mSel.add(objects[i])
                 self.mDags.append(self.mSel.getDagPath(i))
                 mDagBackup.append(self.mSel.getDagPath(i))
-                if not self.checkForNonQuad(self.mDags[i]):
+                self.profilers.append(Profiler(objects[i]) if self.profile else None)
+                progress.begin('validation')
+                with profiling(self.profilers[i]):
+                    if not self.checkForNonQuad(self.mDags[i] , self.components.get(objects[i])):
+                        return False
+        return mDagBackup
+
+    def beginProgress(self , phases):
+        # Esc on Maya's main progress bar cancels, the window's bar shows the same percentage
+        self.mainProgressBar = mel.eval('$tmp = $gMainProgressBar')
+        cm.progressBar(self.mainProgressBar , edit=True , beginProgress=True , isInterruptable=True ,
+                       status='Recostructing (Esc to cancel)...' , maxValue=100)
+        return Progress(1 , phases , self.setProgress if self.showProgress else None , self.isCancelled)
+
+    def setProgress(self , percent , phase):
+        pm.progressBar('progress' , edit=True , progress=int(percent))
+        cm.progressBar(self.mainProgressBar , edit=True , progress=int(percent) ,
+                       status='Recostructing: {0} (Esc to cancel)'.format(phase))
+
+    def isCancelled(self):
+        return cm.progressBar(self.mainProgressBar , q=True , isCancelled=True)
+
+    def endProgress(self):
+        cm.progressBar(self.mainProgressBar , edit=True , endProgress=True)
+
+    def run(self , compute , commit , phases , duplicate=True , regions=False , parallel=False):
+        # Compute every mesh first (cancellable, nothing changed yet), then duplicate and write them all.
+        # With regions, objects with selected faces or vertices only reconstruct those. With parallel, several
+        # meshes are computed in worker processes (computeParallel).
+        start = time.time()
+        progress = self.beginProgress(phases)
+        results = []
+        try:
+            with progressing(progress):
+                mDagBackup = self.prepare(regions)
+                if not mDagBackup:
                     return
-
-        if self.keepOrig:
-            self.makeDuplicates()
-
-        self.separate()
-
-        for id_vtx , obj in enumerate(self.mDags):
-            if isinstance(obj , list):
-                for id2 , subObj in enumerate(obj[1:]):
-                    self.mDag = subObj
+                if parallel and workerCount(self.jobs , len(self.mDags)) > 1:
                     pm.textField('meshes' , edit=True , bgc=self.clrs['grey'] ,
-                                 text='Recostrucing: "{0}"'.format(mDagBackup[id_vtx]))
-                    pm.text('meshesNum' , edit=True ,
-                            label='Submesh: {2}/{3}\nMesh: {0}/{1}'.format(id_vtx + 1 , len(self.mDags) , id2 + 1 ,
-                                                                           len(obj[1:])))
-                    self.reconstruct()
-            else:
-                self.mDag = obj
-                pm.textField('meshes' , edit=True , bgc=self.clrs['grey'] ,
-                             text='Recostrucing: "{0}"'.format(mDagBackup[id_vtx]))
-                pm.text('meshesNum' , edit=True , label='Mesh: {0}/{1}'.format(id_vtx + 1 , len(self.mDags)))
-                self.reconstruct()
+                                 text='Recostrucing {0} meshes...'.format(len(self.mDags)))
+                    results = self.computeParallel()
+                else:
+                    for id_vtx in range(len(self.mDags)):
+                        self.setCurrent(id_vtx)
+                        pm.textField('meshes' , edit=True , bgc=self.clrs['grey'] ,
+                                     text='Recostrucing: "{0}"'.format(mDagBackup[id_vtx]))
+                        pm.text('meshesNum' , edit=True , label='Mesh: {0}/{1}'.format(id_vtx + 1 , len(self.mDags)))
+                        with profiling(self.profilers[id_vtx]):
+                            results.append(compute())
+        except Cancelled:
+            self.uiClear()
+            pm.textField('meshes' , edit=True , bgc=self.clrs['red'] , text='Cancelled, nothing was changed')
+            print('Cancelled, nothing was changed')
+            return
+        finally:
+            self.endProgress()
+
+        # In place the changes themselves are not recorded, the journal command is the undo step. With undo turned
+        # off there is nothing to record, meshes with data the journal cannot restore keep their original instead.
+        keepOrig = self.keepOrig
+        undoState = cm.undoInfo(q=True , state=True)
+        journal = duplicate and not keepOrig and undoState and self.loadJournal()
+        if journal:
+            lost = self.unjournaled()
+            if lost:
+                print('Undo would lose the {0}, keeping the original mesh(es) instead'.format(', '.join(lost)))
+                journal = False
+                keepOrig = True
+        if duplicate and keepOrig:
+            self.makeDuplicates()
 
+        if journal:
+            before = [self.readState(obj) for obj in self.mDags]
+            cm.undoInfo(stateWithoutFlush=False)
+        try:
+            for id_vtx in range(len(self.mDags)):
+                self.setCurrent(id_vtx)
+                with profiling(self.profilers[id_vtx]):
+                    commit(results[id_vtx])
+        finally:
+            if journal:
+                cm.undoInfo(stateWithoutFlush=undoState)
+        if journal:
+            self.recordJournal(before)
+
+        self.done(start)
+
+    def done(self , start):
         Om2.MGlobal.setActiveSelectionList(self.mSel)
 
+        if self.profile:
+            self.profileReports = [profiler.report() for profiler in self.profilers]
+            for profiler in self.profilers:
+                print(profiler.message())
+            print(json.dumps(aggregateReports(self.profileReports) , sort_keys=True))
+
         end = time.time() - start
         self.uiClear()
         pm.text('meshesNum' , edit=True , label='Time spent: {0} sec'.format(round(end , 4)))
         pm.textField('meshes' , edit=True , bgc=self.clrs['orange'] , text='Done!')
         print('Done!')
 
+    def Main(self):
+        self.run(self.compute , self.commit , ('validation' , 'read' , 'adjacency' , 'search' , 'curvature' ,
+                                               'rebuild') , regions=True , parallel=True)
+
+    def MainTargets(self):
+        self.reconstructTargets()
+
+    def MainFrames(self):
+        outDir = cm.fileDialog2(fileMode=3 , caption='Frames output directory')
+        if not outDir:
+            return
+        startFrame = cm.playbackOptions(q=True , minTime=True)
+        endFrame = cm.playbackOptions(q=True , maxTime=True)
+        self.run(lambda: self.computeFrames(startFrame , endFrame) ,
+                 lambda result: self.writeFrames(result , outDir[0]) ,
+                 ('validation' , 'read' , 'operator' , 'write') , duplicate=False)
+
     def reverse_True(self):
         self.reverse = True
 
     def reverse_False(self):
         self.reverse = False
 
+    def reverse_Auto(self):
+        self.reverse = None
+
     def keepOrig_True(self):
         self.keepOrig = True
 
@@ -443,13 +553,33 @@ class ReconstructSubdiv(object):
     def sharpCorners_False(self):
         self.sharpCorners = False
 
+    def rebuild_True(self):
+        self.rebuild = True
+
+    def rebuild_False(self):
+        self.rebuild = False
+
+    def setLevels(self , levels):
+        self.levels = max(int(levels) , 0)
+
+    def setJobs(self , jobs):
+        self.jobs = max(int(jobs) , 0)
+
     def curvature_True(self):
         self.curvature = True
         pm.checkBoxGrp('sharpCorners' , edit=True , en=True)
+        pm.checkBoxGrp('fit' , edit=True , en=True)
 
     def curvature_False(self):
         self.curvature = False
         pm.checkBoxGrp('sharpCorners' , edit=True , en=False)
+        pm.checkBoxGrp('fit' , edit=True , en=False)
+
+    def fit_True(self):
+        self.fit = CoarseFit()
+
+    def fit_False(self):
+        self.fit = None
 
     def progress_True(self):
         self.showProgress = True
@@ -457,13 +587,19 @@ class ReconstructSubdiv(object):
     def progress_False(self):
         self.showProgress = False
 
+    def profile_True(self):
+        self.profile = True
+
+    def profile_False(self):
+        self.profile = False
+
     def expand(self):
         pm.frameLayout('more' , edit=True , l='Less')
-        pm.window('RecostructWin' , edit=True , height=312)
+        pm.window('RecostructWin' , edit=True , height=470)
 
     def collapse(self):
         pm.frameLayout('more' , edit=True , l='More')
-        pm.window('RecostructWin' , edit=True , height=172)
+        pm.window('RecostructWin' , edit=True , height=198)
 
     def uiClear(self):
         pm.textField('meshes' , edit=True , text='')
@@ -477,11 +613,16 @@ class ReconstructSubdiv(object):
         template.define(pm.columnLayout , adj=1 , rs=2)
 
         with pm.window('RecostructWin' , title='Recostruct Subdiv v1.3' , menuBar=True , menuBarVisible=True) as win:
-            pm.window('RecostructWin' , edit=True , width=420 , height=172)
+            pm.window('RecostructWin' , edit=True , width=420 , height=198)
             with pm.frameLayout(lv=False , bv=False , mh=2 , mw=7):
                 with template:
                     with pm.columnLayout():
                         pm.button(label='Recostruct Subdiv' , c=pm.Callback(self.Main) , h=40 , bgc=self.clrs['orange'])
+                        with pm.rowLayout(numberOfColumns=2 , adj=1):
+                            pm.button(label='Recostruct targets' , c=pm.Callback(self.MainTargets) ,
+                                      ann='Selected meshes sharing a topology reuse one cached operator')
+                            pm.button(label='Recostruct frame range to OBJ...' , c=pm.Callback(self.MainFrames) ,
+                                      ann='Time slider range of the selected meshes, one OBJ per frame')
                         with pm.frameLayout('more' , l='More' , cll=True , cl=True , ec=pm.Callback(self.expand) ,
                                             cc=pm.Callback(self.collapse)):
                             with pm.columnLayout(cat=('left' , -20)):
@@ -489,7 +630,7 @@ class ReconstructSubdiv(object):
                                     numberOfCheckBoxes=1 ,
                                     columnAlign=(1 , 'right') ,
                                     label='Settings: ' ,
-                                    label1='Keep original (Recostructing is not undoable)' ,
+                                    label1='Keep original (off: in place, undoable)' ,
                                     v1=True ,
                                     on1=pm.Callback(self.keepOrig_True) ,
                                     of1=pm.Callback(self.keepOrig_False)
@@ -511,21 +652,67 @@ class ReconstructSubdiv(object):
                                     on1=pm.Callback(self.sharpCorners_True) ,
                                     of1=pm.Callback(self.sharpCorners_False) ,
                                 )
+                                pm.checkBoxGrp(
+                                    'fit' ,
+                                    numberOfCheckBoxes=1 ,
+                                    columnAlign=(1 , 'right') ,
+                                    label='' , label1='Global least-squares fit (slower)' ,
+                                    v1=False ,
+                                    on1=pm.Callback(self.fit_True) ,
+                                    of1=pm.Callback(self.fit_False) ,
+                                    ann='Solve all coarse points together, also the ones the local rules cannot reach'
+                                )
+                                pm.checkBoxGrp(
+                                    numberOfCheckBoxes=1 ,
+                                    columnAlign=(1 , 'right') ,
+                                    label='' , label1='Rebuild mesh directly (Faster, keeps current UV set only)' ,
+                                    v1=False ,
+                                    on1=pm.Callback(self.rebuild_True) ,
+                                    of1=pm.Callback(self.rebuild_False) ,
+                                )
+                                pm.intFieldGrp(
+                                    numberOfFields=1 ,
+                                    columnAlign=(1 , 'right') ,
+                                    label='Levels: ' ,
+                                    value1=1 ,
+                                    cc=self.setLevels ,
+                                    ann='Subdivision levels to remove, 0 removes levels until the mesh is irreducible'
+                                )
+                                pm.intFieldGrp(
+                                    numberOfFields=1 ,
+                                    columnAlign=(1 , 'right') ,
+                                    label='Processes: ' ,
+                                    value1=0 ,
+                                    cc=self.setJobs ,
+                                    ann='Worker processes for several selected meshes, 0 uses every core, 1 runs here'
+                                )
                                 pm.checkBoxGrp(
                                     numberOfCheckBoxes=1 ,
                                     columnAlign=(1 , 'right') ,
                                     label='' ,
-                                    label1='Turn Off progress bar (Increase speed)' ,
+                                    label1='Turn Off progress bar (Esc still cancels)' ,
                                     v1=False ,
                                     on1=pm.Callback(self.progress_False) ,
                                     of1=pm.Callback(self.progress_True)
                                 )
+                                pm.checkBoxGrp(
+                                    numberOfCheckBoxes=1 ,
+                                    columnAlign=(1 , 'right') ,
+                                    label='' ,
+                                    label1='Profile phases (report in Script Editor)' ,
+                                    v1=False ,
+                                    on1=pm.Callback(self.profile_True) ,
+                                    of1=pm.Callback(self.profile_False)
+                                )
                                 rb = pm.radioButtonGrp(numberOfRadioButtons=1 , on1=pm.Callback(self.reverse_False) ,
                                                        label='' , sl=1 ,
                                                        label1='Default starting point (For most cases)')
                                 pm.radioButtonGrp(numberOfRadioButtons=1 , on1=pm.Callback(self.reverse_True) ,
                                                   shareCollection=rb , label='' ,
                                                   label1='Reverse starting point (For special cases)')
+                                pm.radioButtonGrp(numberOfRadioButtons=1 , on1=pm.Callback(self.reverse_Auto) ,
+                                                  shareCollection=rb , label='' ,
+                                                  label1='Auto starting point (Tries both)')
                     with pm.frameLayout(l='Progress'):
                         pm.progressBar('progress' , h=25 , ii=True)
                         with pm.rowColumnLayout(
@@ -0,0 +1,208 @@
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+sys.path.insert(0 , os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0 , os.path.dirname(os.path.abspath(__file__)))
+
+import fakemaya
+from meshes import KINDS , forSize
+from subdivCore import unsubdivide
+from subdivForward import subdivideLevel
+from subdivIO import ArrayPointBackend , PointIO
+
+scene = fakemaya.install()
+import ReconstructSubdiv
+
+# The 5M vertex case is slow and memory hungry, it runs when asked for with --sizes ... 5e6
+SIZES = (1000 , 10000 , 100000 , 1000000)
+METRICS = ('mayaTime' , 'coreTime' , 'peakMemory')
+
+
+def canonicalFaces(faceCounts , faceIndices):
+    # Quads rotated to start at their lowest vertex, then sorted, so face order and start corner do not matter
+    quads = np.asarray(faceIndices , dtype=np.int64).reshape(-1 , 4)
+    shift = np.argmin(quads , axis=1)
+    quads = quads[np.arange(len(quads))[: , None] , (shift[: , None] + np.arange(4)) % 4]
+    return quads[np.lexsort(quads.T[::-1])]
+
+
+def checkResult(coarse , faceCounts , faceIndices , points):
+    coarsePoints , coarseCounts , coarseIndices = coarse
+    result = {'topologyMatch': False , 'maxError': None}
+    if len(points) != len(coarsePoints) or len(faceCounts) != len(coarseCounts) or (np.asarray(faceCounts) != 4).any():
+        return result
+    result['topologyMatch'] = bool((canonicalFaces(faceCounts , faceIndices) ==
+                                    canonicalFaces(coarseCounts , coarseIndices)).all())
+    result['maxError'] = float(np.abs(np.asarray(points) - coarsePoints).max())
+    # Maya keeps float points, allow float32 rounding relative to the mesh size
+    extent = max(float(np.abs(coarsePoints).max()) , 1.0)
+    result['topologyMatch'] = result['topologyMatch'] and result['maxError'] <= 1e-5 * extent
+    return result
+
+
+def checkPointIO(points):
+    # Points through PointIO and an array backend and back: unchanged, one bulk read and write each way
+    backend = ArrayPointBackend(points)
+    pointIO = PointIO(backend)
+    pointIO.write(pointIO.read() * 2)
+    return bool(np.array_equal(pointIO.read() , np.asarray(points) * 2) and backend.reads == 2 and backend.writes == 1)
+
+
+def runMaya(fine):
+    points , faceCounts , faceIndices = fine
+    scene.clear()
+    scene.addMesh('bench' , points , faceCounts , faceIndices)
+    scene.select(['bench'])
+    tool = ReconstructSubdiv.ReconstructSubdiv()
+    tool.keepOrig = False
+    # Edge deletion needs Maya
+    tool.rebuild = True
+    tool.showProgress = False
+    tool.profile = True
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull , 'w')
+    try:
+        start = time.time()
+        tool.Main()
+        elapsed = time.time() - start
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+    mesh = scene.meshes['bench']
+    return elapsed , tool.profileReports[0] , (mesh.points , mesh.faceCounts , mesh.faceIndices)
+
+
+def runCore(fine):
+    points , faceCounts , faceIndices = fine
+    start = time.time()
+    result = unsubdivide(faceCounts , faceIndices , points)
+    return time.time() - start , result
+
+
+def peakMemory(function , *args):
+    tracemalloc.start()
+    try:
+        function(*args)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def benchCase(kind , size , repeat=3 , memory=True , noise=0.01):
+    coarsePoints , coarseCounts , coarseIndices = forSize(kind , size)
+    coarsePoints = coarsePoints + np.random.RandomState(size).normal(0 , noise , coarsePoints.shape)
+    start = time.time()
+    faceCounts , faceIndices , points = subdivideLevel(coarseCounts , coarseIndices , coarsePoints)
+    record = {
+        'kind': kind ,
+        'size': size ,
+        'fineVertices': len(points) ,
+        'coarseVertices': len(coarsePoints) ,
+        'subdivideTime': round(time.time() - start , 6)
+    }
+    fine = (points , faceCounts , faceIndices)
+    record['ioMatch'] = checkPointIO(points)
+
+    runs = [runMaya(fine) for _ in range(repeat)]
+    best = min(runs , key=lambda run: run[0])
+    record['mayaTime'] = round(best[0] , 6)
+    record['phases'] = dict((name , phase['time']) for name , phase in best[1]['phases'].items())
+    record['counters'] = best[1]['counters']
+    record.update(checkResult((coarsePoints , coarseCounts , coarseIndices) , best[2][1] , best[2][2] , best[2][0]))
+
+    runs = [runCore(fine) for _ in range(repeat)]
+    record['coreTime'] = round(min(run[0] for run in runs) , 6)
+    core = runs[0][1]
+    record['coreMatch'] = checkResult((coarsePoints , coarseCounts , coarseIndices) , core[0] , core[1] ,
+                                      core[2])['topologyMatch']
+
+    if memory:
+        record['peakMemory'] = peakMemory(runMaya , fine)
+    return record
+
+
+def compareBaseline(records , baseline , tolerance=0.25 , floor=0.005):
+    # Slower or bigger than the baseline by more than tolerance (and more than floor seconds for times)
+    base = dict(('{0}/{1}'.format(r['kind'] , r['size']) , r) for r in baseline.get('records' , []))
+    regressions = []
+    for record in records:
+        old = base.get('{0}/{1}'.format(record['kind'] , record['size']))
+        if not old:
+            continue
+        for metric in METRICS:
+            if metric not in record or metric not in old:
+                continue
+            new , was = record[metric] , old[metric]
+            slack = floor if metric.endswith('Time') else 0
+            if new > was * (1 + tolerance) + slack:
+                regressions.append({'case': '{0}/{1}'.format(record['kind'] , record['size']) , 'metric': metric ,
+                                    'baseline': was , 'current': new , 'ratio': round(new / max(was , 1e-9) , 3)})
+    return regressions
+
+
+def printRecord(record):
+    phases = ' '.join('{0}={1:.4f}'.format(name , value) for name , value in sorted(record['phases'].items() ,
+                                                                                       key=lambda item: -item[1]))
+    print('{0:<6} {1:>9} fine: {2:>9} maya: {3:>8.4f}s core: {4:>8.4f}s mem: {5:>8} ok: {6} err: {7}'.format(
+        record['kind'] , record['size'] , record['fineVertices'] , record['mayaTime'] , record['coreTime'] ,
+        '{0:.1f}MB'.format(record['peakMemory'] / 1048576.0) if 'peakMemory' in record else '-' ,
+        record['topologyMatch'] and record['coreMatch'] and record['ioMatch'] ,
+        '{0:.2e}'.format(record['maxError']) if record['maxError'] is not None else '-'))
+    print('       ' + phases)
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Time ReconstructSubdiv on generated meshes with a fake Maya.')
+    parser.add_argument('--kinds' , nargs='+' , default=list(KINDS) , choices=KINDS)
+    parser.add_argument('--sizes' , nargs='+' , type=float , default=list(SIZES) ,
+                        help='approximate vertex counts of the subdivided meshes (default 1e3 to 1e6, add 5e6 for '
+                             'the largest case)')
+    parser.add_argument('--repeat' , type=int , default=3 , help='best of this many runs')
+    parser.add_argument('--no-memory' , action='store_true' , help='skip the tracemalloc peak memory run')
+    parser.add_argument('--save' , help='write the results as a baseline JSON file')
+    parser.add_argument('--compare' , help='baseline JSON file to check for regressions')
+    parser.add_argument('--tolerance' , type=float , default=0.25 , help='allowed slowdown, 0.25 = 25%%')
+    args = parser.parse_args(args)
+
+    records = []
+    for size in args.sizes:
+        for kind in args.kinds:
+            record = benchCase(kind , int(size) , args.repeat , not args.no_memory)
+            records.append(record)
+            printRecord(record)
+
+    failed = [r for r in records if not (r['topologyMatch'] and r['coreMatch'] and r['ioMatch'])]
+    if failed:
+        print('Mismatch: {0}'.format(', '.join('{0}/{1}'.format(r['kind'] , r['size']) for r in failed)))
+
+    result = {
+        'python': platform.python_version() ,
+        'numpy': np.__version__ ,
+        'machine': platform.machine() ,
+        'records': records
+    }
+    if args.save:
+        with open(args.save , 'w') as baselineFile:
+            json.dump(result , baselineFile , indent=2 , sort_keys=True)
+
+    regressions = []
+    if args.compare:
+        with open(args.compare , 'r') as baselineFile:
+            regressions = compareBaseline(records , json.load(baselineFile) , args.tolerance)
+        for regression in regressions:
+            print('Regression {case} {metric}: {baseline} -> {current} ({ratio}x)'.format(**regression))
+        if not regressions:
+            print('No regressions against {0}'.format(args.compare))
+
+    return 1 if failed or regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,378 @@
+import sys
+import types
+
+import numpy as np
+
+# Just enough of maya.api.OpenMaya, maya.OpenMaya, maya.cmds and pymel.core to run ReconstructSubdiv on
+# in-memory meshes outside Maya. UI calls do nothing, meshes live in scene.
+
+
+class Stub(object):
+    # Any attribute, call or with block, always falsy
+
+    def __getattr__(self , name):
+        return self
+
+    def __call__(self , *args , **kwargs):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self , *args):
+        return False
+
+    def __bool__(self):
+        return False
+
+    __nonzero__ = __bool__
+
+
+class FakeMesh(object):
+
+    def __init__(self , name , points , faceCounts , faceIndices , uvs=None):
+        self.name = name
+        self.points = np.asarray(points , dtype=np.float64).reshape(-1 , 3)
+        self.faceCounts = np.asarray(faceCounts , dtype=np.int64)
+        self.faceIndices = np.asarray(faceIndices , dtype=np.int64)
+        self.raw = None
+        if uvs is None:
+            uvs = self.points[: , :2]
+        # UV set name -> [us , vs , uvCounts , uvIds]
+        self.uvSets = {'map1': [np.asarray(uvs[: , 0] , dtype=np.float64) , np.asarray(uvs[: , 1] , dtype=np.float64) ,
+                                self.faceCounts.copy() , self.faceIndices.copy()]}
+        self.currentUVSet = 'map1'
+        self.colorSets = []
+        self.shaders = ['initialShadingGroup']
+        self.creaseEdges = []
+        self.calls = {}
+
+    @property
+    def uvIds(self):
+        return self.uvSets[self.currentUVSet][3]
+
+    def call(self , name):
+        self.calls[name] = self.calls.get(name , 0) + 1
+
+
+class Scene(object):
+
+    def __init__(self):
+        self.meshes = {}
+        self.selection = []
+        self.components = []
+
+    def clear(self):
+        self.meshes.clear()
+        self.selection = []
+        self.components = []
+
+    def addMesh(self , name , points , faceCounts , faceIndices , uvs=None):
+        self.meshes[name] = FakeMesh(name , points , faceCounts , faceIndices , uvs)
+        return self.meshes[name]
+
+    def select(self , names):
+        self.selection = list(names)
+        self.components = []
+
+    def selectComponents(self , name , kind , ids):
+        # kind: 'f' for faces or 'vtx' for vertices, adds to the selection
+        component = MFnSingleIndexedComponent().create(MFn.kMeshPolygonComponent if kind == 'f' else
+                                                       MFn.kMeshVertComponent)
+        component.addElements(ids)
+        self.components.append((name , component))
+
+    def mesh(self , path):
+        return self.meshes[str(path).split('|')[-1]]
+
+
+scene = Scene()
+
+
+class MFn(object):
+    kMesh = 296
+    kTransform = 110
+    kMeshPolygonComponent = 548
+    kMeshVertComponent = 550
+
+
+class MObject(object):
+    # The null object, what getComponent returns for whole objects
+
+    def isNull(self):
+        return True
+
+
+class MDagPath(object):
+
+    def __init__(self , name=''):
+        self.name = name
+
+    def fullPathName(self):
+        return '|' + self.name
+
+    def apiType(self):
+        return MFn.kTransform
+
+    def pop(self):
+        pass
+
+    def partialPathName(self):
+        return self.name
+
+    def __str__(self):
+        return self.name
+
+
+class MSelectionList(object):
+
+    def __init__(self):
+        self.items = []
+        self.components = []
+
+    def add(self , item):
+        self.items.append(item[0] if isinstance(item , tuple) else MDagPath(str(item).split('|')[-1]))
+        self.components.append(item[1] if isinstance(item , tuple) else MObject())
+
+    def getDagPath(self , index , dag=None):
+        if dag is not None:
+            dag.name = self.items[index].name
+            return dag
+        return MDagPath(self.items[index].name)
+
+    def getComponent(self , index):
+        # Like Maya, items that are not DAG nodes (shading groups, sets, ...) have no DAG path
+        if self.items[index].name not in scene.meshes:
+            raise TypeError('item is not a DAG path or component')
+        return MDagPath(self.items[index].name) , self.components[index]
+
+    def replace(self , index , item):
+        self.items[index] = item
+
+    def length(self):
+        return len(self.items)
+
+
+class MPointArray(object):
+
+    def __init__(self , points=()):
+        self.points = np.asarray(points , dtype=np.float64).reshape(-1 , 3)
+
+    def __len__(self):
+        return len(self.points)
+
+    def __array__(self , dtype=None , copy=None):
+        return self.points if dtype is None else self.points.astype(dtype)
+
+
+class MFnMesh(object):
+
+    def __init__(self , dag):
+        self.mesh = scene.mesh(dag)
+
+    @property
+    def numVertices(self):
+        return len(self.mesh.points)
+
+    def getVertices(self):
+        self.mesh.call('getVertices')
+        return self.mesh.faceCounts , self.mesh.faceIndices
+
+    def getPoints(self , space=None):
+        self.mesh.call('getPoints')
+        return MPointArray(self.mesh.points)
+
+    def setPoints(self , points , space=None):
+        self.mesh.call('setPoints')
+        self.mesh.points = np.array(points , dtype=np.float64).reshape(-1 , 3)
+        self.mesh.raw = None
+
+    def createInPlace(self , points , faceCounts , faceIndices):
+        self.mesh.call('createInPlace')
+        self.mesh.points = np.array(points , dtype=np.float64).reshape(-1 , 3)
+        self.mesh.faceCounts = np.asarray(faceCounts , dtype=np.int64)
+        self.mesh.faceIndices = np.asarray(faceIndices , dtype=np.int64)
+        self.mesh.raw = None
+        # The UV sets stay, their UVs are gone
+        for uvSet in self.mesh.uvSets.values():
+            uvSet[2:] = [np.zeros(0 , dtype=np.int64) , np.zeros(0 , dtype=np.int64)]
+
+    def currentUVSetName(self):
+        return self.mesh.currentUVSet
+
+    def setCurrentUVSetName(self , uvSet):
+        self.mesh.currentUVSet = uvSet
+
+    def getUVSetNames(self):
+        return list(self.mesh.uvSets)
+
+    def createUVSet(self , uvSet):
+        empty = np.zeros(0 , dtype=np.int64)
+        self.mesh.uvSets[uvSet] = [empty.astype(np.float64) , empty.astype(np.float64) , empty , empty]
+        return uvSet
+
+    def getAssignedUVs(self , uvSet=None):
+        return tuple(self.mesh.uvSets[uvSet or self.mesh.currentUVSet][2:])
+
+    def getUVs(self , uvSet=None):
+        return tuple(self.mesh.uvSets[uvSet or self.mesh.currentUVSet][:2])
+
+    def setUVs(self , us , vs , uvSet=None):
+        self.mesh.uvSets[uvSet or self.mesh.currentUVSet][:2] = [np.asarray(us , dtype=np.float64) ,
+                                                                 np.asarray(vs , dtype=np.float64)]
+
+    def assignUVs(self , uvCounts , uvIds , uvSet=None):
+        self.mesh.uvSets[uvSet or self.mesh.currentUVSet][2:] = [np.asarray(uvCounts , dtype=np.int64) ,
+                                                                 np.asarray(uvIds , dtype=np.int64)]
+
+    def getColorSetNames(self):
+        return list(self.mesh.colorSets)
+
+    def getConnectedShaders(self , instance):
+        # Shaders and the shader of every face
+        return list(self.mesh.shaders) , [0] * len(self.mesh.faceCounts)
+
+    def getCreaseEdges(self):
+        # Like Maya, a mesh without creases fails
+        if not self.mesh.creaseEdges:
+            raise RuntimeError('no crease edges')
+        return list(self.mesh.creaseEdges) , [1.0] * len(self.mesh.creaseEdges)
+
+    def getCreaseVertices(self):
+        raise RuntimeError('no crease vertices')
+
+
+class MFnMeshApi1(object):
+    # maya.OpenMaya.MFnMesh: numVertices is a method and getRawPoints hands out the float point buffer
+
+    def __init__(self , dag):
+        self.mesh = scene.mesh(dag)
+
+    def numVertices(self):
+        return len(self.mesh.points)
+
+    def getRawPoints(self):
+        self.mesh.call('getRawPoints')
+        if self.mesh.raw is None:
+            self.mesh.raw = np.ascontiguousarray(self.mesh.points , dtype=np.float32)
+        return self.mesh.raw.ctypes.data
+
+
+class MFnSingleIndexedComponent(object):
+    # Function set and component in one: create() returns the function set itself
+
+    def __init__(self , component=None):
+        self.elements = list(component.elements) if component is not None else []
+        self.kind = component.kind if component is not None else None
+
+    def create(self , kind):
+        self.kind = kind
+        return self
+
+    def addElements(self , elements):
+        self.elements.extend(elements)
+
+    def getElements(self):
+        return list(self.elements)
+
+    def apiType(self):
+        return self.kind
+
+    def isNull(self):
+        return False
+
+
+class MGlobal(object):
+    active = None
+
+    @staticmethod
+    def setActiveSelectionList(selection):
+        MGlobal.active = selection
+
+    @staticmethod
+    def getActiveSelectionList():
+        # Whole objects of scene.selection, then the components of scene.selectComponents
+        selection = MSelectionList()
+        for name in scene.selection:
+            selection.add(name)
+        for name , component in scene.components:
+            selection.add((MDagPath(name) , component))
+        return selection
+
+
+class FakeCmds(Stub):
+    time = 1.0
+    cancelled = False
+    undoState = True
+
+    def ls(self , *args , **kwargs):
+        if kwargs.get('s'):
+            return ['|{0}|{0}Shape'.format(name) for name in scene.selection if name in scene.meshes]
+        return ['|' + name for name in scene.selection]
+
+    def error(self , message):
+        raise RuntimeError(message)
+
+    def select(self , items , **kwargs):
+        scene.selection = [str(item).split('|')[-1] for item in items]
+
+    def currentTime(self , *args , **kwargs):
+        if kwargs.get('q'):
+            return self.time
+        self.time = args[0]
+        return self.time
+
+    def undoInfo(self , **kwargs):
+        if kwargs.get('q'):
+            return self.undoState
+        if 'stateWithoutFlush' in kwargs:
+            self.undoState = kwargs['stateWithoutFlush']
+
+    def playbackOptions(self , **kwargs):
+        return 1.0
+
+    def progressBar(self , *args , **kwargs):
+        # Set cancelled to play the user pressing Esc
+        if kwargs.get('q') and kwargs.get('isCancelled'):
+            return self.cancelled
+        return None
+
+    def polyDelEdge(self , *args , **kwargs):
+        raise NotImplementedError('Edge delete needs Maya, benchmark the rebuild path instead')
+
+
+def module(name , **attributes):
+    mod = types.ModuleType(name)
+    for key , value in attributes.items():
+        setattr(mod , key , value)
+    return mod
+
+
+def install():
+    # Put the fake modules in sys.modules, ReconstructSubdiv can be imported afterwards
+    space = module('MSpace' , kObject=0 , kWorld=4)
+    om2 = module('maya.api.OpenMaya' , MSelectionList=MSelectionList , MDagPath=MDagPath , MPointArray=MPointArray ,
+                 MFnMesh=MFnMesh , MSpace=space , MFn=MFn , MFnSingleIndexedComponent=MFnSingleIndexedComponent ,
+                 MGlobal=MGlobal)
+    om1 = module('maya.OpenMaya' , MSelectionList=MSelectionList , MDagPath=MDagPath , MFnMesh=MFnMeshApi1)
+    cmds = FakeCmds()
+    core = Stub()
+    api = module('maya.api' , OpenMaya=om2)
+    mel = module('maya.mel' , eval=lambda command: '')
+    maya = module('maya' , api=api , OpenMaya=om1 , cmds=cmds , mel=mel)
+    pymel = module('pymel' , core=core)
+    sys.modules.update({
+        'maya': maya ,
+        'maya.api': api ,
+        'maya.api.OpenMaya': om2 ,
+        'maya.OpenMaya': om1 ,
+        'maya.cmds': cmds ,
+        'maya.mel': mel ,
+        'pymel': pymel ,
+        'pymel.core': core
+    })
+    return scene
+
+
+def cmds():
+    return sys.modules['maya.cmds']
@@ -0,0 +1,115 @@
+import numpy as np
+
+
+def quadGrid(ids):
+    # Quads of a 2D array of vertex ids, counter clockwise in (row , column)
+    a = ids[:-1 , :-1]
+    b = ids[:-1 , 1:]
+    c = ids[1: , 1:]
+    d = ids[1: , :-1]
+    indices = np.stack([a , b , c , d] , axis=-1).reshape(-1)
+    return np.full(len(indices) // 4 , 4 , dtype=np.int64) , indices.astype(np.int64)
+
+
+def grid(nx , ny=None):
+    # Flat open grid of nx * ny quads, corners have valence 2
+    ny = ny or nx
+    x , y = np.meshgrid(np.arange(nx + 1 , dtype=np.float64) , np.arange(ny + 1 , dtype=np.float64))
+    points = np.stack([x.ravel() , y.ravel() , np.zeros(x.size)] , axis=1)
+    counts , indices = quadGrid(np.arange(points.shape[0]).reshape(ny + 1 , nx + 1))
+    return points , counts , indices
+
+
+def torus(nu , nv=None , radius=1.0 , thickness=0.35):
+    # Closed, every vertex has valence 4
+    nv = nv or nu
+    u , v = np.meshgrid(np.linspace(0 , 2 * np.pi , nu , endpoint=False) ,
+                        np.linspace(0 , 2 * np.pi , nv , endpoint=False))
+    ring = radius + thickness * np.cos(v)
+    points = np.stack([(ring * np.cos(u)).ravel() , (ring * np.sin(u)).ravel() , (thickness * np.sin(v)).ravel()] ,
+                      axis=1)
+    ids = np.arange(nu * nv).reshape(nv , nu)
+    ids = np.concatenate([ids , ids[:1]] , axis=0)
+    ids = np.concatenate([ids , ids[: , :1]] , axis=1)
+    counts , indices = quadGrid(ids)
+    return points , counts , indices
+
+
+def tube(nu , nv=None , radius=1.0 , height=2.0):
+    # Open cylinder: two boundary loops, no corners
+    nv = nv or nu
+    u , h = np.meshgrid(np.linspace(0 , 2 * np.pi , nu , endpoint=False) , np.linspace(0 , height , nv + 1))
+    points = np.stack([(radius * np.cos(u)).ravel() , (radius * np.sin(u)).ravel() , h.ravel()] , axis=1)
+    ids = np.arange(nu * (nv + 1)).reshape(nv + 1 , nu)
+    ids = np.concatenate([ids , ids[: , :1]] , axis=1)
+    counts , indices = quadGrid(ids)
+    return points , counts , indices
+
+
+def cube(n):
+    # Closed box with n * n quads per side, the eight corners have valence 3
+    size = n + 1
+    lattice = np.stack(np.meshgrid(np.arange(size) , np.arange(size) , np.arange(size) , indexing='ij') , axis=-1)
+    surface = (lattice == 0).any(axis=-1) | (lattice == n).any(axis=-1)
+    ids = np.full((size , size , size) , -1 , dtype=np.int64)
+    ids[surface] = np.arange(int(surface.sum()))
+    points = lattice[surface].astype(np.float64) / n - 0.5
+
+    counts = []
+    indices = []
+    for axis in range(3):
+        for side , flip in ((0 , True) , (n , False)):
+            sheet = np.take(ids , side , axis=axis)
+            c , i = quadGrid(sheet.T if flip == (axis == 1) else sheet)
+            counts.append(c)
+            indices.append(i)
+    return points , np.concatenate(counts) , np.concatenate(indices)
+
+
+def star(valence , rings):
+    # Open disc of valence sectors around one extraordinary vertex, each sector a rings * rings grid
+    angles = np.linspace(0 , 2 * np.pi , valence , endpoint=False)
+    spokes = np.stack([np.cos(angles) , np.sin(angles) , np.zeros(valence)] , axis=1)
+
+    # Vertex 0 is the centre, then every spoke (1..rings), then the inner vertices of every sector
+    spokeIds = 1 + np.arange(valence * rings).reshape(valence , rings)
+    innerCount = rings * rings
+    points = [np.zeros((1 , 3))]
+    points.append((spokes[: , None , :] * (np.arange(1 , rings + 1 , dtype=np.float64) / rings)[None , : , None])
+                  .reshape(-1 , 3))
+    counts = []
+    indices = []
+    t = np.arange(rings + 1 , dtype=np.float64) / rings
+    for k in range(valence):
+        a = spokes[k]
+        b = spokes[(k + 1) % valence]
+        ids = np.empty((rings + 1 , rings + 1) , dtype=np.int64)
+        ids[0 , 0] = 0
+        ids[1: , 0] = spokeIds[k]
+        ids[0 , 1:] = spokeIds[(k + 1) % valence]
+        start = 1 + valence * rings + k * innerCount
+        ids[1: , 1:] = start + np.arange(innerCount).reshape(rings , rings)
+        points.append((t[1: , None , None] * a + t[None , 1: , None] * b).reshape(-1 , 3))
+        c , i = quadGrid(ids)
+        counts.append(c)
+        indices.append(i)
+    return np.concatenate(points) , np.concatenate(counts) , np.concatenate(indices)
+
+
+def forSize(kind , vertices):
+    # A coarse mesh whose once subdivided version has about the given number of vertices
+    if kind == 'grid':
+        return grid(max(int((np.sqrt(vertices) - 1) / 2) , 1))
+    if kind == 'torus':
+        return torus(max(int(np.sqrt(vertices / 4.0)) , 3))
+    if kind == 'tube':
+        return tube(max(int(np.sqrt(vertices / 4.0)) , 3))
+    if kind == 'cube':
+        return cube(max(int(np.sqrt(vertices / 24.0)) , 1))
+    if kind.startswith('star'):
+        valence = int(kind[4:])
+        return star(valence , max(int(np.sqrt(vertices / (4.0 * valence))) , 1))
+    raise ValueError('Unknown mesh kind: {0}'.format(kind))
+
+
+KINDS = ('grid' , 'cube' , 'torus' , 'tube' , 'star3' , 'star5' , 'star6')
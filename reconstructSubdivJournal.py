@@ -0,0 +1,54 @@
+import maya.api.OpenMaya as Om2
+
+from subdivJournal import pendingJournals
+
+# Maya plugin with the undoable command behind in-place reconstruction:
+#   cm.loadPlugin('.../reconstructSubdivJournal.py')
+# ReconstructSubdiv changes the meshes with undo turned off, queues a subdivJournal.Journal and runs
+# reconstructSubdivJournal, which takes the journal and replays its states on undo and redo.
+
+COMMAND_NAME = 'reconstructSubdivJournal'
+
+
+def maya_useNewAPI():
+    pass
+
+
+def meshFn(path):
+    selection = Om2.MSelectionList()
+    selection.add(path)
+    return Om2.MFnMesh(selection.getDagPath(0))
+
+
+class ReconstructSubdivJournal(Om2.MPxCommand):
+
+    def __init__(self):
+        Om2.MPxCommand.__init__(self)
+        self.journal = None
+
+    @staticmethod
+    def creator():
+        return ReconstructSubdivJournal()
+
+    def isUndoable(self):
+        return self.journal is not None
+
+    def doIt(self , args):
+        # The meshes already hold the after states
+        if pendingJournals:
+            self.journal = pendingJournals.pop(0)
+
+    def redoIt(self):
+        self.journal.redo(meshFn , Om2.MPointArray)
+
+    def undoIt(self):
+        self.journal.undo(meshFn , Om2.MPointArray)
+
+
+def initializePlugin(plugin):
+    Om2.MFnPlugin(plugin , 'ReconstructSubdiv' , '1.0').registerCommand(COMMAND_NAME ,
+                                                                        ReconstructSubdivJournal.creator)
+
+
+def uninitializePlugin(plugin):
+    Om2.MFnPlugin(plugin).deregisterCommand(COMMAND_NAME)
@@ -0,0 +1,246 @@
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+import traceback
+
+from subdivCore import unsubdivide
+from subdivIO import readObj , writeObj
+from subdivOutOfCore import readObjToStore , unsubdivideOutOfCore
+from subdivProfile import Profiler , aggregateReports , getProfiler , profiling
+from subdivSolve import CoarseFit
+from subdivTopology import preflight
+from subdivVerify import verifyReconstruction
+
+
+def readManifest(path):
+    # One OBJ path per line, relative to the manifest, '#' starts a comment
+    root = os.path.dirname(os.path.abspath(path))
+    files = []
+    with open(path , 'r') as manifest:
+        for line in manifest:
+            line = line.split('#')[0].strip()
+            if line:
+                files.append(os.path.join(root , line))
+    return files
+
+
+def findObjFiles(directory):
+    return sorted(os.path.join(directory , name) for name in os.listdir(directory) if name.lower().endswith('.obj'))
+
+
+def processFile(task):
+    path , outDir , options = task
+    profiler = Profiler(path , options.get('cprofile' , False)) if options.get('profile') else None
+    with profiling(profiler):
+        record = reconstructFile(path , outDir , options)
+    if profiler:
+        record['profile'] = profiler.report()
+    return record
+
+
+def reconstructFile(path , outDir , options):
+    profiler = getProfiler()
+    record = {
+        'file': path ,
+        'output': None ,
+        'status': 'ok' ,
+        'levels': 0 ,
+        'error': None
+    }
+    start = time.time()
+    if options.get('memoryBudget'):
+        return reconstructFileOutOfCore(path , outDir , options , record , start)
+    try:
+        with profiler.phase('objRead'):
+            points , faceCounts , faceIndices = readObj(path , cache=options.get('cache' , False))
+        record['vertices'] = len(points)
+        record['faces'] = len(faceCounts)
+        record['readTime'] = round(time.time() - start , 4)
+
+        report = preflight(faceCounts , faceIndices , len(points))
+        record['preflight'] = report.asDict()
+        if not report.isQuad:
+            record['status'] = 'irreducible'
+            record['error'] = report.message()
+            record['time'] = round(time.time() - start , 4)
+            return record
+
+        coarseCounts , coarseIndices , coarsePoints , fineCorners , levels = unsubdivide(
+            faceCounts , faceIndices , points , options['levels'] , options['reverse'] , options['curvature'] ,
+            options['sharpCorners'] , jobs=options.get('shellThreads' , 1) , fit=options.get('fit') , report=report)
+        record['levels'] = levels
+        record['coarseVertices'] = len(coarsePoints)
+        record['coarseFaces'] = len(coarseCounts)
+        record['reconstructTime'] = round(time.time() - start - record['readTime'] , 4)
+
+        if not levels:
+            record['status'] = 'irreducible'
+        else:
+            if options.get('verify') is not None:
+                verification = verifyReconstruction(faceCounts , faceIndices , points , coarseCounts , coarseIndices ,
+                                                    coarsePoints , levels , fineCorners , options['sharpCorners'])
+                record['verify'] = verification.asDict()
+                if not verification.passed(options['verify']):
+                    record['status'] = 'mismatch'
+                    record['error'] = 'Re-subdivided result is off by {0}'.format(verification.message())
+            output = os.path.join(outDir , os.path.basename(path))
+            with profiler.phase('objWrite'):
+                writeObj(output , coarsePoints , coarseCounts , coarseIndices)
+            record['output'] = output
+    except Exception as e:
+        record['status'] = 'error'
+        record['error'] = '{0}: {1}'.format(type(e).__name__ , e)
+        record['traceback'] = traceback.format_exc()
+
+    record['time'] = round(time.time() - start , 4)
+    return record
+
+
+def reconstructFileOutOfCore(path , outDir , options , record , start):
+    # Mesh arrays live in memory mapped scratch files, resident memory stays within the budget
+    profiler = getProfiler()
+    result = None
+    try:
+        with profiler.phase('objRead'):
+            store = readObjToStore(path , options.get('scratch') , options['memoryBudget'])
+        record['vertices'] = store.shape('points')[0]
+        record['faces'] = store.shape('faceCounts')[0]
+        record['readTime'] = round(time.time() - start , 4)
+
+        result = unsubdivideOutOfCore(store , options['levels'] , options['reverse'] , options['curvature'] ,
+                                      options['sharpCorners'] , options['memoryBudget'])
+        record['levels'] = result.levels
+        record['coarseVertices'] = result.store.shape('points')[0]
+        record['coarseFaces'] = result.store.shape('faceCounts')[0]
+        record['reconstructTime'] = round(time.time() - start - record['readTime'] , 4)
+
+        if not result.levels:
+            record['status'] = 'irreducible'
+            record['error'] = 'Out-of-core mode needs an all quad mesh with consistent shells'
+        else:
+            output = os.path.join(outDir , os.path.basename(path))
+            with profiler.phase('objWrite'):
+                result.writeObj(output)
+            record['output'] = output
+    except Exception as e:
+        record['status'] = 'error'
+        record['error'] = '{0}: {1}'.format(type(e).__name__ , e)
+        record['traceback'] = traceback.format_exc()
+    finally:
+        if result is not None:
+            result.close()
+
+    if result is not None:
+        record['peakRss'] = result.peakRss
+        record['withinBudget'] = result.withinBudget
+    record['memoryBudget'] = options['memoryBudget']
+    record['time'] = round(time.time() - start , 4)
+    return record
+
+
+def runBatch(files , outDir , options , jobs=None , reportPath=None):
+    if not os.path.isdir(outDir):
+        os.makedirs(outDir)
+    reportPath = reportPath or os.path.join(outDir , 'report.jsonl')
+    tasks = [(path , outDir , options) for path in files]
+
+    records = []
+    start = time.time()
+    # Out of core files get a fresh worker each, the peak RSS of a process would otherwise carry over to the next file
+    pool = multiprocessing.Pool(jobs or multiprocessing.cpu_count() ,
+                                maxtasksperchild=1 if options.get('memoryBudget') else None)
+    try:
+        with open(reportPath , 'w') as report:
+            # Largest meshes first so a big file does not end up alone at the tail of the batch
+            tasks.sort(key=lambda t: -os.path.getsize(t[0]) if os.path.exists(t[0]) else 0)
+            for record in pool.imap_unordered(processFile , tasks , chunksize=1):
+                records.append(record)
+                report.write(json.dumps(record) + '\n')
+                report.flush()
+                print('{0}: {1} ({2} sec)'.format(record['status'] , record['file'] , record['time']))
+    finally:
+        pool.close()
+        pool.join()
+
+    if options.get('profile'):
+        summary = aggregateReports(r.get('profile') for r in records)
+        with open(os.path.join(outDir , 'profile.json') , 'w') as profileFile:
+            json.dump(summary , profileFile , indent=2 , sort_keys=True)
+        for name , phase in sorted(summary['phases'].items() , key=lambda item: -item[1]['time']):
+            print('  {0:<14}{1:>10} sec'.format(name , round(phase['time'] , 4)))
+
+    failed = [r for r in records if r['status'] == 'error']
+    mismatched = [r for r in records if r['status'] == 'mismatch']
+    for record in mismatched:
+        print('  over tolerance: {0} ({1})'.format(record['file'] , record['error']))
+    print('Done! {0} file(s), {1} failed, {2} over tolerance, time spent: {3} sec'.format(
+        len(records) , len(failed) , len(mismatched) , round(time.time() - start , 4)))
+    return records
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Remove subdivision levels from OBJ files without Maya.')
+    parser.add_argument('input' , nargs='?' , help='directory of .obj files')
+    parser.add_argument('-m' , '--manifest' , help='text file listing .obj paths, one per line')
+    parser.add_argument('-o' , '--output' , required=True , help='directory for the reconstructed .obj files')
+    parser.add_argument('-j' , '--jobs' , type=int , default=None , help='worker processes (default: all cores)')
+    parser.add_argument('-l' , '--levels' , type=int , default=1 , help='levels to remove, 0 = until irreducible')
+    parser.add_argument('--shell-threads' , type=int , default=1 ,
+                        help='threads per file, groups of shells of one mesh are reconstructed side by side')
+    parser.add_argument('--reverse' , action='store_true' , help='reverse starting point')
+    parser.add_argument('--auto-parity' , action='store_true' ,
+                        help='try both starting points, every shell keeps the one that is consistent')
+    parser.add_argument('--no-curvature' , action='store_true' , help='do not reconstruct vertex positions')
+    parser.add_argument('--smooth-corners' , action='store_true' , help='do not keep boundary corners sharp')
+    parser.add_argument('--cache' , action='store_true' , help='keep parsed meshes in .npz files next to the inputs')
+    parser.add_argument('--report' , help='per-file JSON lines report (default: OUTPUT/report.jsonl)')
+    parser.add_argument('--profile' , action='store_true' ,
+                        help='phase timers and counters per file, summed up in OUTPUT/profile.json')
+    parser.add_argument('--cprofile' , action='store_true' , help='also add cProfile statistics to every file')
+    parser.add_argument('--fit' , action='store_true' ,
+                        help='solve all coarse points together (sparse least squares, needs scipy)')
+    parser.add_argument('--fit-tolerance' , type=float , default=1e-6 , help='relative residual to stop the fit at')
+    parser.add_argument('--fit-iterations' , type=int , default=100 , help='iteration cap of the fit')
+    parser.add_argument('--verify' , action='store_true' ,
+                        help='subdivide every result again and report its distance to the input')
+    parser.add_argument('--verify-tolerance' , type=float , default=1e-4 ,
+                        help='largest error relative to the bounding box diagonal before a file is flagged')
+    parser.add_argument('--memory-budget' , type=int , default=None , metavar='MB' ,
+                        help='out-of-core mode: keep every worker within MB of resident memory (quad meshes)')
+    parser.add_argument('--scratch' , help='directory for the out-of-core scratch files (default: system temp)')
+    args = parser.parse_args(args)
+
+    if args.manifest:
+        files = readManifest(args.manifest)
+    elif args.input:
+        files = findObjFiles(args.input)
+    else:
+        parser.error('give an input directory or --manifest')
+    if args.fit and args.memory_budget:
+        parser.error('--fit needs the whole mesh in memory, it does not work with --memory-budget')
+    if args.verify and args.memory_budget:
+        parser.error('--verify needs the whole mesh in memory, it does not work with --memory-budget')
+
+    options = {
+        'levels': args.levels ,
+        'shellThreads': max(args.shell_threads , 1) ,
+        'reverse': None if args.auto_parity else args.reverse ,
+        'curvature': not args.no_curvature ,
+        'sharpCorners': not args.smooth_corners ,
+        'cache': args.cache ,
+        'profile': args.profile or args.cprofile ,
+        'cprofile': args.cprofile ,
+        'memoryBudget': args.memory_budget << 20 if args.memory_budget else None ,
+        'scratch': args.scratch ,
+        'fit': CoarseFit(args.fit_tolerance , args.fit_iterations) if args.fit else None ,
+        'verify': args.verify_tolerance if args.verify else None
+    }
+    records = runBatch(files , args.output , options , args.jobs , args.report)
+    return 1 if any(r['status'] == 'error' for r in records) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,119 @@
+import hashlib
+from collections import OrderedDict
+
+import numpy as np
+
+from subdivClassify import LABEL_UNKNOWN , buildCoarseFaces
+from subdivCore import classifyShells
+from subdivSolve import InverseRules
+from subdivTopology import preflight
+
+
+def topologyKey(faceCounts , faceIndices , vtxCount , *options):
+    # Meshes with the same polygons (and options) share one key, whatever their point positions are
+    digest = hashlib.sha1()
+    digest.update(np.ascontiguousarray(faceCounts , dtype=np.int64).tobytes())
+    digest.update(b'|')
+    digest.update(np.ascontiguousarray(faceIndices , dtype=np.int64).tobytes())
+    digest.update(repr((int(vtxCount) ,) + tuple(options)).encode('utf-8'))
+    return digest.hexdigest()
+
+
+class CachedReconstruction(object):
+    # Everything position independent about a reconstruction: the coarse polygons, the corner mapping and
+    # the sparse operator taking the fine points (N , 3) to the coarse points (M , 3)
+
+    def __init__(self , faceCounts , faceIndices , fineCorners , operator , levels):
+        self.faceCounts = faceCounts
+        self.faceIndices = faceIndices
+        self.fineCorners = fineCorners
+        self.operator = operator
+        self.levels = levels
+
+    def apply(self , points):
+        return np.asarray(self.operator.dot(np.asarray(points , dtype=np.float64).reshape(-1 , 3)))
+
+    def applyMany(self , pointSets):
+        # All frames / targets side by side, so they go through one sparse product
+        pointSets = [np.asarray(points , dtype=np.float64).reshape(-1 , 3) for points in pointSets]
+        if not pointSets:
+            return []
+        result = np.asarray(self.operator.dot(np.hstack(pointSets)))
+        return [result[: , 3 * k:3 * k + 3] for k in range(len(pointSets))]
+
+
+def buildReconstruction(faceCounts , faceIndices , vtxCount , levels=1 , reverse=False , curvature=True ,
+                        sharpCorners=True):
+    # Same levels as unsubdivide, but every level is kept as a sparse matrix and chained into one operator
+    from scipy import sparse
+
+    faceCounts = np.asarray(faceCounts , dtype=np.int64)
+    faceIndices = np.asarray(faceIndices , dtype=np.int64)
+    fineCorners = np.arange(len(faceIndices))
+    operator = sparse.identity(vtxCount , format='csr')
+
+    done = 0
+    while not levels or done < levels:
+        report = preflight(faceCounts , faceIndices , vtxCount)
+        if not report.faceCount:
+            break
+        topology = report.topology
+        topology.buildAdjacency()
+        labels = classifyShells(topology , reverse , report)
+        if (labels == LABEL_UNKNOWN).all():
+            break
+
+        if curvature:
+            level = InverseRules(topology , labels , sharpCorners).operator()
+        else:
+            level = sparse.identity(vtxCount , format='csr')
+        faceCounts , faceIndices , vtxIds , corners = buildCoarseFaces(topology , labels)
+        operator = level[vtxIds].dot(operator).tocsr()
+        fineCorners = fineCorners[corners]
+        vtxCount = len(vtxIds)
+        done += 1
+
+    operator.eliminate_zeros()
+    return CachedReconstruction(faceCounts , faceIndices , fineCorners , operator , done)
+
+
+class OperatorCache(object):
+    # Least recently used reconstructions keyed by topology, for frame caches and blendshape targets
+
+    def __init__(self , maxSize=8):
+        self.maxSize = maxSize
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self , faceCounts , faceIndices , vtxCount , levels=1 , reverse=False , curvature=True ,
+            sharpCorners=True):
+        key = topologyKey(faceCounts , faceIndices , vtxCount , levels , reverse , curvature , sharpCorners)
+        entry = self.entries.pop(key , None)
+        if entry is None:
+            self.misses += 1
+            entry = buildReconstruction(faceCounts , faceIndices , vtxCount , levels , reverse , curvature ,
+                                        sharpCorners)
+        else:
+            self.hits += 1
+        self.entries[key] = entry
+        while len(self.entries) > self.maxSize:
+            self.entries.popitem(last=False)
+        return entry
+
+    def clear(self):
+        self.entries.clear()
+
+
+defaultCache = OperatorCache()
+
+
+def unsubdivideSequence(faceCounts , faceIndices , pointSets , levels=1 , reverse=False , curvature=True ,
+                        sharpCorners=True , cache=None):
+    # Reconstruct many point sets of one topology (frames of a cache, blendshape targets) at once.
+    # Returns face counts, face indices, one coarse (M , 3) array per point set, fineCorners and the levels removed.
+    pointSets = list(pointSets)
+    vtxCount = len(np.asarray(pointSets[0]).reshape(-1 , 3)) if pointSets else int(np.max(faceIndices)) + 1
+    entry = (cache or defaultCache).get(faceCounts , faceIndices , vtxCount , levels , reverse , curvature ,
+                                        sharpCorners)
+    return entry.faceCounts , entry.faceIndices , entry.applyMany(pointSets) , entry.fineCorners , entry.levels
@@ -0,0 +1,135 @@
+import numpy as np
+
+from subdivProfile import getProfiler
+from subdivProgress import getProgress
+from subdivTopology import gatherCsr
+
+LABEL_UNKNOWN = -1
+LABEL_COARSE = 0
+LABEL_EDGE = 1
+LABEL_FACE = 2
+
+
+def classifyVertices(topology , startVertices , startLabel=LABEL_COARSE):
+    # Breadth-first walk over the quads of a once subdivided mesh. Every quad is (coarse, edge, face, edge),
+    # so a labelled coarse or face corner fixes the three other corners. Each vertex enters the frontier once.
+    labels = np.full(topology.vtxCount , LABEL_UNKNOWN , dtype=np.int8)
+    frontier = np.unique(np.atleast_1d(np.asarray(startVertices , dtype=np.int64)))
+    labels[frontier] = startLabel
+    profiler = getProfiler()
+    progress = getProgress()
+    labelled = len(frontier)
+
+    while len(frontier):
+        profiler.count('waves')
+        profiler.count('verticesVisited' , len(frontier))
+        progress.update(labelled / float(max(topology.vtxCount , 1)))
+        corners , owners = gatherCsr(topology.vtxCornerOffsets , topology.vtxCorner , frontier)
+        faces = topology.cornerFace[corners]
+        isQuad = topology.faceCounts[faces] == 4
+        corners = corners[isQuad]
+        owners = owners[isQuad]
+        faces = faces[isQuad]
+
+        base = topology.faceOffsets[faces]
+        local = topology.cornerLocal[corners]
+        targets = topology.faceIndices[np.concatenate([base + (local + 1) % 4 ,
+                                                       base + (local + 3) % 4 ,
+                                                       base + (local + 2) % 4])]
+        values = np.concatenate([np.full(2 * len(corners) , LABEL_EDGE , dtype=np.int8) ,
+                                 (LABEL_FACE - labels[frontier[owners]]).astype(np.int8)])
+
+        fresh = labels[targets] == LABEL_UNKNOWN
+        labels[targets[fresh]] = values[fresh]
+        frontier = np.unique(targets[fresh])
+        labelled += len(frontier)
+        frontier = frontier[labels[frontier] != LABEL_EDGE]
+
+    return labels
+
+
+def buildCoarseFaces(topology , labels):
+    # Coarse polygons straight from the labels: walking the quads around a face centre (coarse, edge, face, edge)
+    # visits its coarse vertices in winding order. Faces not consumed by any coarse polygon are kept as they are.
+    # Returns face counts, face indices, the fine id of every kept vertex (ascending) and the fine corner every
+    # output corner comes from (for carrying UVs over).
+    faceCentres = np.flatnonzero(labels == LABEL_FACE)
+    corners , owners = gatherCsr(topology.vtxCornerOffsets , topology.vtxCorner , faceCentres)
+    faces = topology.cornerFace[corners]
+    quadCount = np.bincount(owners , minlength=len(faceCentres))
+    isQuad = np.bincount(owners , weights=topology.faceCounts[faces] == 4 , minlength=len(faceCentres))
+    valid = isQuad == quadCount
+
+    base = topology.faceOffsets[faces]
+    local = topology.cornerLocal[corners]
+    edgeIn = topology.faceIndices[base + (local + 1) % 4]
+    edgeOut = topology.faceIndices[base + (local + 3) % 4]
+    coarseCorner = base + (local + 2) % 4
+
+    # Next quad around the same face centre: the one whose incoming edge point is our outgoing one
+    keys = owners * topology.vtxCount + edgeIn
+    order = np.argsort(keys , kind='stable')
+    found = np.searchsorted(keys[order] , owners * topology.vtxCount + edgeOut)
+    found = np.minimum(found , max(len(keys) - 1 , 0))
+    following = order[found]
+    valid[owners[keys[following] != owners * topology.vtxCount + edgeOut]] = False
+
+    valid[owners[labels[topology.faceIndices[coarseCorner]] != LABEL_COARSE]] = False
+    rows = np.flatnonzero(valid)
+
+    counts = quadCount[rows]
+    offsets = np.zeros(len(rows) + 1 , dtype=np.int64)
+    np.cumsum(counts , out=offsets[1:])
+    starts = (np.cumsum(quadCount) - quadCount)[rows]
+    fineCorners = np.zeros(offsets[-1] , dtype=np.int64)
+    current = starts.copy()
+    for step in range(int(counts.max()) if len(counts) else 0):
+        active = np.flatnonzero(counts > step)
+        fineCorners[offsets[active] + step] = coarseCorner[current[active]]
+        current[active] = following[current[active]]
+
+    # A face centre only owns its quads if the walk closed after exactly counts steps
+    closed = current == starts
+    fineCorners = fineCorners[np.repeat(closed , counts)]
+    counts = counts[closed]
+    rows = rows[closed]
+
+    consumed = np.zeros(topology.faceCount , dtype=bool)
+    consumed[faces[np.isin(owners , rows)]] = True
+    keptFaces = np.flatnonzero(~consumed)
+    keptCorners , _ = gatherCsr(topology.faceOffsets , np.arange(len(topology.faceIndices)) , keptFaces)
+
+    counts = np.concatenate([counts , topology.faceCounts[keptFaces]])
+    fineCorners = np.concatenate([fineCorners , keptCorners])
+    fineIndices = topology.faceIndices[fineCorners]
+
+    kept = np.zeros(topology.vtxCount , dtype=bool)
+    kept[fineIndices] = True
+    vtxIds = np.flatnonzero(kept)
+    remap = np.cumsum(kept) - 1
+    return counts , remap[fineIndices] , vtxIds , fineCorners
+
+
+def inconsistentFaces(topology , labels):
+    # Faces that are not a (coarse, edge, face, edge) quad in some rotation
+    isQuad = topology.faceCounts == 4
+    quads = np.flatnonzero(isQuad)
+    corners = labels[topology.faceIndices[topology.faceOffsets[quads][: , None] + np.arange(4)]]
+    pattern = np.array([LABEL_COARSE , LABEL_EDGE , LABEL_FACE , LABEL_EDGE] , dtype=np.int8)
+    consistent = np.zeros(len(quads) , dtype=bool)
+    for shift in range(4):
+        consistent |= (corners == np.roll(pattern , shift)).all(axis=1)
+    bad = ~isQuad
+    bad[quads[~consistent]] = True
+    return bad
+
+
+def inconsistentVertices(topology , labels):
+    # Face centres sit inside the mesh with valence >= 3, edge midpoints have valence 4 (3 on the boundary)
+    boundary = topology.vtxBoundary
+    valence = topology.valence
+    isFace = labels == LABEL_FACE
+    isEdge = labels == LABEL_EDGE
+    badFace = isFace & (boundary | (valence < 3))
+    badEdge = isEdge & ~np.where(boundary , valence == 3 , valence == 4)
+    return badFace | badEdge
@@ -0,0 +1,216 @@
+from multiprocessing.pool import ThreadPool
+
+import numpy as np
+
+from subdivClassify import (LABEL_COARSE , LABEL_FACE , LABEL_UNKNOWN , buildCoarseFaces , classifyVertices ,
+                            inconsistentFaces , inconsistentVertices)
+from subdivProfile import getProfiler
+from subdivSolve import InverseRules , scatterSum , solveCoarsePositions
+from subdivTopology import PreflightReport , extractFaces , gatherCsr , preflight
+
+# How much smaller (relative) the face centre residual of one starting point has to be to beat the other one,
+# closer than that a shell that works both ways keeps the default
+PARITY_MARGIN = 0.25
+
+
+def shellErrors(topology , labels , report , pinned=None):
+    # Unknown vertices, inconsistent faces and inconsistent vertices of every shell, 0 = a once subdivided shell.
+    # Pinned vertices (the rim of a region) skip the valence checks.
+    vtxShell = report.vtxShell
+    shellCount = report.shellCount
+    badFaces = inconsistentFaces(topology , labels)
+    badVertices = inconsistentVertices(topology , labels)
+    if pinned is not None:
+        badVertices &= ~pinned
+    return (np.bincount(vtxShell[labels == LABEL_UNKNOWN] , minlength=shellCount) +
+            np.bincount(vtxShell[topology.faceIndices[topology.faceOffsets[:-1][badFaces]]] , minlength=shellCount) +
+            np.bincount(vtxShell[badVertices] , minlength=shellCount))
+
+
+def classifyParity(topology , reverse , report , pinned=None):
+    labels = classifyVertices(topology , report.startVertices , LABEL_FACE if reverse else LABEL_COARSE)
+    return labels , shellErrors(topology , labels , report , pinned)
+
+
+def faceResiduals(topology , labels , points , sharpCorners , report):
+    # RMS distance per shell between the face centres and the centres of the coarse points around them once
+    # those are solved: close to 0 for the starting point the mesh was really subdivided from. Centres next to
+    # a coarse point the rules could not solve are left out, a shell without any measurable centre gets 0.
+    rules = InverseRules(topology , labels , sharpCorners)
+    coarse = rules.apply(points)
+    centres = np.flatnonzero(labels == LABEL_FACE)
+    corners , owners = gatherCsr(topology.vtxCornerOffsets , topology.vtxCorner , centres)
+    faces = topology.cornerFace[corners]
+    diagonal = topology.faceIndices[topology.faceOffsets[faces] + (topology.cornerLocal[corners] + 2) % 4]
+    cornerCount = np.bincount(owners , minlength=len(centres))
+    measured = (np.bincount(owners , weights=rules.solved[diagonal] , minlength=len(centres)) == cornerCount) & (
+        cornerCount > 0)
+    means = scatterSum(owners , coarse[diagonal] , len(centres)) / np.maximum(cornerCount , 1)[: , None]
+    shells = report.vtxShell[centres[measured]]
+    errors = np.bincount(shells , weights=((points[centres] - means)[measured] ** 2).sum(axis=1) ,
+                         minlength=report.shellCount)
+    return np.sqrt(errors / np.maximum(np.bincount(shells , minlength=report.shellCount) , 1))
+
+
+def chooseParity(topology , report=None , points=None , sharpCorners=True , pinned=None):
+    # Both starting points are classified side by side, every shell keeps the one that makes it a consistent
+    # once subdivided mesh. When both do, the one whose face centres sit clearly closer to the middle of their
+    # solved coarse faces wins (given the points), else the default one. Returns the labels, which shells use the
+    # reverse starting point, the errors per shell of the default and the reverse starting point and which shells
+    # work both ways without a clear winner.
+    if report is None:
+        report = PreflightReport(topology)
+    pool = ThreadPool(2)
+    try:
+        results = pool.map(lambda reverse: classifyParity(topology , reverse , report , pinned) , (False , True))
+    finally:
+        pool.close()
+        pool.join()
+    (defaultLabels , defaultErrors) , (reverseLabels , reverseErrors) = results
+
+    useReverse = (reverseErrors == 0) & (defaultErrors > 0)
+    both = (defaultErrors == 0) & (reverseErrors == 0)
+    ambiguous = both.copy()
+    if points is not None and both.any():
+        residuals = []
+        for labels , errors in results:
+            labels = labels.copy()
+            labels[(errors > 0)[report.vtxShell]] = LABEL_UNKNOWN
+            residuals.append(faceResiduals(topology , labels , points , sharpCorners , report))
+        reverseBetter = residuals[1] < residuals[0] * (1 - PARITY_MARGIN)
+        defaultBetter = residuals[0] < residuals[1] * (1 - PARITY_MARGIN)
+        useReverse |= both & reverseBetter
+        ambiguous &= ~(reverseBetter | defaultBetter)
+
+    labels = np.where(useReverse[report.vtxShell] , reverseLabels , defaultLabels)
+    labels[((defaultErrors > 0) & (reverseErrors > 0))[report.vtxShell]] = LABEL_UNKNOWN
+    return labels , useReverse , defaultErrors , reverseErrors , ambiguous
+
+
+def parityMessage(useReverse , defaultErrors , reverseErrors , ambiguous=None):
+    valid = (defaultErrors == 0) | (reverseErrors == 0)
+    if not valid.any():
+        return 'Neither starting point gives a subdivided mesh'
+    parity = 'reverse' if useReverse[valid].all() else 'default' if not useReverse.any() else 'mixed'
+    message = 'Auto starting point: {0} ({1}/{2} shell(s) reducible'.format(parity , int(valid.sum()) , len(valid))
+    if ambiguous is not None and ambiguous.any():
+        message += ', {0} ambiguous, kept default'.format(int(ambiguous.sum()))
+    return message + ')'
+
+
+def classifyShells(topology , reverse=False , report=None , points=None , sharpCorners=True , pinned=None):
+    # Labels of every shell from its own start vertex, shells that are not once subdivided meshes stay unknown.
+    # reverse=None picks the starting point per shell (chooseParity).
+    if report is None:
+        report = PreflightReport(topology)
+    if reverse is None:
+        return chooseParity(topology , report , points , sharpCorners , pinned)[0]
+    labels , errors = classifyParity(topology , reverse , report , pinned)
+    labels[(errors > 0)[report.vtxShell]] = LABEL_UNKNOWN
+    return labels
+
+
+def unsubdivideLevel(faceCounts , faceIndices , points , reverse=False , curvature=True , sharpCorners=True ,
+                     fit=None , report=None):
+    # Remove one subdivision level from face arrays, shells that are not subdivided ones are kept as they are.
+    # fit (a subdivSolve.CoarseFit) solves the coarse points globally, report is the preflight of these arrays
+    # when the caller already has it. Returns None when no shell could be reduced.
+    points = np.asarray(points , dtype=np.float64)
+    profiler = getProfiler()
+    if report is None:
+        report = preflight(faceCounts , faceIndices , len(points))
+    if not report.faceCount:
+        return None
+
+    topology = report.topology
+    with profiler.phase('search'):
+        topology.buildAdjacency()
+        labels = classifyShells(topology , reverse , report , points , sharpCorners)
+    if (labels == LABEL_UNKNOWN).all():
+        return None
+
+    if curvature:
+        with profiler.phase('curvature'):
+            points = solveCoarsePositions(topology , labels , points , sharpCorners , fit)
+
+    with profiler.phase('rebuild'):
+        faceCounts , faceIndices , vtxIds , fineCorners = buildCoarseFaces(topology , labels)
+    profiler.count('levels')
+    return faceCounts , faceIndices , points[vtxIds] , fineCorners
+
+
+def unsubdivide(faceCounts , faceIndices , points , levels=1 , reverse=False , curvature=True , sharpCorners=True ,
+                fineCorners=None , jobs=1 , fit=None , report=None):
+    # Peel up to levels subdivision levels (0 = until irreducible) in memory, every level is derived from the
+    # arrays of the previous one. fineCorners maps output corners to input corners through all levels, report
+    # (the preflight of the input) saves building the first level's topology again.
+    # With jobs > 1 groups of shells are processed in worker threads and merged back into one mesh.
+    # Returns face counts, face indices, points, fineCorners and the number of levels removed.
+    faceCounts = np.asarray(faceCounts , dtype=np.int64)
+    faceIndices = np.asarray(faceIndices , dtype=np.int64)
+    points = np.asarray(points , dtype=np.float64)
+    if fineCorners is None:
+        fineCorners = np.arange(len(faceIndices))
+
+    if jobs > 1:
+        return unsubdivideShells(faceCounts , faceIndices , points , levels , reverse , curvature , sharpCorners ,
+                                 fineCorners , jobs , fit , report)
+
+    done = 0
+    while not levels or done < levels:
+        result = unsubdivideLevel(faceCounts , faceIndices , points , reverse , curvature , sharpCorners , fit ,
+                                  report)
+        report = None
+        if result is None:
+            break
+        faceCounts , faceIndices , points , corners = result
+        fineCorners = fineCorners[corners]
+        done += 1
+
+    return faceCounts , faceIndices , points , fineCorners , done
+
+
+def unsubdivideShells(faceCounts , faceIndices , points , levels , reverse , curvature , sharpCorners ,
+                      fineCorners , jobs , fit=None , report=None):
+    if report is None:
+        report = preflight(faceCounts , faceIndices , len(points))
+    shellCount = report.shellCount
+    if not report.faceCount or not shellCount:
+        return faceCounts , faceIndices , points , fineCorners , 0
+    faceShell = report.vtxShell[faceIndices[report.topology.faceOffsets[:-1]]]
+
+    # Balance the groups by face count, biggest shells first
+    shellFaces = np.bincount(faceShell , minlength=shellCount)
+    groupFaces = np.zeros(min(jobs , shellCount) , dtype=np.int64)
+    shellGroup = np.zeros(shellCount , dtype=np.int64)
+    for shell in np.argsort(-shellFaces , kind='stable'):
+        group = int(np.argmin(groupFaces))
+        shellGroup[shell] = group
+        groupFaces[group] += shellFaces[shell]
+
+    def work(group):
+        counts , indices , vtxIds , corners = extractFaces(faceCounts , faceIndices ,
+                                                           np.flatnonzero(shellGroup[faceShell] == group))
+        result = unsubdivide(counts , indices , points[vtxIds] , levels , reverse , curvature , sharpCorners ,
+                             fit=fit)
+        return result[:4] + (corners , result[4])
+
+    pool = ThreadPool(len(groupFaces))
+    try:
+        results = pool.map(work , range(len(groupFaces)))
+    finally:
+        pool.close()
+        pool.join()
+
+    # Merge, then put the vertices back in their original relative order
+    counts = np.concatenate([r[0] for r in results])
+    vtxOffsets = np.cumsum([0] + [len(r[2]) for r in results])
+    indices = np.concatenate([r[1] + vtxOffsets[g] for g , r in enumerate(results)])
+    mergedPoints = np.concatenate([r[2] for r in results])
+    corners = np.concatenate([r[4][r[3]] for r in results])
+    origin = np.zeros(len(mergedPoints) , dtype=np.int64)
+    origin[indices] = faceIndices[corners]
+    order = np.argsort(origin , kind='stable')
+    remap = np.empty_like(order)
+    remap[order] = np.arange(len(order))
+    return counts , remap[indices] , mergedPoints[order] , fineCorners[corners] , max(r[5] for r in results)
@@ -0,0 +1,62 @@
+import numpy as np
+
+from subdivSolve import scatterSum
+from subdivTopology import MeshTopology
+
+
+def subdivideLevel(faceCounts , faceIndices , points , sharpCorners=True , topology=None):
+    # One Catmull-Clark step on face arrays. New vertices are ordered original vertices, face points, edge
+    # points, every face of n corners becomes n quads (vertex, next edge point, face point, previous edge point).
+    points = np.asarray(points , dtype=np.float64).reshape(-1 , 3)
+    if topology is None:
+        topology = MeshTopology(faceCounts , faceIndices , len(points) , adjacency=False)
+    vtxCount = topology.vtxCount
+    faceCount = topology.faceCount
+    counts = topology.faceCounts.astype(np.float64)[: , None]
+    cornerFace = topology.cornerFace
+    indices = topology.faceIndices
+
+    facePoints = scatterSum(cornerFace , points[indices] , faceCount) / counts
+
+    # Edge points: (v0 + v1 + f0 + f1) / 4 inside, the edge midpoint on the boundary
+    edgeVtx = topology.edgeVertices
+    edgeFaces = topology.edgeFaceCount.astype(np.float64)[: , None]
+    edgeFaceSum = scatterSum(topology.cornerEdge , facePoints[cornerFace] , topology.edgeCount)
+    midpoints = (points[edgeVtx[: , 0]] + points[edgeVtx[: , 1]]) * 0.5
+    edgePoints = np.where(topology.edgeBoundary[: , None] , midpoints ,
+                          (midpoints * 2.0 + edgeFaceSum) / (2.0 + np.maximum(edgeFaces , 1.0)))
+
+    # Vertex points: (F + 2R + (n - 3) P) / n inside, 3/4 P + 1/8 of the boundary neighbours on the boundary
+    valence = topology.valence.astype(np.float64)[: , None]
+    faceSum = scatterSum(indices , facePoints[cornerFace] , vtxCount)
+    vtxFaces = np.bincount(indices , minlength=vtxCount).astype(np.float64)[: , None]
+    ends = edgeVtx.reshape(-1)
+    midSum = scatterSum(ends , np.repeat(midpoints , 2 , axis=0) , vtxCount)
+    safe = np.maximum(valence , 1.0)
+    vtxPoints = (faceSum / np.maximum(vtxFaces , 1.0) + 2.0 * midSum / safe + (valence - 3.0) * points) / safe
+
+    boundaryEdges = np.flatnonzero(topology.edgeBoundary)
+    near = scatterSum(edgeVtx[boundaryEdges].reshape(-1) , points[edgeVtx[boundaryEdges][: , ::-1].reshape(-1)] ,
+                      vtxCount)
+    boundary = topology.vtxBoundary
+    vtxPoints[boundary] = 0.75 * points[boundary] + 0.125 * near[boundary]
+    if sharpCorners:
+        corners = boundary & (topology.valence == 2)
+        vtxPoints[corners] = points[corners]
+    isolated = topology.valence == 0
+    vtxPoints[isolated] = points[isolated]
+
+    cornerPrev = topology.faceOffsets[cornerFace] + (topology.cornerLocal - 1) % topology.faceCounts[cornerFace]
+    edgeBase = vtxCount + faceCount
+    newIndices = np.stack([indices ,
+                           edgeBase + topology.cornerEdge ,
+                           vtxCount + cornerFace ,
+                           edgeBase + topology.cornerEdge[cornerPrev]] , axis=1).reshape(-1)
+    newCounts = np.full(len(indices) , 4 , dtype=np.int64)
+    return newCounts , newIndices , np.concatenate([vtxPoints , facePoints , edgePoints])
+
+
+def subdivide(faceCounts , faceIndices , points , levels=1 , sharpCorners=True):
+    for _ in range(levels):
+        faceCounts , faceIndices , points = subdivideLevel(faceCounts , faceIndices , points , sharpCorners)
+    return faceCounts , faceIndices , points
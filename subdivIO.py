@@ -0,0 +1,258 @@
+import array
+import mmap
+import os
+
+import numpy as np
+
+from subdivProfile import getProfiler
+
+
+class PointIO(object):
+    # Bulk point transfer: one backend read into a contiguous (N , 3) float64 buffer, one backend write back
+
+    def __init__(self , backend):
+        self.backend = backend
+
+    def read(self):
+        profiler = getProfiler()
+        with profiler.phase('read'):
+            points = np.asarray(self.backend.getPointBuffer() , dtype=np.float64)
+            points = points.reshape(-1 , points.shape[-1] if points.ndim > 1 else 3)
+            points = np.ascontiguousarray(points[: , :3])
+        profiler.count('pointsRead' , len(points))
+        return points
+
+    def write(self , points):
+        profiler = getProfiler()
+        with profiler.phase('write'):
+            points = np.ascontiguousarray(points , dtype=np.float64).reshape(-1 , 3)
+            self.backend.setPointBuffer(points)
+        profiler.count('pointsWritten' , len(points))
+
+
+# noinspection PyMethodMayBeStatic
+class ArrayPointBackend(object):
+    # Stand-in for a mesh shape that keeps its points in a flat array.array('d'), no Maya needed
+
+    def __init__(self , points=()):
+        self.buffer = array.array('d')
+        self.reads = 0
+        self.writes = 0
+        self.setPointBuffer(np.asarray(points , dtype=np.float64).reshape(-1 , 3))
+        self.writes = 0
+
+    def getPointBuffer(self):
+        self.reads += 1
+        return np.frombuffer(self.buffer , dtype=np.float64).reshape(-1 , 3)
+
+    def setPointBuffer(self , points):
+        self.writes += 1
+        buffer = array.array('d')
+        data = np.ascontiguousarray(points , dtype=np.float64).tobytes()
+        if hasattr(buffer , 'frombytes'):
+            buffer.frombytes(data)
+        else:
+            buffer.fromstring(data)
+        self.buffer = buffer
+
+
+def maskRanges(length , starts , ends):
+    # Boolean mask that is True inside every [start , end) range
+    delta = np.zeros(length + 1 , dtype=np.int8)
+    delta[starts] += 1
+    delta[ends] -= 1
+    return np.cumsum(delta[:-1] , dtype=np.int8).view(bool)
+
+
+def isWhitespace(data):
+    return (data == 32) | (data == 9) | (data == 10) | (data == 13)
+
+
+def chunkBounds(data , chunkSize):
+    # Split a byte buffer into chunks that end on a newline
+    start = 0
+    while start < len(data):
+        end = min(start + chunkSize , len(data))
+        if end < len(data):
+            newline = np.flatnonzero(data[end:end + (1 << 20)] == 10)
+            while not len(newline) and end < len(data):
+                end = min(end + (1 << 20) , len(data))
+                newline = np.flatnonzero(data[end:end + (1 << 20)] == 10)
+            end = end + newline[0] + 1 if len(newline) else len(data)
+        yield start , end
+        start = end
+
+
+def recordLines(data , tag):
+    # Byte ranges of the records of a chunk starting with tag, without the tag, newline included
+    newlines = np.flatnonzero(data == 10)
+    starts = np.concatenate([[0] , newlines + 1])
+    ends = np.concatenate([newlines + 1 , [len(data)]])
+    starts = starts[:-1] if starts[-1] == len(data) else starts
+    ends = ends[:len(starts)]
+    indented = (data[starts] == 32) | (data[starts] == 9)
+    if indented.any():
+        # Records may be indented, their tag is the first character after the blanks
+        solid = np.where((data == 32) | (data == 9) , len(data) , np.arange(len(data)))
+        nextSolid = np.minimum.accumulate(solid[::-1])[::-1]
+        starts = np.minimum(nextSolid[starts] , ends - 1)
+    second = np.minimum(starts + 1 , len(data) - 1)
+    keep = (data[starts] == ord(tag)) & ((data[second] == 32) | (data[second] == 9)) & (ends - starts > 1)
+    return starts[keep] + 1 , ends[keep]
+
+
+def faceTokens(data , starts , ends):
+    # Face records with the texture/normal parts blanked out, and the number of vertices of every face
+    buf = data[maskRanges(len(data) , starts , ends)]
+    index = np.arange(len(buf) , dtype=np.int32)
+    space = isWhitespace(buf)
+    lastSlash = np.maximum.accumulate(np.where(buf == 47 , index , -1))
+    lastSpace = np.maximum.accumulate(np.where(space , index , -1))
+    buf[lastSlash > lastSpace] = 32
+    space = isWhitespace(buf)
+    tokenStart = ~space & np.concatenate([[True] , space[:-1]])
+    line = np.cumsum(buf == 10 , dtype=np.int32) - (buf == 10)
+    return buf , np.bincount(line[tokenStart] , minlength=len(starts))
+
+
+def fileChunks(path , chunkSize=1 << 23):
+    # Plain sequential reads of at most about chunkSize bytes that end on a newline, no memory map
+    with open(path , 'rb') as objFile:
+        rest = b''
+        while True:
+            data = objFile.read(chunkSize)
+            if not data:
+                break
+            data = rest + data
+            end = data.rfind(b'\n') + 1
+            if not end:
+                rest = data
+                continue
+            rest = data[end:]
+            yield np.frombuffer(data[:end] , dtype=np.uint8).copy()
+        if rest:
+            yield np.frombuffer(rest , dtype=np.uint8).copy()
+
+
+def chunkSizes(chunk):
+    # Vertex, face and face corner records of one chunk
+    starts , ends = recordLines(chunk , 'f')
+    space = isWhitespace(chunk[maskRanges(len(chunk) , starts , ends)])
+    cornerCount = int((~space & np.concatenate([[True] , space[:-1]])).sum()) if len(space) else 0
+    return len(recordLines(chunk , 'v')[0]) , len(starts) , cornerCount
+
+
+def readObjChunks(data , chunkSize):
+    # First pass: sizes, so the second pass can parse straight into preallocated arrays
+    vtxCount = faceCount = cornerCount = 0
+    for start , end in chunkBounds(data , chunkSize):
+        sizes = chunkSizes(data[start:end])
+        vtxCount += sizes[0]
+        faceCount += sizes[1]
+        cornerCount += sizes[2]
+    return vtxCount , faceCount , cornerCount
+
+
+def parseObjChunk(chunk , vtxDone):
+    # Points, face counts and 0 based face indices of one chunk, vtxDone vertices were read before it
+    vStarts , vEnds = recordLines(chunk , 'v')
+    points = np.zeros((len(vStarts) , 3) , dtype=np.float64)
+    if len(vStarts):
+        values = np.fromstring(chunk[maskRanges(len(chunk) , vStarts , vEnds)].tobytes() ,
+                               dtype=np.float64 , sep=' ')
+        if len(values) % len(vStarts) or len(values) < 3 * len(vStarts):
+            # Mixed record lengths (w or vertex colors on some lines only), parse line by line
+            values = np.concatenate([np.fromstring(chunk[s:e].tobytes() , dtype=np.float64 , sep=' ')[:3]
+                                     for s , e in zip(vStarts , vEnds)])
+        points[:] = values.reshape(len(vStarts) , -1)[: , :3]
+
+    fStarts , fEnds = recordLines(chunk , 'f')
+    counts = np.zeros(0 , dtype=np.int64)
+    indices = np.zeros(0 , dtype=np.int64)
+    if len(fStarts):
+        buf , counts = faceTokens(chunk , fStarts , fEnds)
+        indices = np.fromstring(buf.tobytes() , dtype=np.int64 , sep=' ')
+        # Negative indices count back from the last vertex read before the face
+        negative = indices < 0
+        if negative.any():
+            vtxBefore = vtxDone + np.searchsorted(vStarts , fStarts)
+            indices[negative] += np.repeat(vtxBefore , counts)[negative] + 1
+        indices -= 1
+    return points , counts , indices
+
+
+def parseObj(data , chunkSize=1 << 23):
+    vtxCount , faceCount , cornerCount = readObjChunks(data , chunkSize)
+    points = np.empty((vtxCount , 3) , dtype=np.float64)
+    faceCounts = np.empty(faceCount , dtype=np.int64)
+    faceIndices = np.empty(cornerCount , dtype=np.int64)
+
+    vtxDone = faceDone = cornerDone = 0
+    for start , end in chunkBounds(data , chunkSize):
+        chunkPoints , counts , indices = parseObjChunk(data[start:end] , vtxDone)
+        points[vtxDone:vtxDone + len(chunkPoints)] = chunkPoints
+        faceCounts[faceDone:faceDone + len(counts)] = counts
+        faceIndices[cornerDone:cornerDone + len(indices)] = indices
+        vtxDone += len(chunkPoints)
+        faceDone += len(counts)
+        cornerDone += len(indices)
+    return points , faceCounts , faceIndices
+
+
+def readObj(path , cache=False , chunkSize=1 << 23):
+    # Positions and polygons of an OBJ file (texture/normal indices are ignored), parsed chunk by chunk from a
+    # memory map. With cache, the arrays are also kept in a path.npz sidecar keyed by the file mtime and size.
+    stat = os.stat(path)
+    sidecar = path + '.npz'
+    if cache and os.path.exists(sidecar):
+        with np.load(sidecar) as cached:
+            if float(cached['mtime']) == stat.st_mtime and int(cached['size']) == stat.st_size:
+                return cached['points'] , cached['faceCounts'] , cached['faceIndices']
+
+    if not stat.st_size:
+        points , faceCounts , faceIndices = parseObj(np.zeros(0 , dtype=np.uint8))
+    else:
+        with open(path , 'rb') as objFile:
+            mapped = mmap.mmap(objFile.fileno() , 0 , access=mmap.ACCESS_READ)
+            points , faceCounts , faceIndices = parseObj(np.frombuffer(mapped , dtype=np.uint8) , chunkSize)
+            mapped.close()
+
+    if cache:
+        with open(sidecar , 'wb') as cacheFile:
+            np.savez(cacheFile , points=points , faceCounts=faceCounts , faceIndices=faceIndices ,
+                     mtime=stat.st_mtime , size=stat.st_size)
+    return points , faceCounts , faceIndices
+
+
+def writeObjVertices(objFile , points):
+    objFile.write(('v %.17g %.17g %.17g\n' * len(points)) % tuple(np.asarray(points).ravel().tolist()))
+
+
+def writeObjFaces(objFile , faceCounts , faceIndices):
+    # faceIndices are the 0 based corners of exactly these faces, runs of faces with the same vertex count share
+    # one format string
+    faceCounts = np.asarray(faceCounts , dtype=np.int64)
+    offsets = np.concatenate([[0] , np.cumsum(faceCounts)])
+    runs = np.flatnonzero(np.diff(faceCounts)) + 1
+    for runStart , runEnd in zip(np.concatenate([[0] , runs]) , np.concatenate([runs , [len(faceCounts)]])):
+        count = int(faceCounts[runStart])
+        indices = np.asarray(faceIndices[offsets[runStart]:offsets[runEnd]] , dtype=np.int64) + 1
+        objFile.write((('f' + ' %d' * count + '\n') * (runEnd - runStart)) % tuple(indices.tolist()))
+
+
+def writeObj(path , points , faceCounts , faceIndices , blockSize=1 << 16):
+    # Streams vertices and faces out in blocks, %.17g keeps every float64 exact
+    points = np.asarray(points , dtype=np.float64).reshape(-1 , 3)
+    faceCounts = np.asarray(faceCounts , dtype=np.int64)
+    faceIndices = np.asarray(faceIndices , dtype=np.int64)
+
+    with open(path , 'w') as objFile:
+        for start in range(0 , len(points) , blockSize):
+            writeObjVertices(objFile , points[start:start + blockSize])
+
+        corner = 0
+        for start in range(0 , len(faceCounts) , blockSize):
+            counts = faceCounts[start:start + blockSize]
+            size = int(counts.sum())
+            writeObjFaces(objFile , counts , faceIndices[corner:corner + size])
+            corner += size
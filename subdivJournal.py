@@ -0,0 +1,124 @@
+import zlib
+
+import numpy as np
+
+# Journals handed from the tool to the next reconstructSubdivJournal command, see reconstructSubdivJournal.py
+pendingJournals = []
+
+
+class Packed(object):
+    # One array as (optionally zlib compressed) bytes
+
+    def __init__(self , array , dtype , level=1):
+        array = np.ascontiguousarray(array , dtype=dtype)
+        self.dtype = array.dtype
+        self.shape = array.shape
+        self.level = level
+        data = array.tobytes()
+        self.data = zlib.compress(data , level) if level else data
+
+    @property
+    def nbytes(self):
+        return len(self.data)
+
+    def unpack(self):
+        data = zlib.decompress(self.data) if self.level else self.data
+        return np.frombuffer(data , dtype=self.dtype).reshape(self.shape)
+
+
+def unjournaledData(mfnMesh):
+    # What a MeshState does not keep of a mesh, empty when undo can restore it completely
+    lost = []
+    if mfnMesh.getColorSetNames():
+        lost.append('colour sets')
+    if len(mfnMesh.getConnectedShaders(0)[0]) > 1:
+        lost.append('per-face shading')
+    try:
+        creased = len(mfnMesh.getCreaseEdges()[0]) or len(mfnMesh.getCreaseVertices()[0])
+    except RuntimeError:
+        # Meshes without creases fail instead of returning nothing
+        creased = False
+    if creased:
+        lost.append('creases')
+    return lost
+
+
+class MeshState(object):
+    # Points, faces and every UV set of one mesh. Maya keeps float points, so float32 loses nothing.
+
+    def __init__(self , points , faceCounts , faceIndices , uvSets=() , currentUVSet=None , level=1):
+        # uvSets: (name , us , vs , uvCounts , uvIds) of every UV set
+        self.currentUVSet = currentUVSet
+        self.arrays = {
+            'points': Packed(np.asarray(points).reshape(-1 , 3) , np.float32 , level) ,
+            'faceCounts': Packed(faceCounts , np.int32 , level) ,
+            'faceIndices': Packed(faceIndices , np.int32 , level)
+        }
+        self.uvSets = [(name , {
+            'us': Packed(us , np.float32 , level) ,
+            'vs': Packed(vs , np.float32 , level) ,
+            'uvCounts': Packed(uvCounts , np.int32 , level) ,
+            'uvIds': Packed(uvIds , np.int32 , level)
+        }) for name , us , vs , uvCounts , uvIds in uvSets]
+
+    @classmethod
+    def read(cls , mfnMesh , points , level=1):
+        # points come from the caller, who usually has a faster way to read them than MFnMesh.getPoints
+        faceCounts , faceIndices = mfnMesh.getVertices()
+        uvSets = []
+        for uvSet in mfnMesh.getUVSetNames():
+            us , vs = mfnMesh.getUVs(uvSet)
+            uvCounts , uvIds = mfnMesh.getAssignedUVs(uvSet)
+            uvSets.append((uvSet , us , vs , uvCounts , uvIds))
+        return cls(points , faceCounts , faceIndices , uvSets , mfnMesh.currentUVSetName() , level)
+
+    @property
+    def nbytes(self):
+        return sum(packed.nbytes for packed in self.arrays.values()) + sum(
+            packed.nbytes for _ , arrays in self.uvSets for packed in arrays.values())
+
+    def array(self , name):
+        return self.arrays[name].unpack()
+
+    def write(self , mfnMesh , pointArray):
+        # pointArray turns an (n , 3) list into what createInPlace takes (MPointArray in Maya)
+        faceCounts = self.array('faceCounts')
+        mfnMesh.createInPlace(pointArray(self.array('points').astype(np.float64).tolist()) , faceCounts.tolist() ,
+                              self.array('faceIndices').tolist())
+        names = mfnMesh.getUVSetNames()
+        for uvSet , arrays in self.uvSets:
+            uvCounts = arrays['uvCounts'].unpack()
+            if len(uvCounts) != len(faceCounts) or not uvCounts.any():
+                continue
+            if uvSet not in names:
+                mfnMesh.createUVSet(uvSet)
+            mfnMesh.setUVs(arrays['us'].unpack().tolist() , arrays['vs'].unpack().tolist() , uvSet)
+            mfnMesh.assignUVs(uvCounts.tolist() , arrays['uvIds'].unpack().tolist() , uvSet)
+        if self.currentUVSet:
+            mfnMesh.setCurrentUVSetName(self.currentUVSet)
+
+
+class Journal(object):
+    # Meshes changed by one reconstruction, each with its state before and after. meshFn(path) gives the MFnMesh
+    # of a path, undo and redo write the states back in place.
+
+    def __init__(self):
+        self.entries = []
+
+    def add(self , path , before , after):
+        self.entries.append((path , before , after))
+
+    @property
+    def nbytes(self):
+        return sum(before.nbytes + after.nbytes for _ , before , after in self.entries)
+
+    def undo(self , meshFn , pointArray):
+        for path , before , _ in reversed(self.entries):
+            before.write(meshFn(path) , pointArray)
+
+    def redo(self , meshFn , pointArray):
+        for path , _ , after in self.entries:
+            after.write(meshFn(path) , pointArray)
+
+    def message(self):
+        return 'Undo journal: {0} mesh(es), {1} MB'.format(len(self.entries) , round(self.nbytes / 1048576.0 , 2))
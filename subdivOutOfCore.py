@@ -0,0 +1,723 @@
+import os
+import shutil
+import sys
+import tempfile
+
+import numpy as np
+
+from subdivClassify import LABEL_COARSE , LABEL_EDGE , LABEL_FACE , LABEL_UNKNOWN
+from subdivCore import PARITY_MARGIN
+from subdivIO import chunkSizes , fileChunks , parseObjChunk , writeObjFaces , writeObjVertices
+from subdivProfile import getProfiler
+from subdivProgress import getProgress
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+DEFAULT_BUDGET = 512 << 20
+# Interpreter, numpy and the arrays that stay in memory, not scaled by the chunk size
+BASE_RSS = 64 << 20
+# A page fault on a mapped file maps (up to) this much around it
+FAULT_SPAN = 64 << 10
+
+
+def peakRss():
+    # Peak resident set size of this process in bytes (None where the platform does not tell). It never goes down,
+    # so it only measures one run when the process does nothing else.
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def currentRss():
+    try:
+        with open('/proc/self/statm' , 'r') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (IOError , OSError , ValueError , IndexError):
+        return None
+
+
+def chunkFor(budget):
+    # Items per chunk: every item costs a few kB of temporaries (corners, quads, keys, sorts)
+    return max(int((budget - BASE_RSS) // 6144) , 1024)
+
+
+def ranges(count , chunk):
+    for start in range(0 , count , chunk):
+        yield start , min(start + chunk , count)
+
+
+class ScratchStore(object):
+    # numpy.memmap arrays (.npy files) in a scratch directory. Arrays are opened for one chunk and dropped
+    # afterwards, so the pages a chunk touched leave the resident set again.
+
+    def __init__(self , directory=None , keep=False):
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.root = tempfile.mkdtemp(prefix='subdiv_' , dir=directory)
+        self.keep = keep
+        self.peak = 0
+
+    def path(self , name):
+        return os.path.join(self.root , name + '.npy')
+
+    def create(self , name , shape , dtype):
+        # Zero filled (sparse) file
+        array = np.lib.format.open_memmap(self.path(name) , mode='w+' , dtype=dtype , shape=shape)
+        del array
+
+    def open(self , name , mode='r+'):
+        self.sample()
+        return np.load(self.path(name) , mmap_mode=mode)
+
+    def shape(self , name):
+        return self.open(name , 'r').shape
+
+    def fill(self , name , value , chunk):
+        for start , end in ranges(self.shape(name)[0] , chunk):
+            array = self.open(name)
+            array[start:end] = value
+            del array
+
+    def batches(self , name , index , mapBytes , width=None):
+        # Sorted index in batches that touch at most mapBytes of the file each. Mapped pages count as resident
+        # until the map is closed, so every batch goes through a fresh map.
+        array = self.open(name , 'r')
+        rowBytes = array.itemsize * (width or int(np.prod(array.shape[1:])))
+        del array
+        order = np.argsort(index , kind='stable')
+        spans = index[order] * rowBytes // FAULT_SPAN
+        spanCount = np.cumsum(np.concatenate([[True] , spans[1:] != spans[:-1]])) if len(spans) else spans
+        batch = (spanCount - 1) // max(int(mapBytes // FAULT_SPAN) , 1)
+        cuts = np.concatenate([[0] , np.flatnonzero(np.diff(batch)) + 1 , [len(index)]])
+        for start , end in zip(cuts[:-1] , cuts[1:]):
+            yield order[start:end]
+
+    def map(self , name , mode , width=None):
+        array = self.open(name , mode)
+        return array.reshape(-1 , width) if width else array
+
+    def gather(self , name , index , mapBytes , width=None):
+        # array[index] for scattered index
+        index = np.asarray(index , dtype=np.int64)
+        array = self.map(name , 'r' , width)
+        result = np.empty((len(index) ,) + array.shape[1:] , dtype=array.dtype)
+        del array
+        for rows in self.batches(name , index , mapBytes , width):
+            array = self.map(name , 'r' , width)
+            result[rows] = array[index[rows]]
+            del array
+        return result
+
+    def scatter(self , name , index , values , mapBytes , add=False):
+        # array[index] = values (or += for unique index) for scattered index
+        index = np.asarray(index , dtype=np.int64)
+        values = np.asarray(values)
+        for rows in self.batches(name , index , mapBytes):
+            array = self.open(name)
+            if add:
+                array[index[rows]] += values[rows] if values.ndim else values
+            else:
+                array[index[rows]] = values[rows] if values.ndim else values
+            del array
+
+    def remove(self , *names):
+        for name in names:
+            if os.path.exists(self.path(name)):
+                os.remove(self.path(name))
+
+    def sample(self):
+        rss = currentRss()
+        if rss:
+            self.peak = max(self.peak , rss)
+
+    def close(self):
+        if not self.keep:
+            shutil.rmtree(self.root , ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self , *args):
+        self.close()
+        return False
+
+
+def storeArrays(faceCounts , faceIndices , points , scratch=None , chunk=1 << 20):
+    # Copy in-memory (or memory mapped) arrays into a new store
+    store = ScratchStore(scratch)
+    store.create('faceCounts' , (len(faceCounts) ,) , np.int64)
+    store.create('faceIndices' , (len(faceIndices) ,) , np.int64)
+    store.create('points' , (len(points) , 3) , np.float64)
+    for name , source in (('faceCounts' , faceCounts) , ('faceIndices' , faceIndices) , ('points' , points)):
+        for start , end in ranges(len(source) , chunk):
+            array = store.open(name)
+            array[start:end] = source[start:end]
+            del array
+    return store
+
+
+def readObjToStore(path , scratch=None , budget=DEFAULT_BUDGET):
+    # OBJ straight into a store: one pass for the sizes, one to parse, the file is read, not memory mapped.
+    # Parsing takes about 32 times the text it is given.
+    chunkSize = max(int(budget // 64) , 1 << 16)
+    vtxCount = faceCount = cornerCount = 0
+    for chunk in fileChunks(path , chunkSize):
+        sizes = chunkSizes(chunk)
+        vtxCount += sizes[0]
+        faceCount += sizes[1]
+        cornerCount += sizes[2]
+
+    store = ScratchStore(scratch)
+    store.create('points' , (vtxCount , 3) , np.float64)
+    store.create('faceCounts' , (faceCount ,) , np.int64)
+    store.create('faceIndices' , (cornerCount ,) , np.int64)
+    vtxDone = faceDone = cornerDone = 0
+    for chunk in fileChunks(path , chunkSize):
+        points , counts , indices = parseObjChunk(chunk , vtxDone)
+        for name , start , values in (('points' , vtxDone , points) , ('faceCounts' , faceDone , counts) ,
+                                      ('faceIndices' , cornerDone , indices)):
+            if len(values):
+                array = store.open(name)
+                array[start:start + len(values)] = values
+                del array
+        vtxDone += len(points)
+        faceDone += len(counts)
+        cornerDone += len(indices)
+    return store
+
+
+class OutOfCoreLevel(object):
+    # One inverse Catmull-Clark step of an all quad mesh kept in a store. Vertex -> corner adjacency is a CSR
+    # built with a chunked counting sort, every later pass walks vertex or face ranges of chunk items.
+
+    def __init__(self , store , chunk):
+        self.store = store
+        self.chunk = chunk
+        self.mapBytes = chunk * 1024
+        self.vtxCount = store.shape('points')[0]
+        self.faceCount = store.shape('faceCounts')[0]
+
+    def gather(self , name , index , width=None):
+        return self.store.gather(name , index , self.mapBytes , width)
+
+    def scatter(self , name , index , values , add=False):
+        self.store.scatter(name , index , values , self.mapBytes , add)
+
+    def faces(self , mode='r'):
+        return self.store.open('faceIndices' , mode).reshape(-1 , 4)
+
+    def isQuad(self):
+        for start , end in ranges(self.faceCount , self.chunk):
+            if (self.store.open('faceCounts' , 'r')[start:end] != 4).any():
+                return False
+        return self.store.shape('faceIndices')[0] == 4 * self.faceCount
+
+    def buildCorners(self):
+        store = self.store
+        store.create('cornerCount' , (self.vtxCount ,) , np.int64)
+        for start , end in ranges(self.faceCount , self.chunk):
+            ids , counts = np.unique(self.faces()[start:end] , return_counts=True)
+            self.scatter('cornerCount' , ids , counts , True)
+
+        store.create('vtxCornerOffsets' , (self.vtxCount + 1 ,) , np.int64)
+        carry = 0
+        for start , end in ranges(self.vtxCount , self.chunk):
+            offsets = store.open('vtxCornerOffsets')
+            offsets[start + 1:end + 1] = carry + np.cumsum(store.open('cornerCount' , 'r')[start:end])
+            carry = int(offsets[end])
+            del offsets
+
+        # Corners of every vertex in ascending corner order, cornerCount is reused as the fill cursor
+        store.fill('cornerCount' , 0 , self.chunk)
+        store.create('vtxCorner' , (4 * self.faceCount ,) , np.int64)
+        for start , end in ranges(self.faceCount , self.chunk):
+            ids = np.array(self.faces()[start:end]).reshape(-1)
+            corners = np.arange(4 * start , 4 * end)
+            order = np.argsort(ids , kind='stable')
+            ids = ids[order]
+            first = np.flatnonzero(np.concatenate([[True] , ids[1:] != ids[:-1]]))
+            lengths = np.diff(np.concatenate([first , [len(ids)]]))
+            rank = np.arange(len(ids)) - np.repeat(first , lengths)
+            unique = ids[first]
+            positions = self.gather('vtxCornerOffsets' , ids) + np.repeat(self.gather('cornerCount' , unique) ,
+                                                                          lengths) + rank
+            self.scatter('vtxCorner' , positions , corners[order])
+            self.scatter('cornerCount' , unique , lengths , True)
+        store.remove('cornerCount')
+
+    def gatherCorners(self , vtxs):
+        # Corners around the given vertices, the position of their vertex in vtxs, and the quad neighbours:
+        # next and previous corner (edge points of the fan) and the opposite corner
+        starts , ends = self.gather('vtxCornerOffsets' , np.concatenate([vtxs , vtxs + 1])).reshape(2 , -1)
+        lengths = ends - starts
+        owners = np.repeat(np.arange(len(vtxs)) , lengths)
+        shift = np.repeat(starts - (np.cumsum(lengths) - lengths) , lengths)
+        corners = self.gather('vtxCorner' , np.arange(len(owners)) + shift)
+        quads = self.gather('faceIndices' , corners // 4 , 4)
+        local = corners % 4
+        rows = np.arange(len(corners))
+        return (corners , owners , quads[rows , (local + 1) % 4] , quads[rows , (local + 3) % 4] ,
+                quads[rows , (local + 2) % 4])
+
+    def edgeNeighbours(self , vtxs , owners , nextVtx , prevVtx):
+        # Distinct neighbours of every vertex in the same order as MeshTopology.vtxVtx (bigger ids first), and
+        # how many faces share every edge
+        keys = np.concatenate([owners , owners]) * self.vtxCount + np.concatenate([nextVtx , prevVtx])
+        keys , faceCount = np.unique(keys , return_counts=True)
+        nearOwners = keys // self.vtxCount
+        near = keys % self.vtxCount
+        order = np.lexsort((near , near < vtxs[nearOwners] , nearOwners))
+        return nearOwners[order] , near[order] , faceCount[order]
+
+    def vertexPass(self):
+        store = self.store
+        store.create('valence' , (self.vtxCount ,) , np.int32)
+        store.create('boundary' , (self.vtxCount ,) , bool)
+        store.create('rank' , (self.vtxCount ,) , np.int8)
+        for start , end in ranges(self.vtxCount , self.chunk):
+            vtxs = np.arange(start , end)
+            corners , owners , nextVtx , prevVtx , _ = self.gatherCorners(vtxs)
+            nearOwners , near , faceCount = self.edgeNeighbours(vtxs , owners , nextVtx , prevVtx)
+            valence = np.bincount(nearOwners , minlength=len(vtxs))
+            boundary = np.bincount(nearOwners[faceCount == 1] , minlength=len(vtxs)) > 0
+
+            # Start vertex priority, same as findStartVertices
+            rank = np.full(len(vtxs) , 4 , dtype=np.int8)
+            rank[(valence == 3) & boundary] = 3
+            rank[(valence == 3) & ~boundary] = 2
+            rank[valence > 4] = 1
+            rank[valence == 2] = 0
+            for name , values in (('valence' , valence) , ('boundary' , boundary) , ('rank' , rank)):
+                array = store.open(name)
+                array[start:end] = values
+                del array
+
+    def nextStart(self , cursors):
+        # Lowest (rank , id) vertex not labelled yet: the start vertex of its own shell
+        for rank in range(5):
+            while cursors[rank] < self.vtxCount:
+                start = cursors[rank]
+                end = min(start + 8 * self.chunk , self.vtxCount)
+                hit = np.flatnonzero((self.store.open('rank' , 'r')[start:end] == rank) &
+                                     (self.store.open('labels' , 'r')[start:end] == LABEL_UNKNOWN))
+                if len(hit):
+                    cursors[rank] = start + hit[0]
+                    return start + hit[0]
+                cursors[rank] = end
+        return -1
+
+    def classify(self , reverse=False):
+        # classifyVertices shell by shell, every wave in chunks of frontier vertices
+        store = self.store
+        profiler = getProfiler()
+        progress = getProgress()
+        store.create('labels' , (self.vtxCount ,) , np.int8)
+        store.fill('labels' , LABEL_UNKNOWN , self.chunk)
+        store.create('vtxShell' , (self.vtxCount ,) , np.int32)
+        startLabel = LABEL_FACE if reverse else LABEL_COARSE
+        cursors = [0] * 5
+        shell = 0
+        labelled = 0
+        while True:
+            start = self.nextStart(cursors)
+            if start < 0:
+                break
+            self.scatter('labels' , [start] , startLabel)
+            self.scatter('vtxShell' , [start] , shell)
+            frontier = np.array([start] , dtype=np.int64)
+            labelled += 1
+
+            while len(frontier):
+                profiler.count('waves')
+                profiler.count('verticesVisited' , len(frontier))
+                progress.update(labelled / float(self.vtxCount))
+                parts = []
+                for first , last in ranges(len(frontier) , self.chunk):
+                    vtxs = frontier[first:last]
+                    corners , owners , nextVtx , prevVtx , oppositeVtx = self.gatherCorners(vtxs)
+                    targets = np.concatenate([nextVtx , prevVtx , oppositeVtx])
+                    values = np.concatenate([np.full(2 * len(corners) , LABEL_EDGE , dtype=np.int8) ,
+                                             (LABEL_FACE - self.gather('labels' , vtxs)[owners]).astype(np.int8)])
+                    fresh = self.gather('labels' , targets) == LABEL_UNKNOWN
+                    self.scatter('labels' , targets[fresh] , values[fresh])
+                    self.scatter('vtxShell' , targets[fresh] , shell)
+                    found = np.unique(targets[fresh])
+                    labelled += len(found)
+                    parts.append(found[self.gather('labels' , found) != LABEL_EDGE])
+                frontier = np.unique(np.concatenate(parts))
+            shell += 1
+        return shell
+
+    def validate(self , shellCount):
+        # Shells with an inconsistent face or vertex go back to unknown, like classifyShells.
+        # Returns the number of vertices still labelled.
+        store = self.store
+        badShells = np.zeros(shellCount , dtype=bool)
+        pattern = np.array([LABEL_COARSE , LABEL_EDGE , LABEL_FACE , LABEL_EDGE] , dtype=np.int8)
+        for start , end in ranges(self.faceCount , self.chunk):
+            quads = np.asarray(self.faces()[start:end])
+            corners = self.gather('labels' , quads.reshape(-1)).reshape(-1 , 4)
+            consistent = np.zeros(len(quads) , dtype=bool)
+            for shift in range(4):
+                consistent |= (corners == np.roll(pattern , shift)).all(axis=1)
+            badShells[self.gather('vtxShell' , quads[~consistent , 0])] = True
+
+        for start , end in ranges(self.vtxCount , self.chunk):
+            labels = np.asarray(store.open('labels' , 'r')[start:end])
+            boundary = np.asarray(store.open('boundary' , 'r')[start:end])
+            valence = np.asarray(store.open('valence' , 'r')[start:end])
+            bad = labels == LABEL_UNKNOWN
+            bad |= (labels == LABEL_FACE) & (boundary | (valence < 3))
+            bad |= (labels == LABEL_EDGE) & ~np.where(boundary , valence == 3 , valence == 4)
+            badShells[store.open('vtxShell' , 'r')[start:end][bad]] = True
+
+        remaining = 0
+        for start , end in ranges(self.vtxCount , self.chunk):
+            labels = store.open('labels')
+            if badShells.any():
+                labels[start:end][badShells[store.open('vtxShell' , 'r')[start:end]]] = LABEL_UNKNOWN
+            remaining += int((labels[start:end] != LABEL_UNKNOWN).sum())
+            del labels
+        return remaining
+
+    def chooseParity(self , sharpCorners=True):
+        # subdivCore.chooseParity for the whole mesh, one starting point after the other (two label sets would
+        # not fit the budget): the one that keeps more vertices wins, on a tie the reverse one only with a face
+        # centre residual smaller by PARITY_MARGIN. Leaves the labels of the winner, returns how many are labelled.
+        remaining = self.validate(self.classify(False))
+        reverseRemaining = self.validate(self.classify(True))
+        if reverseRemaining == remaining and remaining:
+            self.solve(True , sharpCorners)
+            reverseResidual = self.residual()
+            self.validate(self.classify(False))
+            self.solve(True , sharpCorners)
+            if reverseResidual < self.residual() * (1 - PARITY_MARGIN):
+                self.validate(self.classify(True))
+        elif reverseRemaining < remaining:
+            self.validate(self.classify(False))
+        return max(remaining , reverseRemaining)
+
+    def residual(self):
+        # subdivCore.faceResiduals over the whole mesh, after solve
+        total = 0.0
+        count = 0
+        for start , end in ranges(self.vtxCount , self.chunk):
+            centres = start + np.flatnonzero(self.store.open('labels' , 'r')[start:end] == LABEL_FACE)
+            if not len(centres):
+                continue
+            corners , owners , _ , _ , diagonal = self.gatherCorners(centres)
+            cornerCount = np.bincount(owners , minlength=len(centres))
+            measured = (np.bincount(owners , weights=self.gather('solved' , diagonal) , minlength=len(centres)) ==
+                        cornerCount) & (cornerCount > 0)
+            means = np.zeros((len(centres) , 3))
+            np.add.at(means , owners , self.gather('newPoints' , diagonal))
+            means /= np.maximum(cornerCount , 1)[: , None]
+            total += float(((self.gather('points' , centres) - means)[measured] ** 2).sum())
+            count += int(measured.sum())
+        return np.sqrt(total / max(count , 1))
+
+    def solve(self , curvature=True , sharpCorners=True):
+        # InverseRules chunk by chunk: boundary and valence >= 4 vertices directly, valence 3 vertices are
+        # collected and solved in rounds at the end
+        store = self.store
+        store.create('newPoints' , (self.vtxCount , 3) , np.float64)
+        store.create('solved' , (self.vtxCount ,) , bool)
+        valence3 = []
+        for start , end in ranges(self.vtxCount , self.chunk):
+            newPoints = store.open('newPoints')
+            newPoints[start:end] = store.open('points' , 'r')[start:end]
+            del newPoints
+            if not curvature:
+                continue
+
+            labels = np.asarray(store.open('labels' , 'r')[start:end])
+            vtxs = start + np.flatnonzero(labels == LABEL_COARSE)
+            if not len(vtxs):
+                continue
+            corners , owners , nextVtx , prevVtx , oppositeVtx = self.gatherCorners(vtxs)
+            nearOwners , near , _ = self.edgeNeighbours(vtxs , owners , nextVtx , prevVtx)
+            vtxPoints = self.gather('points' , vtxs)
+            vtxBoundary = self.gather('boundary' , vtxs)
+            valence = self.gather('valence' , vtxs)
+            nearPoints = self.gather('points' , near)
+            result = np.zeros((len(vtxs) , 3))
+            solved = np.zeros(len(vtxs) , dtype=bool)
+
+            # Boundary vtx: vk = 2 * vk1 - 0.5 * (e0k1 + e1k1)
+            onBoundary = self.gather('boundary' , near)
+            nearCount = np.bincount(nearOwners[onBoundary] , minlength=len(vtxs))
+            ok = vtxBoundary & (nearCount == 2)
+            if sharpCorners:
+                ok &= valence != 2
+            sums = np.zeros((len(vtxs) , 3))
+            np.add.at(sums , nearOwners[onBoundary] , nearPoints[onBoundary])
+            result[ok] = 2.0 * vtxPoints[ok] - 0.5 * sums[ok]
+            solved |= ok
+
+            # Not boundary vtx with connected edges n >= 4: vk = A * vk1 + B * sum(ek1) + Y * sum(fk1)
+            inner = ~vtxBoundary & (valence >= 4)
+            edgeSums = np.zeros((len(vtxs) , 3))
+            np.add.at(edgeSums , nearOwners , nearPoints)
+            diagonals = np.unique(owners * self.vtxCount + oppositeVtx)
+            diagonals = diagonals[~np.isin(diagonals , nearOwners * self.vtxCount + near)]
+            diagonals = diagonals[diagonals % self.vtxCount != vtxs[diagonals // self.vtxCount]]
+            faceSums = np.zeros((len(vtxs) , 3))
+            np.add.at(faceSums , diagonals // self.vtxCount , self.gather('points' , diagonals % self.vtxCount))
+            n = valence[inner].astype(np.float64)[: , None]
+            result[inner] = (n / (n - 3.0) * vtxPoints[inner] + (-4.0 / (n * (n - 3.0))) * edgeSums[inner] +
+                             (1.0 / (n * (n - 3.0))) * faceSums[inner])
+            solved |= inner
+            valence3.append(vtxs[~vtxBoundary & (valence == 3)])
+
+            newPoints = store.open('newPoints')
+            newPoints[vtxs[solved]] = result[solved]
+            solvedFlags = store.open('solved')
+            solvedFlags[vtxs[solved]] = True
+            del newPoints , solvedFlags
+
+        if curvature and valence3:
+            self.solveValence3(np.concatenate(valence3))
+
+    def solveValence3(self , vtxs):
+        # Not boundary vtx with connected edges n == 3: vk = 4 * ek1 - f0k1 - f1k1 - ek, as in InverseRules
+        store = self.store
+        if not len(vtxs):
+            return
+        corners , owners , nextVtx , prevVtx , _ = self.gatherCorners(vtxs)
+        owners , edgePoints , _ = self.edgeNeighbours(vtxs , owners , nextVtx , prevVtx)
+        pairVtx = vtxs[owners]
+        pairCount = len(edgePoints)
+
+        corners , cornerOwners , nextVtx , prevVtx , _ = self.gatherCorners(edgePoints)
+        pairs , near , _ = self.edgeNeighbours(edgePoints , cornerOwners , nextVtx , prevVtx)
+        labels = self.gather('labels' , near)
+        isCoarse = (labels == LABEL_COARSE) & (near != pairVtx[pairs])
+        isFace = labels == LABEL_FACE
+        nearCount = np.bincount(pairs[isCoarse] , minlength=pairCount)
+        nearVtx = np.zeros(pairCount , dtype=np.int64)
+        nearVtx[pairs[isCoarse]] = near[isCoarse]
+        faceCount = np.bincount(pairs[isFace] , minlength=pairCount)
+        valid = (nearCount == 1) & (faceCount == 2) & ~self.gather('boundary' , nearVtx)
+
+        facePairs = pairs[isFace]
+        faceOrder = np.argsort(facePairs , kind='stable')
+        facePairs = facePairs[faceOrder]
+        faceVtxs = near[isFace][faceOrder]
+        faceStart = np.minimum(np.searchsorted(facePairs , np.arange(pairCount)) , max(len(faceVtxs) - 2 , 0))
+
+        # Solved flags of every vertex involved, kept in memory while the rounds run
+        involved = np.unique(np.concatenate([pairVtx , nearVtx]))
+        solved = self.gather('solved' , involved)
+        nearSlot = np.searchsorted(involved , nearVtx)
+        pairSlot = np.searchsorted(involved , pairVtx)
+        while True:
+            ready = np.flatnonzero(valid & solved[nearSlot] & ~solved[pairSlot])
+            if not len(ready):
+                break
+            ready = ready[np.unique(pairVtx[ready] , return_index=True)[1]]
+            self.scatter('newPoints' , pairVtx[ready] ,
+                         4.0 * self.gather('points' , edgePoints[ready]) -
+                         self.gather('points' , faceVtxs[faceStart[ready]]) -
+                         self.gather('points' , faceVtxs[faceStart[ready] + 1]) -
+                         self.gather('newPoints' , nearVtx[ready]))
+            solved[pairSlot[ready]] = True
+            getProfiler().count('valence3Rounds')
+
+    def emit(self , output):
+        # buildCoarseFaces chunk by chunk into the output store: coarse polygons around valid face centres, then
+        # every face that is not consumed, then the kept vertices in ascending order
+        store = self.store
+        store.create('outCounts' , (self.faceCount ,) , np.int64)
+        store.create('outIndices' , (4 * self.faceCount ,) , np.int64)
+        store.create('centreValid' , (self.vtxCount ,) , bool)
+        faceDone = cornerDone = 0
+        for start , end in ranges(self.vtxCount , self.chunk):
+            centres = start + np.flatnonzero(store.open('labels' , 'r')[start:end] == LABEL_FACE)
+            if not len(centres):
+                continue
+            corners , owners , edgeIn , edgeOut , coarseVtx = self.gatherCorners(centres)
+            quadCount = np.bincount(owners , minlength=len(centres))
+            valid = quadCount > 0
+
+            keys = owners * self.vtxCount + edgeIn
+            order = np.argsort(keys , kind='stable')
+            found = np.minimum(np.searchsorted(keys[order] , owners * self.vtxCount + edgeOut) ,
+                               max(len(keys) - 1 , 0))
+            following = order[found]
+            valid[owners[keys[following] != owners * self.vtxCount + edgeOut]] = False
+            valid[owners[self.gather('labels' , coarseVtx) != LABEL_COARSE]] = False
+            rows = np.flatnonzero(valid)
+
+            counts = quadCount[rows]
+            offsets = np.zeros(len(rows) + 1 , dtype=np.int64)
+            np.cumsum(counts , out=offsets[1:])
+            starts = (np.cumsum(quadCount) - quadCount)[rows]
+            indices = np.zeros(offsets[-1] , dtype=np.int64)
+            current = starts.copy()
+            for step in range(int(counts.max()) if len(counts) else 0):
+                active = np.flatnonzero(counts > step)
+                indices[offsets[active] + step] = coarseVtx[current[active]]
+                current[active] = following[current[active]]
+
+            closed = current == starts
+            indices = indices[np.repeat(closed , counts)]
+            counts = counts[closed]
+            self.scatter('centreValid' , centres[rows[closed]] , True)
+            outCounts = store.open('outCounts')
+            outCounts[faceDone:faceDone + len(counts)] = counts
+            outIndices = store.open('outIndices')
+            outIndices[cornerDone:cornerDone + len(indices)] = indices
+            faceDone += len(counts)
+            cornerDone += len(indices)
+            del outCounts , outIndices
+
+        for start , end in ranges(self.faceCount , self.chunk):
+            quads = np.asarray(self.faces()[start:end])
+            kept = quads[~self.gather('centreValid' , quads.reshape(-1)).reshape(-1 , 4).any(axis=1)]
+            outCounts = store.open('outCounts')
+            outCounts[faceDone:faceDone + len(kept)] = 4
+            outIndices = store.open('outIndices')
+            outIndices[cornerDone:cornerDone + kept.size] = kept.reshape(-1)
+            faceDone += len(kept)
+            cornerDone += kept.size
+            del outCounts , outIndices
+
+        # Kept vertices and their new ids
+        store.create('kept' , (self.vtxCount ,) , bool)
+        for start , end in ranges(cornerDone , self.chunk):
+            self.scatter('kept' , store.open('outIndices' , 'r')[start:end] , True)
+        store.create('remap' , (self.vtxCount ,) , np.int64)
+        keptCount = 0
+        for start , end in ranges(self.vtxCount , self.chunk):
+            kept = np.asarray(store.open('kept' , 'r')[start:end])
+            remap = store.open('remap')
+            remap[start:end] = keptCount + np.cumsum(kept) - 1
+            keptCount += int(kept.sum())
+            del remap
+
+        output.create('faceCounts' , (faceDone ,) , np.int64)
+        output.create('faceIndices' , (cornerDone ,) , np.int64)
+        output.create('points' , (keptCount , 3) , np.float64)
+        for start , end in ranges(faceDone , self.chunk):
+            faceCounts = output.open('faceCounts')
+            faceCounts[start:end] = store.open('outCounts' , 'r')[start:end]
+            del faceCounts
+        for start , end in ranges(cornerDone , self.chunk):
+            faceIndices = output.open('faceIndices')
+            faceIndices[start:end] = self.gather('remap' , store.open('outIndices' , 'r')[start:end])
+            del faceIndices
+        pointDone = 0
+        for start , end in ranges(self.vtxCount , self.chunk):
+            ids = start + np.flatnonzero(store.open('kept' , 'r')[start:end])
+            points = output.open('points')
+            points[pointDone:pointDone + len(ids)] = store.open('newPoints' , 'r')[ids]
+            pointDone += len(ids)
+            del points
+
+    def run(self , reverse=False , curvature=True , sharpCorners=True):
+        # The next level in a new store, None when the mesh is not all quads or no shell could be reduced
+        profiler = getProfiler()
+        progress = getProgress()
+        with profiler.phase('validation'):
+            if not self.faceCount or not self.isQuad():
+                return None
+        progress.begin('adjacency')
+        with profiler.phase('adjacency'):
+            self.buildCorners()
+            self.vertexPass()
+        progress.begin('search')
+        with profiler.phase('search'):
+            if reverse is None:
+                remaining = self.chooseParity(sharpCorners)
+            else:
+                remaining = self.validate(self.classify(reverse))
+            if not remaining:
+                return None
+        progress.begin('curvature')
+        with profiler.phase('curvature'):
+            self.solve(curvature , sharpCorners)
+        progress.begin('rebuild')
+        output = ScratchStore(os.path.dirname(self.store.root))
+        with profiler.phase('rebuild'):
+            try:
+                self.emit(output)
+            except BaseException:
+                output.close()
+                raise
+        profiler.count('levels')
+        return output
+
+
+class OutOfCoreResult(object):
+    # Final arrays of an out-of-core run, still in their store, plus how much memory it took
+
+    def __init__(self , store , levels , budget , chunk):
+        self.store = store
+        self.levels = levels
+        self.budget = budget
+        self.chunk = chunk
+        self.peakRss = peakRss()
+        self.sampledRss = store.peak
+
+    @property
+    def withinBudget(self):
+        # None when the platform does not report the peak
+        return None if self.peakRss is None else self.peakRss <= self.budget
+
+    def arrays(self):
+        # Memory mapped (read only) face counts, face indices and points
+        return self.store.open('faceCounts' , 'r') , self.store.open('faceIndices' , 'r') , self.store.open('points' ,
+                                                                                                             'r')
+
+    def writeObj(self , path , blockSize=1 << 16):
+        with open(path , 'w') as objFile:
+            for start , end in ranges(self.store.shape('points')[0] , blockSize):
+                writeObjVertices(objFile , self.store.open('points' , 'r')[start:end])
+            corner = 0
+            for start , end in ranges(self.store.shape('faceCounts')[0] , blockSize):
+                counts = np.asarray(self.store.open('faceCounts' , 'r')[start:end])
+                size = int(counts.sum())
+                writeObjFaces(objFile , counts , self.store.open('faceIndices' , 'r')[corner:corner + size])
+                corner += size
+
+    def asDict(self):
+        return {
+            'levels': self.levels ,
+            'budget': self.budget ,
+            'chunk': self.chunk ,
+            'peakRss': self.peakRss ,
+            'sampledRss': self.sampledRss ,
+            'withinBudget': self.withinBudget
+        }
+
+    def close(self):
+        self.store.close()
+
+
+def unsubdivideOutOfCore(store , levels=1 , reverse=False , curvature=True , sharpCorners=True ,
+                         budget=DEFAULT_BUDGET , chunk=None):
+    # Memory bounded unsubdivide of an all quad mesh in a store (see storeArrays and readObjToStore). Every level
+    # gets a new store, the previous one is removed. Peak RSS is reported against the budget, it does not
+    # include the page cache the memory maps go through.
+    chunk = chunk or chunkFor(budget)
+    done = 0
+    peak = store.peak
+    while not levels or done < levels:
+        level = OutOfCoreLevel(store , chunk)
+        try:
+            output = level.run(reverse , curvature , sharpCorners)
+        except BaseException:
+            store.close()
+            raise
+        peak = max(peak , store.peak)
+        if output is None:
+            break
+        store.close()
+        store = output
+        done += 1
+    store.peak = max(store.peak , peak)
+    return OutOfCoreResult(store , done , budget , chunk)
@@ -0,0 +1,212 @@
+import multiprocessing
+import os
+import sys
+
+import numpy as np
+
+from subdivClassify import LABEL_FACE , LABEL_UNKNOWN , buildCoarseFaces
+from subdivCore import chooseParity , classifyParity , parityMessage , unsubdivide
+from subdivProfile import Profiler , getProfiler , profiling
+from subdivProgress import getProgress
+from subdivRegion import Region , unsubdivideRegion
+from subdivSolve import solveCoarsePositions
+from subdivTopology import preflight
+
+# Phases of reconstructArrays, counted as done when a worker process returns a mesh
+MESH_PHASES = ('adjacency' , 'search' , 'curvature' , 'rebuild')
+
+
+class PoolUnavailable(Exception):
+    pass
+
+
+def searchLabels(job , topology , report , points , pinned=None):
+    # Labels and the messages for the log, or an error when no shell is a subdivided mesh
+    if job['reverse'] is not None:
+        labels , errors = classifyParity(topology , job['reverse'] , report , pinned)
+        labels[(errors > 0)[report.vtxShell]] = LABEL_UNKNOWN
+        starting = 'reverse' if job['reverse'] else 'default'
+        if (labels == LABEL_UNKNOWN).all():
+            return labels , [] , 'The {0} starting point gives no subdivided mesh'.format(starting)
+        messages = []
+        if (errors > 0).any():
+            shells = np.flatnonzero(errors > 0)
+            messages.append('{0}: shell(s) {1}{2} are not subdivided meshes from the {3} starting point, kept as they '
+                            'are'.format(job['name'] , ', '.join(str(shell) for shell in shells[:10]) ,
+                                         '...' if len(shells) > 10 else '' , starting))
+        return labels , messages , None
+    labels , useReverse , defaultErrors , reverseErrors , ambiguous = chooseParity(topology , report , points ,
+                                                                                   job['sharpCorners'] , pinned)
+    message = parityMessage(useReverse , defaultErrors , reverseErrors , ambiguous)
+    messages = ['{0}: {1}'.format(job['name'] , message)]
+    if not ((defaultErrors == 0) | (reverseErrors == 0)).any():
+        return labels , messages , message
+    return labels , messages , None
+
+
+def rebuildWarning(job):
+    # Several levels can only be written as a new mesh, even when deleting edges was asked for
+    if job['rebuild'] or job['levels'] == 1:
+        return []
+    return ['{0}: removing several levels rebuilds the mesh, only the current UV set is kept (other UV sets, colour '
+            'sets, creases and per-face shading are lost)'.format(job['name'])]
+
+
+def reconstructWhole(job , points):
+    progress = getProgress()
+    profiler = getProfiler()
+    report = job.get('report') or preflight(job['faceCounts'] , job['faceIndices'] , len(points))
+    topology = report.topology
+    progress.begin('adjacency')
+    with profiler.phase('adjacency'):
+        topology.buildAdjacency()
+
+    progress.begin('search')
+    with profiler.phase('search'):
+        labels , messages , error = searchLabels(job , topology , report , points)
+    if error:
+        return {'error': error , 'messages': messages}
+
+    progress.begin('curvature')
+    newPoints = points
+    if job['curvature']:
+        with profiler.phase('curvature'):
+            newPoints = solveCoarsePositions(topology , labels , points , job['sharpCorners'] , job['fit'])
+
+    if not (job['rebuild'] or job['levels'] != 1):
+        return {'points': newPoints if job['curvature'] else None , 'vtxFace': np.flatnonzero(labels == LABEL_FACE) ,
+                'messages': messages}
+
+    progress.begin('rebuild')
+    messages.extend(rebuildWarning(job))
+    faceCounts , faceIndices , vtxIds , fineCorners = buildCoarseFaces(topology , labels)
+    coarsePoints = newPoints[vtxIds]
+    # Further levels are peeled off the in-memory arrays, the mesh is only written once
+    if job['levels'] != 1:
+        faceCounts , faceIndices , coarsePoints , fineCorners , levels = unsubdivide(
+            faceCounts , faceIndices , coarsePoints , max(job['levels'] - 1 , 0) , job['reverse'] , job['curvature'] ,
+            job['sharpCorners'] , fineCorners , fit=job['fit'])
+        messages.append('Removed {0} subdivision level(s)'.format(levels + 1))
+    return {'coarse': (coarsePoints , faceCounts , faceIndices , fineCorners) , 'fineFaceCounts': topology.faceCounts ,
+            'messages': messages}
+
+
+def reconstructRegion(job , points):
+    # Only the selected faces are searched and solved, their rim and the rest stay put
+    progress = getProgress()
+    profiler = getProfiler()
+    region = job.get('region') or Region(job['faceCounts'] , job['faceIndices'] , len(points) , job['faceIds'])
+    progress.begin('adjacency')
+    with profiler.phase('adjacency'):
+        region.topology.buildAdjacency()
+
+    progress.begin('search')
+    with profiler.phase('search'):
+        labels , messages , error = searchLabels(job , region.topology , region.report , region.localPoints(points) ,
+                                                 region.rim)
+    if error:
+        return {'error': error , 'messages': messages}
+
+    progress.begin('curvature')
+    newPoints = points
+    if job['curvature']:
+        if job['fit'] is not None:
+            messages.append('The global fit does not apply to selected faces, solving them locally')
+        with profiler.phase('curvature'):
+            newPoints = region.solve(labels , points , job['sharpCorners'])
+
+    if not (job['rebuild'] or job['levels'] != 1):
+        return {'points': newPoints if job['curvature'] else None , 'vtxFace': region.faceCentres(labels) ,
+                'messages': messages}
+
+    progress.begin('rebuild')
+    messages.extend(rebuildWarning(job))
+    with profiler.phase('rebuild'):
+        faceCounts , faceIndices , coarsePoints , fineCorners , regionFaces = region.rebuild(labels , newPoints)
+        if job['levels'] != 1:
+            faceCounts , faceIndices , coarsePoints , fineCorners , levels = unsubdivideRegion(
+                faceCounts , faceIndices , coarsePoints , np.arange(len(faceCounts) - regionFaces , len(faceCounts)) ,
+                max(job['levels'] - 1 , 0) , job['reverse'] , job['curvature'] , job['sharpCorners'] , fineCorners)
+            messages.append('Removed {0} subdivision level(s)'.format(levels + 1))
+    return {'coarse': (coarsePoints , faceCounts , faceIndices , fineCorners) , 'fineFaceCounts': region.faceCounts ,
+            'messages': messages}
+
+
+def reconstructArrays(job):
+    # One mesh from plain arrays and options to what gets written back, no Maya and no shared state.
+    # job: name, faceCounts, faceIndices, points, faceIds (selected faces or None), levels, reverse, curvature,
+    # sharpCorners, rebuild, fit, optionally the report / region validation already built.
+    # Returns {'coarse', 'fineFaceCounts'} or {'points', 'vtxFace'} (edges to delete), or {'error'}, with 'messages'.
+    points = np.asarray(job['points'] , dtype=np.float64)
+    if job.get('faceIds') is not None:
+        return reconstructRegion(job , points)
+    return reconstructWhole(job , points)
+
+
+def reconstructMesh(job):
+    # Worker process entry point, profiles on its own and sends the report back with the result
+    profiler = Profiler(job['name']) if job.get('profile') else None
+    with profiling(profiler):
+        result = reconstructArrays(job)
+    if profiler:
+        result['profile'] = profiler.report()
+    return result
+
+
+def mayapyExecutable(executable=None):
+    # Workers have to start the mayapy interpreter that comes with Maya, not another Maya. It sits next to the
+    # executable on Windows and Linux, in Contents/bin next to Contents/MacOS on macOS.
+    executable = executable or sys.executable
+    folder , name = os.path.split(executable)
+    base , extension = os.path.splitext(name)
+    if base.lower() not in ('maya' , 'maya.bin'):
+        return executable
+    name = 'mayapy' + (extension if extension.lower() == '.exe' else '')
+    for mayapy in (os.path.join(folder , name) , os.path.join(os.path.dirname(folder) , 'bin' , name)):
+        if os.path.exists(mayapy):
+            return mayapy
+    raise PoolUnavailable('no mayapy next to {0}'.format(executable))
+
+
+def workerCount(workers , jobCount):
+    # workers 0 / None = one per core, never more than there are jobs
+    return min(workers or multiprocessing.cpu_count() , jobCount)
+
+
+def poolMap(function , jobs , workers=None , poll=None , interval=0.1):
+    # Yields (index , result) as the jobs finish in spawned worker processes. poll() runs while waiting, whatever it
+    # raises (a cancel) drops the jobs not started yet. Raises PoolUnavailable when there is no working pool (Python
+    # 2, no processes allowed, workers failing to start), the caller then runs the jobs without a result itself.
+    try:
+        from concurrent.futures import FIRST_COMPLETED , ProcessPoolExecutor , wait
+        from concurrent.futures.process import BrokenProcessPool
+    except ImportError as e:
+        raise PoolUnavailable(str(e))
+
+    try:
+        context = multiprocessing.get_context('spawn')
+        context.set_executable(mayapyExecutable())
+        executor = ProcessPoolExecutor(workerCount(workers , len(jobs)) , mp_context=context)
+        # Largest meshes first so a big one does not end up alone at the tail
+        order = sorted(range(len(jobs)) , key=lambda index: -len(jobs[index]['faceIndices']))
+        futures = dict((executor.submit(function , jobs[index]) , index) for index in order)
+    except (OSError , ValueError , NotImplementedError) as e:
+        raise PoolUnavailable(str(e))
+
+    finished = False
+    try:
+        waiting = set(futures)
+        while waiting:
+            done , waiting = wait(waiting , timeout=interval , return_when=FIRST_COMPLETED)
+            for future in done:
+                yield futures[future] , future.result()
+            if poll:
+                poll()
+        finished = True
+    except BrokenProcessPool as e:
+        raise PoolUnavailable(str(e) or 'a worker process died')
+    finally:
+        if not finished:
+            for future in futures:
+                future.cancel()
+        executor.shutdown(wait=finished)
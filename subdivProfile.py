@@ -0,0 +1,197 @@
+import cProfile
+import io
+import json
+import pstats
+import threading
+import time
+
+
+class NullPhase(object):
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self , *args):
+        return False
+
+
+# noinspection PyMethodMayBeStatic,PyUnusedLocal
+class NullProfiler(object):
+    # Does nothing, the default so instrumented code costs one method call per phase or counter
+    enabled = False
+    nullPhase = NullPhase()
+
+    def phase(self , name):
+        return self.nullPhase
+
+    def count(self , name , value=1):
+        pass
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def report(self):
+        return {}
+
+
+class Phase(object):
+
+    def __init__(self , profiler , name):
+        self.profiler = profiler
+        self.name = name
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self , *args):
+        self.profiler.addTime(self.name , time.time() - self.start)
+        return False
+
+
+class Profiler(object):
+    # Named phase timers and counters for one mesh, with an optional cProfile run around everything. The total
+    # only runs inside profiling blocks, so a mesh profiled in several steps counts its own work only.
+    enabled = True
+
+    def __init__(self , name='' , cprofile=False):
+        self.name = name
+        self.timers = {}
+        self.calls = {}
+        self.counters = {}
+        self.order = []
+        self.lock = threading.Lock()
+        self.profile = cProfile.Profile() if cprofile else None
+        self.elapsed = 0.0
+        self.started = None
+        self.depth = 0
+
+    def phase(self , name):
+        return Phase(self , name)
+
+    def addTime(self , name , seconds):
+        with self.lock:
+            if name not in self.timers:
+                self.order.append(name)
+                self.timers[name] = 0.0
+                self.calls[name] = 0
+            self.timers[name] += seconds
+            self.calls[name] += 1
+
+    def count(self , name , value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name , 0) + value
+
+    def merge(self , report):
+        # Phases and counters of a report made somewhere else, a worker process
+        for name , phase in report.get('phases' , {}).items():
+            self.addTime(name , phase['time'])
+            with self.lock:
+                self.calls[name] += phase['calls'] - 1
+        for name , value in report.get('counters' , {}).items():
+            self.count(name , value)
+        with self.lock:
+            self.elapsed += report.get('total' , 0.0)
+
+    def start(self):
+        with self.lock:
+            if not self.depth:
+                self.started = time.time()
+            self.depth += 1
+
+    def stop(self):
+        with self.lock:
+            if self.depth:
+                self.depth -= 1
+                if not self.depth:
+                    self.elapsed += time.time() - self.started
+
+    @property
+    def total(self):
+        return self.elapsed + (time.time() - self.started if self.depth else 0.0)
+
+    def profileStats(self , limit=25):
+        if not self.profile:
+            return None
+        stream = io.StringIO() if str is not bytes else io.BytesIO()
+        pstats.Stats(self.profile , stream=stream).sort_stats('cumulative').print_stats(limit)
+        return stream.getvalue()
+
+    def report(self):
+        result = {
+            'name': self.name ,
+            'total': round(self.total , 6) ,
+            'phases': dict((name , {'time': round(self.timers[name] , 6) , 'calls': self.calls[name]})
+                           for name in self.order) ,
+            'counters': dict(self.counters)
+        }
+        if self.profile:
+            result['cprofile'] = self.profileStats()
+        return result
+
+    def toJson(self , indent=None):
+        return json.dumps(self.report() , indent=indent , sort_keys=True)
+
+    def message(self):
+        lines = ['{0}: {1} sec'.format(self.name or 'total' , round(self.total , 4))]
+        for name in self.order:
+            lines.append('  {0:<14}{1:>10} sec{2:>6}x'.format(name , round(self.timers[name] , 4) , self.calls[name]))
+        for name in sorted(self.counters):
+            lines.append('  {0:<14}{1:>10}'.format(name , self.counters[name]))
+        return '\n'.join(lines)
+
+
+nullProfiler = NullProfiler()
+activeProfiler = [nullProfiler]
+
+
+def getProfiler():
+    # The profiler of the mesh being processed, a NullProfiler when profiling is off
+    return activeProfiler[-1]
+
+
+class profiling(object):
+    # with profiling(Profiler('mesh')) as profiler: ... makes it the active profiler inside the block,
+    # cProfile (when asked for) only runs inside these blocks
+
+    def __init__(self , profiler=None):
+        self.profiler = profiler or nullProfiler
+
+    def __enter__(self):
+        activeProfiler.append(self.profiler)
+        self.profiler.start()
+        if getattr(self.profiler , 'profile' , None):
+            self.profiler.profile.enable()
+        return self.profiler
+
+    def __exit__(self , *args):
+        if getattr(self.profiler , 'profile' , None):
+            self.profiler.profile.disable()
+        self.profiler.stop()
+        activeProfiler.pop()
+        return False
+
+
+def aggregateReports(reports):
+    # Sum of the phase times, calls and counters of many per mesh reports
+    result = {'meshes': 0 , 'total': 0.0 , 'phases': {} , 'counters': {}}
+    for report in reports:
+        if not report:
+            continue
+        result['meshes'] += 1
+        result['total'] += report.get('total' , 0.0)
+        for name , phase in report.get('phases' , {}).items():
+            summed = result['phases'].setdefault(name , {'time': 0.0 , 'calls': 0})
+            summed['time'] += phase['time']
+            summed['calls'] += phase['calls']
+        for name , value in report.get('counters' , {}).items():
+            result['counters'][name] = result['counters'].get(name , 0) + value
+
+    result['total'] = round(result['total'] , 6)
+    for phase in result['phases'].values():
+        phase['time'] = round(phase['time'] , 6)
+    return result
@@ -0,0 +1,126 @@
+import threading
+import time
+
+# Share of every phase in the progress of one mesh, phases not listed only poll for cancellation
+PHASE_WEIGHTS = {
+    'validation': 10 ,
+    'read': 5 ,
+    'adjacency': 15 ,
+    'search': 35 ,
+    'curvature': 10 ,
+    'rebuild': 20 ,
+    'operator': 30 ,
+    'write': 5
+}
+
+
+class Cancelled(Exception):
+    pass
+
+
+# noinspection PyMethodMayBeStatic,PyUnusedLocal
+class NullProgress(object):
+    enabled = False
+
+    def setItems(self , items):
+        pass
+
+    def begin(self , name):
+        pass
+
+    def update(self , fraction=0.0 , force=False):
+        pass
+
+    def end(self):
+        pass
+
+    def complete(self , phases):
+        pass
+
+
+class Progress(object):
+    # Progress over items * the weights of the given phases. show(percent , phase) runs at most every interval
+    # seconds and only when the percentage moved by step, isCancelled() is polled at the same rate and raises
+    # Cancelled. Phases only ever add up, so the order they run in (all validations first) does not matter.
+    # Updates from worker threads are ignored, the UI callbacks only run on the thread that made the Progress.
+
+    enabled = True
+
+    def __init__(self , items=1 , phases=None , show=None , isCancelled=None , interval=0.1 , step=1.0 ,
+                 weights=None):
+        self.show = show
+        self.isCancelled = isCancelled
+        self.interval = interval
+        self.step = step
+        self.weights = weights or PHASE_WEIGHTS
+        self.phases = phases or list(self.weights)
+        self.setItems(items)
+        self.name = ''
+        self.weight = 0.0
+        self.completed = 0.0
+        self.percent = 0.0
+        self.shown = -1.0
+        self.last = 0.0
+        self.updates = 0
+        self.thread = threading.current_thread()
+
+    def setItems(self , items):
+        self.items = max(int(items) , 1)
+        self.total = float(max(self.items * sum(self.weights.get(phase , 0) for phase in self.phases) , 1))
+
+    def begin(self , name):
+        # The phase running so far counts as complete
+        self.completed += self.weight
+        self.name = name
+        self.weight = self.weights.get(name , 0) if name in self.phases else 0
+        self.update(0.0 , True)
+
+    def update(self , fraction=0.0 , force=False):
+        if threading.current_thread() is not self.thread:
+            return
+        now = time.time()
+        if not force and now - self.last < self.interval:
+            return
+        self.last = now
+        fraction = min(max(fraction , 0.0) , 1.0)
+        self.percent = min(100.0 * (self.completed + self.weight * fraction) / self.total , 100.0)
+        if self.isCancelled and self.isCancelled():
+            raise Cancelled('Cancelled during {0}'.format(self.name))
+        if self.show and (force or self.percent - self.shown >= self.step):
+            self.shown = self.percent
+            self.updates += 1
+            self.show(self.percent , self.name)
+
+    def end(self):
+        self.completed += self.weight
+        self.weight = 0.0
+        self.name = ''
+
+    def complete(self , phases):
+        # Phases of one item that ran somewhere else (a worker process) count as done
+        self.completed += sum(self.weights.get(name , 0) for name in phases if name in self.phases)
+        self.update(0.0 , True)
+
+
+nullProgress = NullProgress()
+activeProgress = [nullProgress]
+
+
+def getProgress():
+    return activeProgress[-1]
+
+
+class progressing(object):
+    # with progressing(Progress(...)): long running code inside reports to it through getProgress()
+
+    def __init__(self , progress=None):
+        self.progress = progress or nullProgress
+
+    def __enter__(self):
+        activeProgress.append(self.progress)
+        return self.progress
+
+    def __exit__(self , *args):
+        activeProgress.pop()
+        self.progress.end()
+        return False
@@ -0,0 +1,172 @@
+import numpy as np
+
+from subdivClassify import LABEL_COARSE , LABEL_EDGE , LABEL_FACE , LABEL_UNKNOWN , buildCoarseFaces
+from subdivCore import classifyShells
+from subdivProfile import getProfiler
+from subdivSolve import solveCoarsePositions
+from subdivTopology import extractFaces , gatherCsr , preflight
+
+
+def facesUsing(faceCounts , faceIndices , vtxMask):
+    # Faces with at least one corner on a masked vertex, one pass over the corners
+    faceCounts = np.asarray(faceCounts , dtype=np.int64)
+    cornerFace = np.repeat(np.arange(len(faceCounts)) , faceCounts)
+    return np.unique(cornerFace[vtxMask[np.asarray(faceIndices , dtype=np.int64)]])
+
+
+def selectionFaces(faceCounts , faceIndices , vtxCount , faceIds=() , vtxIds=()):
+    # Faces of a component selection: the selected faces and every face using a selected vertex
+    faceIds = np.asarray(faceIds , dtype=np.int64)
+    if len(vtxIds):
+        vtxMask = np.zeros(vtxCount , dtype=bool)
+        vtxMask[np.asarray(vtxIds , dtype=np.int64)] = True
+        faceIds = np.concatenate([faceIds , facesUsing(faceCounts , faceIndices , vtxMask)])
+    return np.unique(faceIds)
+
+
+def ringFaces(faceCounts , faceIndices , vtxCount , faceIds):
+    # One ring of faces around faceIds: the other faces sharing a vertex with them
+    faceCounts = np.asarray(faceCounts , dtype=np.int64)
+    faceOffsets = np.zeros(len(faceCounts) + 1 , dtype=np.int64)
+    np.cumsum(faceCounts , out=faceOffsets[1:])
+    faceIndices = np.asarray(faceIndices , dtype=np.int64)
+    vtxMask = np.zeros(vtxCount , dtype=bool)
+    vtxMask[gatherCsr(faceOffsets , faceIndices , faceIds)[0]] = True
+    return np.setdiff1d(facesUsing(faceCounts , faceIndices , vtxMask) , faceIds , assume_unique=True)
+
+
+def seamPoints(topology , labels , keep):
+    # Kept edge points and the sorted edge keys of the two coarse vertices they sit between
+    edgePoints = np.flatnonzero((labels == LABEL_EDGE) & keep)
+    near , owners = gatherCsr(topology.vtxVtxOffsets , topology.vtxVtx , edgePoints)
+    coarse = labels[near] == LABEL_COARSE
+    near = near[coarse]
+    owners = owners[coarse]
+    paired = np.bincount(owners , minlength=len(edgePoints)) == 2
+    ends = near[paired[owners]].reshape(-1 , 2)
+    keys = topology.edgeKeys(ends[: , 0] , ends[: , 1])
+    order = np.argsort(keys)
+    return keys[order] , edgePoints[paired][order]
+
+
+def insertSeamPoints(topology , labels , keep , counts , fineCorners):
+    # Coarse polygons skip the edge points between their corners. The ones that stay in the mesh (used by kept
+    # faces or by the rest of the mesh) go back in between, so the polygons around them stay closed.
+    keys , edgePoints = seamPoints(topology , labels , keep)
+    if not len(keys):
+        return counts , fineCorners
+    offsets = np.zeros(len(counts) + 1 , dtype=np.int64)
+    np.cumsum(counts , out=offsets[1:])
+    cornerFace = np.repeat(np.arange(len(counts)) , counts)
+    local = np.arange(len(fineCorners)) - offsets[cornerFace]
+    fineIndices = topology.faceIndices[fineCorners]
+    following = fineIndices[offsets[cornerFace] + (local + 1) % counts[cornerFace]]
+    edgeKeys = topology.edgeKeys(fineIndices , following)
+    found = np.minimum(np.searchsorted(keys , edgeKeys) , len(keys) - 1)
+    hit = keys[found] == edgeKeys
+
+    slots = 1 + hit
+    corners = np.repeat(fineCorners , slots)
+    corners[(np.cumsum(slots) - 1)[hit]] = topology.vtxCorner[topology.vtxCornerOffsets[edgePoints[found[hit]]]]
+    return counts + np.bincount(cornerFace[hit] , minlength=len(counts)) , corners
+
+
+class Region(object):
+    # Selected faces of a mesh, reconstructed as a mesh of their own. Region vertices also used by the one ring
+    # around it form the rim: rim points keep their positions, skip the valence checks and stay in the mesh, so
+    # the seam with the untouched faces stays closed. Classification and the solve itself only see the region, but
+    # finding the ring, copying the points and rebuilding are still linear passes over the whole mesh.
+
+    def __init__(self , faceCounts , faceIndices , vtxCount , faceIds):
+        self.faceCounts = np.asarray(faceCounts , dtype=np.int64)
+        self.faceIndices = np.asarray(faceIndices , dtype=np.int64)
+        self.vtxCount = int(vtxCount)
+        self.faceIds = np.unique(np.asarray(faceIds , dtype=np.int64))
+        self.ringIds = ringFaces(self.faceCounts , self.faceIndices , self.vtxCount , self.faceIds)
+
+        counts , indices , self.vtxIds , self.corners = extractFaces(self.faceCounts , self.faceIndices , self.faceIds)
+        self.report = preflight(counts , indices , len(self.vtxIds))
+        self.topology = self.report.topology
+
+        ringMesh = extractFaces(self.faceCounts , self.faceIndices , self.ringIds)
+        self.rim = np.isin(self.vtxIds , ringMesh[2] , assume_unique=True)
+
+    @property
+    def nonQuadFaces(self):
+        return self.faceIds[self.report.nonQuadFaces]
+
+    def localPoints(self , points):
+        return None if points is None else np.asarray(points , dtype=np.float64)[self.vtxIds]
+
+    def classify(self , reverse=False , points=None , sharpCorners=True):
+        self.topology.buildAdjacency()
+        return classifyShells(self.topology , reverse , self.report , self.localPoints(points) , sharpCorners ,
+                              self.rim)
+
+    def solve(self , labels , points , sharpCorners=True):
+        # Full size points with the inner coarse points of the region solved, rim coarse points are left out
+        labels = labels.copy()
+        labels[self.rim & (labels == LABEL_COARSE)] = LABEL_UNKNOWN
+        points = np.array(points , dtype=np.float64)
+        points[self.vtxIds] = solveCoarsePositions(self.topology , labels , points[self.vtxIds] , sharpCorners)
+        return points
+
+    def faceCentres(self , labels):
+        # Mesh ids of the face centres whose quads all lie in the region, for deleting edges in place
+        return self.vtxIds[(labels == LABEL_FACE) & ~self.rim]
+
+    def rebuild(self , labels , points):
+        # The untouched faces followed by the coarse region. Returns face counts, face indices, points, the fine
+        # corner of every output corner and the number of region faces at the end.
+        counts , _ , _ , fineCorners = buildCoarseFaces(self.topology , labels)
+        keep = self.rim.copy()
+        keep[self.topology.faceIndices[fineCorners]] = True
+        counts , fineCorners = insertSeamPoints(self.topology , labels , keep , counts , fineCorners)
+
+        outside = np.ones(len(self.faceCounts) , dtype=bool)
+        outside[self.faceIds] = False
+        outside = np.flatnonzero(outside)
+        outsideMesh = extractFaces(self.faceCounts , self.faceIndices , outside)
+        corners = np.concatenate([outsideMesh[3] , self.corners[fineCorners]])
+        fineIndices = self.faceIndices[corners]
+
+        kept = np.zeros(self.vtxCount , dtype=bool)
+        kept[fineIndices] = True
+        remap = np.cumsum(kept) - 1
+        points = np.asarray(points , dtype=np.float64)[kept]
+        return np.concatenate([outsideMesh[0] , counts]) , remap[fineIndices] , points , corners , len(counts)
+
+
+def unsubdivideRegion(faceCounts , faceIndices , points , faceIds , levels=1 , reverse=False , curvature=True ,
+                      sharpCorners=True , fineCorners=None):
+    # Peel up to levels subdivision levels (0 = until irreducible) off the given faces only, the coarse region of
+    # one level is the region of the next. Returns face counts, face indices, points, fineCorners and the number
+    # of levels removed, like subdivCore.unsubdivide.
+    faceCounts = np.asarray(faceCounts , dtype=np.int64)
+    faceIndices = np.asarray(faceIndices , dtype=np.int64)
+    points = np.asarray(points , dtype=np.float64)
+    if fineCorners is None:
+        fineCorners = np.arange(len(faceIndices))
+    profiler = getProfiler()
+
+    done = 0
+    while not levels or done < levels:
+        with profiler.phase('validation'):
+            region = Region(faceCounts , faceIndices , len(points) , faceIds)
+        if not len(region.faceIds) or len(region.nonQuadFaces):
+            break
+        with profiler.phase('search'):
+            labels = region.classify(reverse , points , sharpCorners)
+        if (labels == LABEL_UNKNOWN).all():
+            break
+        if curvature:
+            with profiler.phase('curvature'):
+                points = region.solve(labels , points , sharpCorners)
+        with profiler.phase('rebuild'):
+            faceCounts , faceIndices , points , corners , regionFaces = region.rebuild(labels , points)
+        faceIds = np.arange(len(faceCounts) - regionFaces , len(faceCounts))
+        fineCorners = fineCorners[corners]
+        profiler.count('levels')
+        done += 1
+
+    return faceCounts , faceIndices , points , fineCorners , done
@@ -0,0 +1,255 @@
+import numpy as np
+
+from subdivClassify import LABEL_COARSE , LABEL_EDGE , LABEL_FACE
+from subdivProfile import getProfiler
+from subdivTopology import gatherCsr
+
+
+def scatterSum(rows , values , rowCount):
+    # Sum (N , 3) values into rowCount rows
+    return np.stack([np.bincount(rows , weights=values[: , k] , minlength=rowCount) for k in range(3)] , axis=1)
+
+
+# noinspection SpellCheckingInspection
+class InverseRules(object):
+    # The inverse of one Catmull-Clark step as linear rules over the fine positions. They only depend on the
+    # topology and labels, so they can be evaluated for any number of position sets.
+    #   direct: vk = sum(weight * fine[col]) for boundary and valence >= 4 vertices
+    #   rounds: vk = sum(weight * fine[col]) - vk(near) for valence 3 vertices, near solved in an earlier step
+
+    def __init__(self , topology , labels , sharpCorners=True):
+        self.vtxCount = topology.vtxCount
+        coarse = labels == LABEL_COARSE
+        boundary = topology.vtxBoundary
+        valence = topology.valence
+        rows = []
+        cols = []
+        weights = []
+        solved = np.zeros(topology.vtxCount , dtype=bool)
+
+        # Boundary vtx: vk = 2 * vk1 - 0.5 * (e0k1 + e1k1)
+        vtxs = np.flatnonzero(coarse & boundary)
+        if sharpCorners:
+            vtxs = vtxs[valence[vtxs] != 2]
+        near , owners = gatherCsr(topology.vtxVtxOffsets , topology.vtxVtx , vtxs)
+        onBoundary = boundary[near]
+        near = near[onBoundary]
+        owners = owners[onBoundary]
+        ok = np.bincount(owners , minlength=len(vtxs)) == 2
+        keep = ok[owners]
+        rows += [vtxs[ok] , vtxs[owners[keep]]]
+        cols += [vtxs[ok] , near[keep]]
+        weights += [np.full(ok.sum() , 2.0) , np.full(keep.sum() , -0.5)]
+        solved[vtxs[ok]] = True
+
+        # Not boundary vtx with connected edges n >= 4: vk = A * vk1 + B * sum(ek1) + Y * sum(fk1)
+        vtxs = np.flatnonzero(coarse & ~boundary & (valence >= 4))
+        n = valence[vtxs].astype(np.float64)
+        edgeNear , edgeOwners = gatherCsr(topology.vtxVtxOffsets , topology.vtxVtx , vtxs)
+        faceNear , faceOwners = gatherCsr(topology.vtxDiagonalOffsets , topology.vtxDiagonal , vtxs)
+        rows += [vtxs , vtxs[edgeOwners] , vtxs[faceOwners]]
+        cols += [vtxs , edgeNear , faceNear]
+        weights += [n / (n - 3.0) , (-4.0 / (n * (n - 3.0)))[edgeOwners] , (1.0 / (n * (n - 3.0)))[faceOwners]]
+        solved[vtxs] = True
+
+        self.directRows = np.concatenate(rows).astype(np.int64)
+        self.directCols = np.concatenate(cols).astype(np.int64)
+        self.directWeights = np.concatenate(weights)
+        self.directVtxs = np.flatnonzero(solved)
+
+        # Not boundary vtx with connected edges n == 3: vk = 4 * ek1 - f0k1 - f1k1 - ek, where ek is the solved
+        # coarse vertex on the other side of the edge point ek1. Solved in rounds, one edge per vertex.
+        vtxs = np.flatnonzero(coarse & ~boundary & (valence == 3))
+        edgePoints , owners = gatherCsr(topology.vtxVtxOffsets , topology.vtxVtx , vtxs)
+        pairVtx = vtxs[owners]
+        pairCount = len(edgePoints)
+
+        near , pairs = gatherCsr(topology.vtxVtxOffsets , topology.vtxVtx , edgePoints)
+        isCoarse = (labels[near] == LABEL_COARSE) & (near != pairVtx[pairs])
+        isFace = labels[near] == LABEL_FACE
+        nearCount = np.bincount(pairs[isCoarse] , minlength=pairCount)
+        nearVtx = np.zeros(pairCount , dtype=np.int64)
+        nearVtx[pairs[isCoarse]] = near[isCoarse]
+        faceCount = np.bincount(pairs[isFace] , minlength=pairCount)
+        valid = (nearCount == 1) & (faceCount == 2) & ~boundary[nearVtx]
+
+        # Faces of every pair, in pair order
+        facePairs = pairs[isFace]
+        faceOrder = np.argsort(facePairs , kind='stable')
+        facePairs = facePairs[faceOrder]
+        faceVtxs = near[isFace][faceOrder]
+        faceStart = np.searchsorted(facePairs , np.arange(pairCount))
+
+        self.rounds = []
+        while True:
+            ready = np.flatnonzero(valid & solved[nearVtx] & ~solved[pairVtx])
+            if not len(ready):
+                break
+            ready = ready[np.unique(pairVtx[ready] , return_index=True)[1]]
+            local = np.arange(len(ready))
+            roundRows = np.concatenate([local , local , local])
+            roundCols = np.concatenate([edgePoints[ready] , faceVtxs[faceStart[ready]] ,
+                                        faceVtxs[faceStart[ready] + 1]])
+            roundWeights = np.concatenate([np.full(len(ready) , 4.0) , np.full(2 * len(ready) , -1.0)])
+            self.rounds.append((pairVtx[ready] , nearVtx[ready] , roundRows , roundCols , roundWeights))
+            solved[pairVtx[ready]] = True
+
+        self.solved = solved
+        getProfiler().count('valence3Rounds' , len(self.rounds))
+
+    def apply(self , positions):
+        positions = np.asarray(positions , dtype=np.float64)
+        result = positions.copy()
+        sums = scatterSum(self.directRows , positions[self.directCols] * self.directWeights[: , None] , self.vtxCount)
+        result[self.directVtxs] = sums[self.directVtxs]
+        for vtxs , near , rows , cols , weights in self.rounds:
+            result[vtxs] = scatterSum(rows , positions[cols] * weights[: , None] , len(vtxs)) - result[near]
+        return result
+
+    def operator(self):
+        # The same rules as one sparse (V , V) matrix, rows of vertices that are not solved are identity rows
+        from scipy import sparse
+
+        size = (self.vtxCount , self.vtxCount)
+        untouched = np.flatnonzero(~np.isin(np.arange(self.vtxCount) , self.directVtxs))
+        matrix = sparse.csr_matrix((np.concatenate([self.directWeights , np.ones(len(untouched))]) ,
+                                    (np.concatenate([self.directRows , untouched]) ,
+                                     np.concatenate([self.directCols , untouched]))) , shape=size)
+        for vtxs , near , rows , cols , weights in self.rounds:
+            rounds = sparse.csr_matrix((weights , (vtxs[rows] , cols)) , shape=size) - \
+                sparse.csr_matrix((np.ones(len(vtxs)) , (vtxs , near)) , shape=size).dot(matrix)
+            keep = np.ones(self.vtxCount)
+            keep[vtxs] = 0.0
+            matrix = (sparse.diags(keep).dot(matrix) + rounds).tocsr()
+        return matrix
+
+
+def subdivisionOperator(topology , labels , sharpCorners=True):
+    # One Catmull-Clark step as a sparse matrix S from the coarse to the fine positions, written on the fine mesh
+    # from its labels (the same rules as subdivForward). Rows are the coarse, edge and face vertices, columns the
+    # coarse vertices. Returns S and the fine ids of its rows and of its columns.
+    from scipy import sparse
+
+    vtxCount = topology.vtxCount
+    boundary = topology.vtxBoundary
+    coarseIds = np.flatnonzero(labels == LABEL_COARSE)
+    edgeIds = np.flatnonzero(labels == LABEL_EDGE)
+    faceIds = np.flatnonzero(labels == LABEL_FACE)
+    column = np.full(vtxCount , -1 , dtype=np.int64)
+    column[coarseIds] = np.arange(len(coarseIds))
+    edgeRow = np.full(vtxCount , -1 , dtype=np.int64)
+    edgeRow[edgeIds] = np.arange(len(edgeIds))
+    faceRow = np.full(vtxCount , -1 , dtype=np.int64)
+    faceRow[faceIds] = np.arange(len(faceIds))
+    shape = (len(coarseIds) , len(faceIds) , len(edgeIds))
+
+    def matrix(rows , cols , weights , rowCount , colCount):
+        return sparse.csr_matrix((weights , (rows , cols)) , shape=(rowCount , colCount))
+
+    # Face points: the mean of the coarse corners of their face (their diagonals)
+    near , owners = gatherCsr(topology.vtxDiagonalOffsets , topology.vtxDiagonal , faceIds)
+    keep = labels[near] == LABEL_COARSE
+    near = near[keep]
+    owners = owners[keep]
+    counts = np.maximum(np.bincount(owners , minlength=shape[1]) , 1).astype(np.float64)
+    faces = matrix(owners , column[near] , 1.0 / counts[owners] , shape[1] , shape[0])
+
+    # Edge points: (c0 + c1 + f0 + f1) / 4 inside, (c0 + c1) / 2 on the boundary
+    near , owners = gatherCsr(topology.vtxVtxOffsets , topology.vtxVtx , edgeIds)
+    isCoarse = labels[near] == LABEL_COARSE
+    isFace = (labels[near] == LABEL_FACE) & ~boundary[edgeIds][owners]
+    ends = matrix(owners[isCoarse] , column[near[isCoarse]] , np.ones(isCoarse.sum()) , shape[2] , shape[0])
+    weight = 1.0 / (2.0 + np.bincount(owners[isFace] , minlength=shape[2]))
+    edges = (sparse.diags(weight).dot(ends) +
+             matrix(owners[isFace] , faceRow[near[isFace]] , weight[owners[isFace]] , shape[2] , shape[1]).dot(faces))
+
+    # Coarse vertices: (F + 2R + (n - 3) v) / n inside, 3/4 v + 1/8 of the boundary neighbours on the boundary
+    n = topology.valence[coarseIds].astype(np.float64)
+    safe = np.maximum(n , 1.0)
+    vtxBoundary = boundary[coarseIds]
+    near , owners = gatherCsr(topology.vtxVtxOffsets , topology.vtxVtx , coarseIds)
+    isEdge = labels[near] == LABEL_EDGE
+    near = near[isEdge]
+    owners = owners[isEdge]
+    alongBoundary = boundary[near]
+    # The other coarse end of every edge point, summed per coarse vertex
+    others = matrix(owners , edgeRow[near] , np.ones(len(near)) , shape[0] , shape[2]).dot(ends) - sparse.diags(n)
+    boundaryOthers = (matrix(owners[alongBoundary] , edgeRow[near[alongBoundary]] , np.ones(alongBoundary.sum()) ,
+                             shape[0] , shape[2]).dot(ends) -
+                      sparse.diags(np.bincount(owners[alongBoundary] , minlength=shape[0]).astype(np.float64)))
+    diagonal , diagonalOwners = gatherCsr(topology.vtxDiagonalOffsets , topology.vtxDiagonal , coarseIds)
+    isFace = labels[diagonal] == LABEL_FACE
+    faceCount = np.maximum(np.bincount(diagonalOwners[isFace] , minlength=shape[0]) , 1).astype(np.float64)
+    faceSum = matrix(diagonalOwners[isFace] , faceRow[diagonal[isFace]] , np.ones(isFace.sum()) , shape[0] ,
+                     shape[1]).dot(faces)
+
+    inner = np.where(vtxBoundary | (n == 0) , 0.0 , 1.0)
+    onBoundary = np.where(vtxBoundary , 1.0 , 0.0)
+    if sharpCorners:
+        onBoundary[vtxBoundary & (n == 2)] = 0.0
+    fixed = 1.0 - inner - onBoundary
+    vertices = (sparse.diags(inner * (n - 2.0) / safe + onBoundary * 0.75 + fixed) +
+                sparse.diags(inner / (safe * safe)).dot(others) +
+                sparse.diags(inner / (safe * faceCount)).dot(faceSum) +
+                sparse.diags(onBoundary * 0.125).dot(boundaryOthers))
+    return (sparse.vstack([vertices , edges , faces]).tocsr() , np.concatenate([coarseIds , edgeIds , faceIds]) ,
+            coarseIds)
+
+
+def columnDot(a , b):
+    # Dot product of every column of two (N , 3) arrays
+    return np.einsum('ij,ij->j' , a , b)
+
+
+class CoarseFit(object):
+    # All coarse positions at once: the least squares solution of S * coarse = fine (S = subdivisionOperator),
+    # conjugate gradients on the normal equations started from the local rules. Stops when the residual of the
+    # normal equations is below tolerance (relative to the right hand side) or after iterations steps.
+
+    def __init__(self , tolerance=1e-6 , iterations=100):
+        self.tolerance = tolerance
+        self.iterations = iterations
+
+    def solve(self , topology , labels , positions , sharpCorners=True , start=None):
+        positions = np.asarray(positions , dtype=np.float64)
+        if start is None:
+            start = InverseRules(topology , labels , sharpCorners).apply(positions)
+        result = np.array(start , dtype=np.float64)
+        matrix , rows , coarseIds = subdivisionOperator(topology , labels , sharpCorners)
+        if not len(coarseIds):
+            return result
+
+        # Three right hand sides (x , y , z) side by side, every column stops on its own
+        transposed = matrix.T.tocsr()
+        normal = transposed.dot(matrix).tocsr()
+        coarse = result[coarseIds]
+        rhs = transposed.dot(positions[rows])
+        residual = rhs - normal.dot(coarse)
+        direction = residual.copy()
+        squared = columnDot(residual , residual)
+        limit = self.tolerance ** 2 * np.maximum(columnDot(rhs , rhs) , 1e-300)
+        done = 0
+        while done < self.iterations and (squared > limit).any():
+            active = squared > limit
+            product = normal.dot(direction)
+            alpha = np.where(active , squared / np.maximum(columnDot(direction , product) , 1e-300) , 0.0)
+            coarse += direction * alpha
+            residual -= product * alpha
+            newSquared = columnDot(residual , residual)
+            direction *= np.where(active , newSquared / np.maximum(squared , 1e-300) , 0.0)
+            direction += residual
+            squared = np.where(active , newSquared , squared)
+            done += 1
+
+        getProfiler().count('fitIterations' , done)
+        result[coarseIds] = coarse
+        return result
+
+
+def solveCoarsePositions(topology , labels , positions , sharpCorners=True , fit=None):
+    # Invert one Catmull-Clark step for the coarse vertices, every other vertex keeps its position.
+    # With a CoarseFit the local rules are only the starting point of the global fit.
+    result = InverseRules(topology , labels , sharpCorners).apply(positions)
+    if fit is None:
+        return result
+    return fit.solve(topology , labels , positions , sharpCorners , result)
@@ -0,0 +1,225 @@
+import numpy as np
+
+from subdivProfile import getProfiler
+
+
+def buildCsr(rows , values , rowCount):
+    # Group values by row: returns offsets (rowCount + 1) and the values sorted by row, stable inside a row
+    rows = np.asarray(rows , dtype=np.int64)
+    order = np.argsort(rows , kind='stable')
+    offsets = np.zeros(rowCount + 1 , dtype=np.int64)
+    np.cumsum(np.bincount(rows , minlength=rowCount) , out=offsets[1:])
+    return offsets , np.asarray(values)[order]
+
+
+def gatherCsr(offsets , values , rows):
+    # Concatenate the CSR rows of the given ids, also returning for every entry the position of its row in rows
+    rows = np.asarray(rows , dtype=np.int64)
+    starts = offsets[rows]
+    lengths = offsets[rows + 1] - starts
+    owners = np.repeat(np.arange(len(rows)) , lengths)
+    shift = np.repeat(starts - (np.cumsum(lengths) - lengths) , lengths)
+    return values[np.arange(len(owners)) + shift] , owners
+
+
+def uniqueSorted(values):
+    values = np.sort(values)
+    if not len(values):
+        return values
+    return values[np.concatenate([[True] , values[1:] != values[:-1]])]
+
+
+# noinspection SpellCheckingInspection
+class MeshTopology(object):
+
+    def __init__(self , faceCounts , faceIndices , vtxCount=None , adjacency=True):
+        self.faceCounts = np.ascontiguousarray(faceCounts , dtype=np.int64)
+        self.faceIndices = np.ascontiguousarray(faceIndices , dtype=np.int64)
+        if vtxCount is None:
+            vtxCount = int(self.faceIndices.max()) + 1 if len(self.faceIndices) else 0
+        self.vtxCount = int(vtxCount)
+        self.faceCount = len(self.faceCounts)
+
+        self.faceOffsets = np.zeros(self.faceCount + 1 , dtype=np.int64)
+        np.cumsum(self.faceCounts , out=self.faceOffsets[1:])
+
+        # Face corners: owner face, position inside the face and the corner that follows it
+        self.cornerFace = np.repeat(np.arange(self.faceCount) , self.faceCounts)
+        self.cornerLocal = np.arange(len(self.faceIndices)) - self.faceOffsets[self.cornerFace]
+        self.cornerNext = (self.faceOffsets[self.cornerFace] +
+                           (self.cornerLocal + 1) % self.faceCounts[self.cornerFace])
+
+        self.hasAdjacency = False
+        self.buildEdges()
+        if adjacency:
+            self.buildAdjacency()
+
+    def edgeKeys(self , a , b):
+        lo = np.minimum(a , b)
+        hi = np.maximum(a , b)
+        return lo * self.vtxCount + hi
+
+    def buildEdges(self):
+        keys = self.edgeKeys(self.faceIndices , self.faceIndices[self.cornerNext])
+        self.edgeKeysSorted , self.cornerEdge = np.unique(keys , return_inverse=True)
+        self.cornerEdge = self.cornerEdge.reshape(-1)
+        self.edgeVertices = np.stack([self.edgeKeysSorted // max(self.vtxCount , 1) ,
+                                      self.edgeKeysSorted % max(self.vtxCount , 1)] , axis=1)
+        self.edgeCount = len(self.edgeVertices)
+
+        self.valence = np.bincount(self.edgeVertices.reshape(-1) , minlength=self.vtxCount)
+        self.edgeFaceCount = np.bincount(self.cornerEdge , minlength=self.edgeCount)
+        self.edgeBoundary = self.edgeFaceCount == 1
+        self.vtxBoundary = np.zeros(self.vtxCount , dtype=bool)
+        self.vtxBoundary[self.edgeVertices[self.edgeBoundary].reshape(-1)] = True
+
+    def buildAdjacency(self):
+        if self.hasAdjacency:
+            return
+        self.hasAdjacency = True
+
+        # Vertex -> vertex
+        src = np.concatenate([self.edgeVertices[: , 0] , self.edgeVertices[: , 1]])
+        dst = np.concatenate([self.edgeVertices[: , 1] , self.edgeVertices[: , 0]])
+        self.vtxVtxOffsets , self.vtxVtx = buildCsr(src , dst , self.vtxCount)
+
+        # Vertex -> face corner
+        self.vtxCornerOffsets , self.vtxCorner = buildCsr(
+            self.faceIndices , np.arange(len(self.faceIndices)) , self.vtxCount)
+
+        # Vertex -> diagonal: vertices sharing a face but not an edge
+        pairSrc = []
+        pairDst = []
+        maxCount = int(self.faceCounts.max()) if self.faceCount else 0
+        counts = self.faceCounts[self.cornerFace]
+        for k in range(2 , maxCount - 1):
+            corners = np.flatnonzero(counts - k >= 2)
+            opposite = self.faceOffsets[self.cornerFace[corners]] + (self.cornerLocal[corners] + k) % counts[corners]
+            pairSrc.append(self.faceIndices[corners])
+            pairDst.append(self.faceIndices[opposite])
+
+        if pairSrc:
+            pairSrc = np.concatenate(pairSrc)
+            pairDst = np.concatenate(pairDst)
+            pairs = uniqueSorted(pairSrc * self.vtxCount + pairDst)
+            pairSrc = pairs // self.vtxCount
+            pairDst = pairs % self.vtxCount
+            keep = pairSrc != pairDst
+            keys = self.edgeKeys(pairSrc , pairDst)
+            found = np.searchsorted(self.edgeKeysSorted , keys)
+            found = np.minimum(found , max(self.edgeCount - 1 , 0))
+            if self.edgeCount:
+                keep &= self.edgeKeysSorted[found] != keys
+            pairSrc = pairSrc[keep]
+            pairDst = pairDst[keep]
+        else:
+            pairSrc = pairDst = np.zeros(0 , dtype=np.int64)
+
+        self.vtxDiagonalOffsets , self.vtxDiagonal = buildCsr(pairSrc , pairDst , self.vtxCount)
+
+    def connected(self , vtxId):
+        return self.vtxVtx[self.vtxVtxOffsets[vtxId]:self.vtxVtxOffsets[vtxId + 1]]
+
+    def diagonal(self , vtxId):
+        return self.vtxDiagonal[self.vtxDiagonalOffsets[vtxId]:self.vtxDiagonalOffsets[vtxId + 1]]
+
+
+def extractFaces(faceCounts , faceIndices , faceIds):
+    # Sub mesh of the given faces: counts, indices into the kept vertices, kept vertex ids (ascending) and the
+    # corner ids the sub mesh corners come from
+    faceCounts = np.asarray(faceCounts , dtype=np.int64)
+    faceOffsets = np.zeros(len(faceCounts) + 1 , dtype=np.int64)
+    np.cumsum(faceCounts , out=faceOffsets[1:])
+    corners , _ = gatherCsr(faceOffsets , np.arange(faceOffsets[-1]) , faceIds)
+    indices = np.asarray(faceIndices , dtype=np.int64)[corners]
+    vtxIds , indices = np.unique(indices , return_inverse=True)
+    return faceCounts[faceIds] , indices.reshape(-1) , vtxIds , corners
+
+
+def findShells(topology):
+    # Union-find over the edges: hook the larger root under the smaller one, then jump pointers to the roots.
+    # Returns the shell id of every vertex and the shell count, shells are numbered by their lowest vertex.
+    parent = np.arange(topology.vtxCount)
+    a = topology.edgeVertices[: , 0]
+    b = topology.edgeVertices[: , 1]
+    while True:
+        while True:
+            grandParent = parent[parent]
+            if (grandParent == parent).all():
+                break
+            parent = grandParent
+
+        rootA = parent[a]
+        rootB = parent[b]
+        differ = rootA != rootB
+        if not differ.any():
+            break
+        a = a[differ]
+        b = b[differ]
+        np.minimum.at(parent , np.maximum(rootA[differ] , rootB[differ]) , np.minimum(rootA[differ] , rootB[differ]))
+
+    roots , vtxShell = np.unique(parent , return_inverse=True)
+    return vtxShell.reshape(-1) , len(roots)
+
+
+def findStartVertices(topology , vtxShell=None , shellCount=1):
+    # Per shell: first vertex of valence 2, then > 4, then interior 3, then boundary 3, else its first vertex
+    if vtxShell is None:
+        vtxShell = np.zeros(topology.vtxCount , dtype=np.int64)
+    valence = topology.valence
+    boundary = topology.vtxBoundary
+    rank = np.full(topology.vtxCount , 4 , dtype=np.int8)
+    rank[(valence == 3) & boundary] = 3
+    rank[(valence == 3) & ~boundary] = 2
+    rank[valence > 4] = 1
+    rank[valence == 2] = 0
+
+    order = np.lexsort((np.arange(topology.vtxCount) , rank , vtxShell))
+    first = np.searchsorted(vtxShell[order] , np.arange(shellCount))
+    return order[first[first < len(order)]]
+
+
+class PreflightReport(object):
+    # Everything checked before reconstructing, from one pass over the face and edge arrays
+
+    def __init__(self , topology):
+        self.topology = topology
+        self.vtxCount = topology.vtxCount
+        self.faceCount = topology.faceCount
+        self.edgeCount = topology.edgeCount
+        self.edgeVertices = topology.edgeVertices
+        self.nonQuadFaces = np.flatnonzero(topology.faceCounts != 4)
+        self.valence = topology.valence
+        self.vtxBoundary = topology.vtxBoundary
+        with getProfiler().phase('shells'):
+            self.vtxShell , self.shellCount = findShells(self)
+            self.startVertices = findStartVertices(self , self.vtxShell , self.shellCount)
+
+    @property
+    def isQuad(self):
+        return not len(self.nonQuadFaces)
+
+    def asDict(self , limit=100):
+        valences , counts = np.unique(self.valence , return_counts=True)
+        return {
+            'vertices': self.vtxCount ,
+            'faces': self.faceCount ,
+            'edges': self.edgeCount ,
+            'shells': self.shellCount ,
+            'nonQuadCount': len(self.nonQuadFaces) ,
+            'nonQuadFaces': self.nonQuadFaces[:limit].tolist() ,
+            'boundaryVertices': int(self.vtxBoundary.sum()) ,
+            'valence': dict((str(v) , int(c)) for v , c in zip(valences , counts)) ,
+            'startVertices': self.startVertices[:limit].tolist()
+        }
+
+    def message(self):
+        if not self.isQuad:
+            return 'Found {0} non quad face(s)'.format(len(self.nonQuadFaces))
+        return '{0} vertices, {1} faces, {2} shell(s)'.format(self.vtxCount , self.faceCount , self.shellCount)
+
+
+def preflight(faceCounts , faceIndices , vtxCount=None):
+    # The report keeps its topology, call report.topology.buildAdjacency() to reconstruct without re-reading
+    with getProfiler().phase('validation'):
+        return PreflightReport(MeshTopology(faceCounts , faceIndices , vtxCount , adjacency=False))
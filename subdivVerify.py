@@ -0,0 +1,85 @@
+import numpy as np
+
+from subdivForward import subdivide
+from subdivProfile import getProfiler
+
+
+def topologyMatch(faceCounts , faceIndices , vtxCount , fineCorners , resubIndices , resubCount):
+    # Input vertex -> re-subdivided vertex. Coarse corner c becomes quad c of the re-subdivided mesh (vertex, next
+    # edge point, face point, previous edge point), the same quad of the input starts at its fine corner. None
+    # unless that maps the input vertices one to one.
+    faceCounts = np.asarray(faceCounts , dtype=np.int64)
+    faceIndices = np.asarray(faceIndices , dtype=np.int64)
+    if len(fineCorners) != len(faceCounts) or vtxCount != resubCount:
+        return None
+    faceOffsets = np.zeros(len(faceCounts) + 1 , dtype=np.int64)
+    np.cumsum(faceCounts , out=faceOffsets[1:])
+    faces = np.searchsorted(faceOffsets , fineCorners , side='right') - 1
+    if (faceCounts[faces] != 4).any() or np.bincount(faces , minlength=len(faceCounts)).max() > 1:
+        return None
+
+    base = faceOffsets[faces]
+    quads = faceIndices[base[: , None] + ((fineCorners - base)[: , None] + np.arange(4)) % 4]
+    resubQuads = np.asarray(resubIndices , dtype=np.int64).reshape(-1 , 4)
+    mapping = np.full(vtxCount , -1 , dtype=np.int64)
+    mapping[quads.reshape(-1)] = resubQuads.reshape(-1)
+    if (mapping < 0).any() or (mapping[quads] != resubQuads).any():
+        return None
+    if np.bincount(mapping , minlength=resubCount).max() > 1:
+        return None
+    return mapping
+
+
+def nearestDistances(points , resubPoints):
+    # Both ways, so missing and extra geometry both count
+    from scipy.spatial import cKDTree
+    there , _ = cKDTree(resubPoints).query(points)
+    back , _ = cKDTree(points).query(resubPoints)
+    return np.concatenate([there , back])
+
+
+class Verification(object):
+    # Distances between the input and the re-subdivided reconstruction, errors relative to the input's
+    # bounding box diagonal are comparable between assets
+
+    def __init__(self , distances , method , extent):
+        self.method = method
+        self.extent = float(extent)
+        self.maxError = float(distances.max()) if len(distances) else 0.0
+        self.rmsError = float(np.sqrt(np.mean(distances ** 2))) if len(distances) else 0.0
+
+    @property
+    def relativeError(self):
+        return self.maxError / self.extent if self.extent > 0 else self.maxError
+
+    def passed(self , tolerance):
+        return self.relativeError <= tolerance
+
+    def asDict(self):
+        return {
+            'method': self.method ,
+            'maxError': self.maxError ,
+            'rmsError': self.rmsError ,
+            'relativeError': self.relativeError
+        }
+
+    def message(self):
+        return 'max error {0:.3g}, rms {1:.3g} ({2})'.format(self.maxError , self.rmsError , self.method)
+
+
+def verifyReconstruction(faceCounts , faceIndices , points , coarseCounts , coarseIndices , coarsePoints , levels=1 ,
+                         fineCorners=None , sharpCorners=True):
+    # Subdivide the reconstruction again and measure how far it lands from the input. One level with fineCorners
+    # compares vertex to vertex, anything else falls back to nearest neighbours (needs scipy).
+    points = np.asarray(points , dtype=np.float64)
+    with getProfiler().phase('verify'):
+        resubCounts , resubIndices , resubPoints = subdivide(coarseCounts , coarseIndices , coarsePoints , levels ,
+                                                             sharpCorners)
+        extent = float(np.linalg.norm(points.max(axis=0) - points.min(axis=0))) if len(points) else 0.0
+        mapping = None
+        if levels == 1 and fineCorners is not None:
+            mapping = topologyMatch(faceCounts , faceIndices , len(points) , fineCorners , resubIndices ,
+                                    len(resubPoints))
+        if mapping is not None:
+            return Verification(np.linalg.norm(points - resubPoints[mapping] , axis=1) , 'topology' , extent)
+        return Verification(nearestDistances(points , resubPoints) , 'nearest' , extent)
@@ -0,0 +1,64 @@
+import numpy as np
+
+from meshes import torus
+from subdivIO import ArrayPointBackend , PointIO , readObj , writeObj
+
+
+def testPointRoundTrip():
+    points = np.random.RandomState(0).normal(size=(50 , 3))
+    backend = ArrayPointBackend(points)
+    pointIO = PointIO(backend)
+    read = pointIO.read()
+    assert read.dtype == np.float64 and read.flags['C_CONTIGUOUS']
+    assert np.array_equal(read , points)
+    pointIO.write(read * 2)
+    assert np.array_equal(pointIO.read() , points * 2)
+    assert (backend.reads , backend.writes) == (2 , 1)
+
+
+def testPointReadDropsExtraColumns():
+    # Homogeneous (x , y , z , w) buffers like Maya's MPointArray
+    class HomogeneousBackend(object):
+
+        def getPointBuffer(self):
+            return np.arange(8 , dtype=np.float32).reshape(2 , 4)
+
+    assert PointIO(HomogeneousBackend()).read().tolist() == [[0 , 1 , 2] , [4 , 5 , 6]]
+
+
+def testObjRoundTrip(tmp_path):
+    points , counts , indices = torus(6 , 4)
+    points = points + np.random.RandomState(1).normal(scale=1e-3 , size=points.shape)
+    # Mixed face sizes: a triangle and a pentagon at the end
+    counts = np.concatenate([counts , [3 , 5]])
+    indices = np.concatenate([indices , [0 , 1 , 2 , 3 , 4 , 5 , 6 , 7]])
+    path = str(tmp_path / 'mesh.obj')
+    writeObj(path , points , counts , indices)
+    for chunkSize in (1 << 23 , 256):
+        readPoints , readCounts , readIndices = readObj(path , chunkSize=chunkSize)
+        assert np.array_equal(readPoints , points)
+        assert np.array_equal(readCounts , counts)
+        assert np.array_equal(readIndices , indices)
+
+
+def testObjRecords(tmp_path):
+    # Texture / normal indices, negative indices, indented records, comments and blank lines
+    text = ('# square\n'
+            'v 0 0 0\n'
+            '  v 1 0 0\n'
+            '\tv 1 1 0\n'
+            'vt 0 0\n'
+            'vn 0 0 1\n'
+            '\n'
+            'v 0 1 0 1.0\n'
+            '  f -4/1 -3/1/1 -2//1 -1\n'
+            'v 2 0 0\n'
+            'f 2/1/1 5 3\n'
+            'f -1 -4 -3\n')
+    path = tmp_path / 'records.obj'
+    path.write_bytes(text.encode('ascii'))
+    for chunkSize in (1 << 23 , 16):
+        points , counts , indices = readObj(str(path) , chunkSize=chunkSize)
+        assert points.tolist() == [[0 , 0 , 0] , [1 , 0 , 0] , [1 , 1 , 0] , [0 , 1 , 0] , [2 , 0 , 0]]
+        assert counts.tolist() == [4 , 3 , 3]
+        assert indices.tolist() == [0 , 1 , 2 , 3 , 1 , 4 , 2 , 4 , 1 , 2]
@@ -0,0 +1,26 @@
+import numpy as np
+
+from meshes import torus
+from subdivCore import unsubdivide
+from subdivForward import subdivide
+from subdivOutOfCore import storeArrays , unsubdivideOutOfCore
+
+
+def testMatchesInCore(tmp_path):
+    # Two levels in chunks much smaller than the mesh give the same arrays as the in-core path
+    coarsePoints , coarseCounts , coarseIndices = torus(6 , 4)
+    faceCounts , faceIndices , points = subdivide(coarseCounts , coarseIndices , coarsePoints , 2)[:3]
+    counts , indices , expected , _ , levels = unsubdivide(faceCounts , faceIndices , points , levels=2)
+    assert levels == 2
+
+    result = unsubdivideOutOfCore(storeArrays(faceCounts , faceIndices , points , str(tmp_path)) , levels=2 ,
+                                  chunk=100)
+    try:
+        assert result.levels == 2
+        resultCounts , resultIndices , resultPoints = [np.array(array) for array in result.arrays()]
+    finally:
+        result.store.close()
+    assert np.array_equal(resultCounts , counts)
+    assert np.array_equal(resultIndices , indices)
+    assert np.allclose(resultPoints , expected , atol=1e-12)
+    assert np.allclose(resultPoints , coarsePoints , atol=1e-12)
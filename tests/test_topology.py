@@ -0,0 +1,53 @@
+import numpy as np
+
+from meshes import grid , torus
+from subdivTopology import MeshTopology , findShells , preflight
+
+
+def testGridAdjacency():
+    # 2 x 2 quads, vertex 4 in the middle
+    _ , counts , indices = grid(2)
+    topology = MeshTopology(counts , indices)
+    assert topology.vtxCount == 9
+    assert topology.edgeCount == 12
+    assert sorted(topology.connected(4)) == [1 , 3 , 5 , 7]
+    assert sorted(topology.diagonal(4)) == [0 , 2 , 6 , 8]
+    assert sorted(topology.connected(0)) == [1 , 3]
+    assert len(topology.diagonal(1)) == 2
+    assert topology.valence.tolist() == [2 , 3 , 2 , 3 , 4 , 3 , 2 , 3 , 2]
+    assert topology.vtxBoundary.tolist() == [True] * 4 + [False] + [True] * 4
+
+
+def testCsrRowsMatchEdges():
+    _ , counts , indices = torus(5 , 3)
+    topology = MeshTopology(counts , indices)
+    assert topology.vtxVtxOffsets[-1] == 2 * topology.edgeCount
+    for vtx in range(topology.vtxCount):
+        edges = topology.edgeVertices[(topology.edgeVertices == vtx).any(axis=1)]
+        assert sorted(topology.connected(vtx)) == sorted(edges[edges != vtx].tolist())
+        corners = topology.vtxCorner[topology.vtxCornerOffsets[vtx]:topology.vtxCornerOffsets[vtx + 1]]
+        assert (topology.faceIndices[corners] == vtx).all()
+    assert (topology.valence == 4).all()
+    assert not topology.vtxBoundary.any()
+
+
+def testFindShells():
+    # A torus and a grid after it, shells are numbered by their lowest vertex
+    torusPoints , torusCounts , torusIndices = torus(4)
+    _ , gridCounts , gridIndices = grid(3)
+    counts = np.concatenate([gridCounts , torusCounts])
+    indices = np.concatenate([gridIndices + len(torusPoints) , torusIndices])
+    vtxShell , shellCount = findShells(MeshTopology(counts , indices))
+    assert shellCount == 2
+    assert (vtxShell[:len(torusPoints)] == 0).all()
+    assert (vtxShell[len(torusPoints):] == 1).all()
+
+
+def testPreflightReport():
+    _ , counts , indices = grid(2)
+    report = preflight(np.concatenate([counts , [3]]) , np.concatenate([indices , [0 , 1 , 4]]) , 9)
+    assert report.shellCount == 1
+    assert report.nonQuadFaces.tolist() == [4]
+    assert not report.isQuad
+    # The triangle gives corner 0 a third edge, corner 2 is the first valence 2 vertex
+    assert report.startVertices.tolist() == [2]